@@ -0,0 +1,102 @@
+"""Benchmark the aggregation of nfldb scores.
+
+Compares the vectorized ``nflwin.utilities._aggregate_nfldb_scores`` against
+the original row-by-row implementation on synthetic play-by-play data, and
+makes sure both produce the same result.
+
+Usage::
+
+  $ python benchmarks/aggregate_scores.py [--num-plays 1000000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from nflwin import utilities
+
+
+def make_synthetic_plays(num_plays, plays_per_game=160, seed=0):
+    """Make a DataFrame that looks like the raw output of the nfldb query."""
+    random_state = np.random.RandomState(seed)
+    game_numbers = np.arange(num_plays) // plays_per_game
+    home_is_offense = random_state.rand(num_plays) > 0.5
+    offense_play_points = random_state.choice([0, 1, 2, 3, 6], size=num_plays,
+                                              p=[0.93, 0.015, 0.005, 0.02, 0.03])
+    defense_play_points = random_state.choice([0, 2, 6], size=num_plays,
+                                              p=[0.995, 0.002, 0.003])
+    return pd.DataFrame({
+        "gsis_id": ["{0:010d}".format(game_number) for game_number in game_numbers],
+        "yardline": random_state.randint(-49, 50, size=num_plays).astype(np.float64),
+        "offense_team": np.where(home_is_offense, "HOME", "AWAY"),
+        "home_team": "HOME",
+        "away_team": "AWAY",
+        "offense_play_points": offense_play_points,
+        "defense_play_points": defense_play_points,
+        })
+
+
+def rowwise_aggregate_nfldb_scores(play_df):
+    """The original, row-by-row implementation of ``_aggregate_nfldb_scores``."""
+    play_df['next_yardline'] = play_df['yardline'].shift(-1)
+    argdict = {"curr_home_score": 0, "curr_away_score": 0, "curr_gsis_id": play_df.iloc[0].gsis_id}
+
+    def compute_current_scores(play, argdict):
+        if play.gsis_id != argdict['curr_gsis_id']:
+            argdict['curr_home_score'] = 0
+            argdict['curr_away_score'] = 0
+            argdict['curr_gsis_id'] = play.gsis_id
+
+        home_score_to_return = argdict['curr_home_score']
+        away_score_to_return = argdict['curr_away_score']
+
+        if play.offense_play_points == 6 and play.next_yardline < 0:
+            play.offense_play_points += 1
+        if play.defense_play_points == 6 and play.next_yardline < 0:
+            play.defense_play_points += 1
+
+        if play.offense_team == play.home_team:
+            argdict['curr_home_score'] += play.offense_play_points
+            argdict['curr_away_score'] += play.defense_play_points
+        else:
+            argdict['curr_home_score'] += play.defense_play_points
+            argdict['curr_away_score'] += play.offense_play_points
+        return home_score_to_return, away_score_to_return
+
+    aggregate_scores = play_df.apply(compute_current_scores, axis=1, args=(argdict,))
+    aggregate_scores = pd.DataFrame(aggregate_scores.values.tolist())
+    play_df[['curr_home_score', 'curr_away_score']] = aggregate_scores
+
+    play_df.drop(labels=["next_yardline", "offense_play_points", "defense_play_points"],
+                 axis=1, inplace=True)
+
+    return play_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-plays", type=int, default=1000000,
+                        help="How many plays to aggregate.")
+    args = parser.parse_args()
+
+    plays = make_synthetic_plays(args.num_plays)
+
+    start = time.time()
+    vectorized_df = utilities._aggregate_nfldb_scores(plays.copy())
+    vectorized_time = time.time() - start
+    print("Vectorized: {0:.2f}s for {1:d} plays".format(vectorized_time, args.num_plays))
+
+    start = time.time()
+    rowwise_df = rowwise_aggregate_nfldb_scores(plays.copy())
+    rowwise_time = time.time() - start
+    print("Row-wise: {0:.2f}s for {1:d} plays".format(rowwise_time, args.num_plays))
+
+    pd.util.testing.assert_frame_equal(vectorized_df, rowwise_df)
+    print("Outputs are identical, speedup is {0:.0f}x".format(rowwise_time / vectorized_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the lookup-table mappings in MapToInt and ComputeElapsedTime.
+
+Compares ``MapToInt`` and ``ComputeElapsedTime`` against the original
+``Series.replace``-based implementations on synthetic quarters, both as strings
+and as a categorical column, and makes sure the results are the same.
+
+Usage::
+
+  $ python benchmarks/categorical_mappings.py [--num-plays 1000000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from nflwin import preprocessing
+
+
+def replace_map_to_int(plays, mapping):
+    """The original implementation of ``MapToInt.transform``."""
+    plays = plays.copy()
+    plays["quarter"].replace(mapping, inplace=True)
+    return plays
+
+
+def replace_compute_elapsed_time(plays, quarter_to_second_mapping):
+    """The original implementation of ``ComputeElapsedTime.transform``."""
+    plays = plays.copy()
+    quarters = plays["quarter"]
+    if pd.api.types.is_categorical_dtype(quarters):
+        quarters = quarters.astype(object)
+    time_elapsed = quarters.replace(quarter_to_second_mapping) + plays["seconds_elapsed"]
+    plays["total_elapsed_time"] = time_elapsed.astype(np.int64)
+    return plays
+
+
+def time_function(description, function, *args):
+    """Time a function call, returning its output."""
+    start = time.time()
+    output = function(*args)
+    print("{0}: {1:.3f}s".format(description, time.time() - start))
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-plays", type=int, default=1000000,
+                        help="How many plays to transform.")
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    plays = pd.DataFrame({
+        "quarter": random_state.choice(["Q1", "Q2", "Q3", "Q4", "OT"], size=args.num_plays,
+                                       p=[0.25, 0.25, 0.24, 0.25, 0.01]),
+        "seconds_elapsed": random_state.randint(0, 900, size=args.num_plays).astype(np.float64)})
+    categorical_plays = plays.copy()
+    categorical_plays["quarter"] = categorical_plays["quarter"].astype("category")
+
+    for description, data in [("strings", plays), ("categorical", categorical_plays)]:
+        map_to_int = preprocessing.MapToInt("quarter").fit(data)
+        replaced = time_function("MapToInt, replace ({0})".format(description),
+                                 replace_map_to_int, plays, map_to_int.mapping)
+        looked_up = time_function("MapToInt, lookup table ({0})".format(description),
+                                  map_to_int.transform, data)
+        np.testing.assert_array_equal(replaced["quarter"].values.astype(np.int64),
+                                      looked_up["quarter"].values)
+
+        elapsed_time = preprocessing.ComputeElapsedTime("quarter", "seconds_elapsed").fit(data)
+        replaced = time_function("ComputeElapsedTime, replace ({0})".format(description),
+                                 replace_compute_elapsed_time, data,
+                                 elapsed_time.quarter_to_second_mapping)
+        looked_up = time_function("ComputeElapsedTime, lookup table ({0})".format(description),
+                                  elapsed_time.transform, data)
+        np.testing.assert_array_equal(replaced["total_elapsed_time"].values,
+                                      looked_up["total_elapsed_time"].values)
+
+    print("Outputs are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark the peak memory of scoring plays all at once and in chunks.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+then scores increasingly large batches of plays with ``predict_wp``, both in one
+shot and with ``chunksize``, reporting the time and the peak memory allocated
+(according to ``tracemalloc``) for each.
+
+Usage::
+
+  $ python benchmarks/chunked_predict.py [--chunksize 50000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from nflwin import model, nfldb_sqlite, utilities
+
+
+def score(wpmodel, plays, chunksize):
+    """Score the plays, returning the predictions, time taken, and peak memory allocated."""
+    tracemalloc.start()
+    start = time.time()
+    win_probabilities = wpmodel.predict_wp(plays, chunksize=chunksize)
+    elapsed_time = time.time() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return win_probabilities, elapsed_time, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--chunksize", type=int, default=50000,
+                        help="How many plays to score at a time.")
+    parser.add_argument("--num-plays", type=int, nargs="+", default=[100000, 400000, 1600000],
+                        help="How many plays to score.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+    finally:
+        shutil.rmtree(temp_directory)
+
+    wpmodel = model.WPModel()
+    wpmodel.train_model(source_data=plays)
+
+    for num_plays in args.num_plays:
+        batch = pd.concat([plays] * (num_plays // len(plays) + 1),
+                          ignore_index=True).iloc[:num_plays]
+        input_memory = batch.memory_usage(deep=True).sum()
+        full_wp, full_time, full_memory = score(wpmodel, batch, None)
+        chunked_wp, chunked_time, chunked_memory = score(wpmodel, batch, args.chunksize)
+        print("{0:d} plays ({1:.0f} MB): all at once {2:.2f}s, {3:.0f} MB peak; "
+              "chunks of {4:d} {5:.2f}s, {6:.0f} MB peak".format(
+                  num_plays, input_memory / 1e6, full_time, full_memory / 1e6,
+                  args.chunksize, chunked_time, chunked_memory / 1e6))
+        np.testing.assert_allclose(chunked_wp, full_wp, rtol=1e-12, atol=1e-14)
+
+
+if __name__ == "__main__":
+    main()
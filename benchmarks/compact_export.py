@@ -0,0 +1,91 @@
+"""Benchmark loading an exported compact model against loading a pickled WPModel.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+saves it both with ``joblib`` (like ``WPModel.save_model``) and with
+``WPModel.export_compact``, then, in a fresh Python process for each, times
+importing NFLWin, loading the model and scoring one play. Reports the file
+sizes and cold-start times, and makes sure both give the same win probability.
+
+Usage::
+
+  $ python benchmarks/compact_export.py [--repeats 5]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from nflwin import model, nfldb_sqlite, utilities
+
+PICKLED_SCRIPT = """
+import timeit
+start = timeit.default_timer()
+from sklearn.externals import joblib
+wpmodel = joblib.load({filename!r})
+wp = wpmodel.predict_wp_single(**{play!r})
+print(repr(timeit.default_timer() - start), repr(wp))
+"""
+
+COMPACT_SCRIPT = """
+import timeit
+start = timeit.default_timer()
+from nflwin.compact import CompactWPModel
+compact_model = CompactWPModel.load({filename!r})
+wp = compact_model.predict_wp_single(**{play!r})
+print(repr(timeit.default_timer() - start), repr(wp))
+"""
+
+
+def time_cold_start(script, repeats):
+    """Run a script in new processes, returning the median time and the win probability it prints."""
+    package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for i in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=package_directory)
+        seconds, wp = output.decode("utf-8").split()[-2:]
+        times.append(float(seconds))
+    return np.median(times), float(wp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="How many processes to time for each kind of model.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+
+        wpmodel = model.WPModel()
+        wpmodel.train_model(source_data=plays)
+        play = dict((colname, value.item() if isinstance(value, np.generic) else value)
+                    for colname, value in plays[wpmodel.required_columns].iloc[0].to_dict().items())
+
+        pickled_filename = os.path.join(temp_directory, "model.nflwin")
+        from sklearn.externals import joblib
+        joblib.dump(wpmodel, pickled_filename)
+        compact_filename = os.path.join(temp_directory, "model.npz")
+        wpmodel.export_compact(compact_filename)
+
+        for description, filename, script in [
+                ("pickled WPModel", pickled_filename, PICKLED_SCRIPT),
+                ("exported compact model", compact_filename, COMPACT_SCRIPT)]:
+            seconds, wp = time_cold_start(script.format(filename=filename, play=play), args.repeats)
+            print("{0}: {1:.1f} kB, import + load + score one play {2:.0f}ms (wp={3:.6f})".format(
+                description, os.path.getsize(filename) / 1e3, seconds * 1e3, wp))
+            np.testing.assert_allclose(wp, wpmodel.predict_wp_single(**play), rtol=1e-12)
+    finally:
+        shutil.rmtree(temp_directory)
+
+
+if __name__ == "__main__":
+    main()
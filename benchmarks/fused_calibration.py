@@ -0,0 +1,89 @@
+"""Benchmark scoring plays with a model fused by ``WPModel.fuse_model``.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+fuses a copy of it with ``WPModel.fuse_model`` (checking it against the
+original on the plays), and makes another copy with only the preprocessing
+compiled (``nflwin.preprocessing.compile_pipeline``), to tell the two parts of
+fusing apart. Then times all of ``predict_wp`` for each model, and the final
+step of the original and fused models on its own, on one play at a time and on
+batches of plays.
+
+Usage::
+
+  $ python benchmarks/fused_calibration.py [--num-single-plays 2000] [--num-plays 200000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import copy
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from nflwin import model, nfldb_sqlite, preprocessing, utilities
+
+
+def time_per_call(function, arguments):
+    """Call a function on each argument, returning the median seconds per call."""
+    seconds = []
+    for argument in arguments:
+        start = timeit.default_timer()
+        function(argument)
+        seconds.append(timeit.default_timer() - start)
+    return np.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-single-plays", type=int, default=2000,
+                        help="How many plays to score one at a time.")
+    parser.add_argument("--num-plays", type=int, default=200000,
+                        help="How many plays to score in a batch.")
+    parser.add_argument("--num-batches", type=int, default=5,
+                        help="How many times to score the batch.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+    finally:
+        shutil.rmtree(temp_directory)
+
+    wpmodel = model.WPModel()
+    wpmodel.train_model(source_data=plays)
+    fused_model = copy.copy(wpmodel)
+    max_difference = fused_model.fuse_model(check_plays=plays)
+    print("largest difference from the original on {0} plays: {1:.3g}".format(len(plays),
+                                                                           max_difference))
+    compiled_model = copy.copy(wpmodel)
+    compiled_model.model = preprocessing.compile_pipeline(wpmodel.model)
+
+    plays = plays[wpmodel.required_columns]
+    batch = pd.concat([plays] * (args.num_plays // len(plays) + 1),
+                      ignore_index=True).iloc[:args.num_plays]
+    single_plays = [plays.iloc[[i]] for i in range(min(args.num_single_plays, len(plays)))]
+    features = Pipeline(wpmodel.model.steps[:-1]).transform(batch)
+    single_features = [features.iloc[[i]] for i in range(len(single_plays))]
+
+    for description, wp_model in [("original", wpmodel), ("preprocessing compiled", compiled_model),
+                                  ("fused", fused_model)]:
+        classifier = wp_model.model.steps[-1][1]
+        print("{0}:".format(description))
+        if wp_model is not compiled_model:
+            print("  final step: {0:.0f}us per play one at a time, {1:.0f} plays/s in batches".format(
+                time_per_call(classifier.predict_proba, single_features) * 1e6,
+                len(batch) / time_per_call(classifier.predict_proba, [features] * args.num_batches)))
+        print("  predict_wp: {0:.0f}us per play one at a time, {1:.0f} plays/s in batches".format(
+            time_per_call(wp_model.predict_wp, single_plays) * 1e6,
+            len(batch) / time_per_call(wp_model.predict_wp, [batch] * args.num_batches)))
+
+
+if __name__ == "__main__":
+    main()
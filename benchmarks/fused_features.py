@@ -0,0 +1,65 @@
+"""Benchmark the fused feature builder against the step-by-step default pipeline.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+then times computing the model features for a large batch of plays with the
+fitted preprocessing steps one after the other and with
+``nflwin.preprocessing.compile_pipeline``, making sure the results are bit-identical.
+
+Usage::
+
+  $ python benchmarks/fused_features.py [--num-plays 500000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from nflwin import model, nfldb_sqlite, preprocessing, utilities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-plays", type=int, default=500000,
+                        help="How many plays to compute features for.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+    finally:
+        shutil.rmtree(temp_directory)
+
+    wpmodel = model.WPModel()
+    wpmodel.train_model(source_data=plays)
+    plays = pd.concat([plays] * (args.num_plays // len(plays) + 1),
+                      ignore_index=True).iloc[:args.num_plays]
+
+    start = time.time()
+    stepwise_features = plays
+    for name, step in wpmodel.model.steps[:-1]:
+        stepwise_features = step.transform(stepwise_features)
+    stepwise_features = np.asarray(stepwise_features, dtype=np.float64)
+    stepwise_time = time.time() - start
+    print("Step-by-step: {0:.2f}s for {1:d} plays".format(stepwise_time, len(plays)))
+
+    compiled_model = preprocessing.compile_pipeline(wpmodel.model)
+    feature_builder = compiled_model.named_steps["build_features"]
+    start = time.time()
+    fused_features = feature_builder.transform(plays)
+    fused_time = time.time() - start
+    print("Fused: {0:.2f}s for {1:d} plays".format(fused_time, len(plays)))
+
+    np.testing.assert_array_equal(fused_features.view(np.int64), stepwise_features.view(np.int64))
+    print("Features are bit-identical, speedup is {0:.1f}x".format(stepwise_time / fused_time))
+
+
+if __name__ == "__main__":
+    main()
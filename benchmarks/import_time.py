@@ -0,0 +1,118 @@
+"""Benchmark how long it takes to import NFLWin and start scoring plays.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``)
+and saves it, then, in fresh Python processes, times:
+
+* importing ``nflwin.model``;
+* importing it, loading the saved model and scoring one play with ``predict_wp``
+  (a short-lived scoring job);
+* validating the model, which needs the statistics modules that scoring doesn't.
+
+For each, reports the fastest wall time of several runs and how many modules
+were imported. With ``--importtime`` (Python 3.7+), also prints the modules
+that took the longest to import, from ``python -X importtime``.
+
+Usage::
+
+  $ python benchmarks/import_time.py [--repeats 7] [--importtime]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from nflwin import model, nfldb_sqlite, utilities
+
+IMPORT_SCRIPT = """
+import timeit
+start = timeit.default_timer()
+import nflwin.model
+seconds = timeit.default_timer() - start
+"""
+
+SCORE_SCRIPT = """
+import timeit
+start = timeit.default_timer()
+import pandas as pd
+from nflwin.model import WPModel
+WPModel.model_directory = {directory!r}
+wpmodel = WPModel.load_model("benchmark.nflwin")
+wpmodel.predict_wp(pd.read_csv({plays_filename!r}))
+seconds = timeit.default_timer() - start
+"""
+
+VALIDATE_SCRIPT = SCORE_SCRIPT.replace("wpmodel.predict_wp(",
+                                       "wpmodel.validate_model(source_data=")
+
+REPORT = """
+import sys
+print(repr(seconds), len(sys.modules))
+"""
+
+
+def time_script(script, repeats, package_directory):
+    """Run a script in new processes, returning the fastest time and the number of modules."""
+    times = []
+    for i in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", script + REPORT],
+                                         cwd=package_directory).decode("utf-8").split()
+        times.append(float(output[-2]))
+    return min(times), int(output[-1])
+
+
+def print_slowest_imports(script, package_directory, num_modules=10):
+    """Print the modules with the largest cumulative import times."""
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", script],
+                               cwd=package_directory, stderr=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    stderr = process.communicate()[1].decode("utf-8")
+    imports = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_time, cumulative_time, name = line[len("import time:"):].split("|")
+            if cumulative_time.strip().isdigit():
+                imports.append((int(cumulative_time), name.rstrip()))
+    for cumulative_time, name in sorted(imports, reverse=True)[:num_modules]:
+        print("    {0:7.1f}ms {1}".format(cumulative_time / 1e3, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeats", type=int, default=7,
+                        help="How many processes to time for each case.")
+    parser.add_argument("--importtime", action="store_true",
+                        help="Also print the slowest imports (needs Python 3.7+).")
+    args = parser.parse_args()
+    package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=16, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+        wpmodel = model.WPModel()
+        wpmodel.train_model(source_data=plays)
+        model.WPModel.model_directory = temp_directory
+        wpmodel.save_model(filename="benchmark.nflwin")
+        plays_filename = os.path.join(temp_directory, "plays.csv")
+        plays.to_csv(plays_filename, index=False)
+
+        for description, script in [
+                ("import nflwin.model", IMPORT_SCRIPT),
+                ("import, load_model and predict_wp", SCORE_SCRIPT),
+                ("import, load_model and validate_model", VALIDATE_SCRIPT)]:
+            script = script.format(directory=temp_directory, plays_filename=plays_filename)
+            seconds, num_modules = time_script(script, args.repeats, package_directory)
+            print("{0}: {1:.0f}ms, {2} modules".format(description, seconds * 1e3, num_modules))
+            if args.importtime:
+                print_slowest_imports(script, package_directory)
+    finally:
+        shutil.rmtree(temp_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark building and scoring plays with a win probability lookup table.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+builds a ``WPLookupTable`` over ``nflwin.lookup.DEFAULT_GRID`` (checking it
+against the model on the plays), then compares scoring the plays in a batch
+and one at a time with the table, ``predict_wp`` and ``predict_wp_single``.
+
+Usage::
+
+  $ python benchmarks/lookup_table.py [--n-jobs 1] [--num-plays 200000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from nflwin import lookup, model, nfldb_sqlite, utilities
+
+
+def time_function(function, *args, **kwargs):
+    """Call a function once, returning its output and the seconds it took."""
+    start = timeit.default_timer()
+    output = function(*args, **kwargs)
+    return output, timeit.default_timer() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n-jobs", type=int, default=1,
+                        help="How many jobs to build the table with.")
+    parser.add_argument("--num-plays", type=int, default=200000,
+                        help="How many plays to score in a batch.")
+    parser.add_argument("--num-single-plays", type=int, default=5000,
+                        help="How many plays to score one at a time.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+
+        wpmodel = model.WPModel()
+        wpmodel.train_model(source_data=plays)
+        table, seconds = time_function(wpmodel.build_lookup_table,
+                                       directory=os.path.join(temp_directory, "table"),
+                                       check_plays=plays, n_jobs=args.n_jobs)
+        print("built {0} table ({1:.0f} MB) in {2:.1f}s: max error {3:.4f}, mean error {4:.5f}".format(
+            "x".join(str(size) for size in table.table.shape), table.table.nbytes / 1e6,
+            seconds, table.max_error, table.mean_error))
+        table = lookup.WPLookupTable.load(os.path.join(temp_directory, "table"))
+
+        batch = pd.concat([plays] * (args.num_plays // len(plays) + 1),
+                          ignore_index=True).iloc[:args.num_plays][wpmodel.required_columns]
+        for description, function in [("predict_wp", wpmodel.predict_wp),
+                                      ("lookup table", table.predict_wp)]:
+            wp, seconds = time_function(function, batch)
+            print("{0}, batch of {1} plays: {2:.0f} plays/s".format(
+                description, len(batch), len(batch) / seconds))
+
+        records = batch.iloc[:args.num_single_plays].to_dict("records")
+        wpmodel.predict_wp_single(**records[0])
+        for description, function in [("predict_wp_single", wpmodel.predict_wp_single),
+                                      ("lookup table, single play", table.predict_wp_single)]:
+            latencies = []
+            for record in records:
+                latencies.append(time_function(function, **record)[1])
+            print("{0}: median {1:.1f}us, p99 {2:.1f}us".format(
+                description, np.median(latencies) * 1e6, np.percentile(latencies, 99) * 1e6))
+    finally:
+        shutil.rmtree(temp_directory)
+
+
+if __name__ == "__main__":
+    main()
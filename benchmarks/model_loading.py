@@ -0,0 +1,58 @@
+"""Benchmark loading saved models with ``load_model`` and ``get_model``.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+saves it to a temporary model directory, then times asking for it many times
+(as a request handler would) with ``load_model``, which reads and unpickles
+the file every time, and with ``get_model``, which loads it once into the
+process-wide registry, with and without memory-mapping.
+
+Usage::
+
+  $ python benchmarks/model_loading.py [--num-loads 200]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from nflwin import model, nfldb_sqlite, utilities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-loads", type=int, default=200,
+                        help="How many times to ask for the model.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+
+        wpmodel = model.WPModel()
+        wpmodel.train_model(source_data=plays)
+        model.WPModel.model_directory = temp_directory
+        wpmodel.save_model(filename="benchmark.nflwin")
+
+        for description, load in [
+                ("load_model", lambda: model.WPModel.load_model("benchmark.nflwin")),
+                ("load_model(mmap_mode='r')",
+                 lambda: model.WPModel.load_model("benchmark.nflwin", mmap_mode="r")),
+                ("get_model", lambda: model.WPModel.get_model("benchmark.nflwin")),
+                ("get_model(mmap_mode=None)",
+                 lambda: model.WPModel.get_model("benchmark.nflwin", mmap_mode=None))]:
+            model.model_registry.clear()
+            first_seconds = timeit.timeit(load, number=1)
+            seconds = timeit.timeit(load, number=args.num_loads) / args.num_loads
+            print("{0}: first {1:.1f}ms, then {2:.3f}ms per call".format(
+                description, first_seconds * 1e3, seconds * 1e3))
+    finally:
+        shutil.rmtree(temp_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark the nfldb ingestion path against a synthetic SQLite database.
+
+Builds a stand-in for the nfldb database with ``nflwin.nfldb_sqlite``, then times
+``nflwin.utilities.get_nfldb_play_data`` (and its streaming equivalent) with
+different options, so the full ingestion path can be profiled without
+a Postgres server.
+
+Usage::
+
+  $ python benchmarks/nfldb_ingestion.py [--num-seasons 4] [--games-per-season 256]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from nflwin import nfldb_sqlite, utilities
+
+
+def time_ingestion(description, function, **kwargs):
+    """Time a call to one of the ingestion functions, returning its output."""
+    start = time.time()
+    plays_df = function(**kwargs)
+    if not isinstance(plays_df, pd.DataFrame):
+        plays_df = pd.concat(plays_df, ignore_index=True)
+    print("{0}: {1:.2f}s for {2:d} plays".format(description, time.time() - start, len(plays_df)))
+    return plays_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-seasons", type=int, default=4,
+                        help="How many seasons of games to generate.")
+    parser.add_argument("--games-per-season", type=int, default=256,
+                        help="How many regular season games to generate in each season.")
+    args = parser.parse_args()
+
+    season_years = list(range(2009, 2009 + args.num_seasons))
+    temp_directory = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    season_years=season_years,
+                                                    games_per_season=args.games_per_season,
+                                                    random_state=0)
+        print("Built database: {0:.2f}s".format(time.time() - start))
+
+        query_kwargs = {"season_years": season_years, "season_types": ["Regular"],
+                        "database_url": database_url}
+        time_ingestion("Scores aggregated in Python", utilities.get_nfldb_play_data, **query_kwargs)
+        time_ingestion("Scores aggregated in the database", utilities.get_nfldb_play_data,
+                       aggregate_scores_in_db=True, **query_kwargs)
+        time_ingestion("Seasons queried in parallel", utilities.get_nfldb_play_data,
+                       n_jobs=len(season_years), **query_kwargs)
+        time_ingestion("Compact dtypes", utilities.get_nfldb_play_data,
+                       compact_dtypes=True, **query_kwargs)
+        time_ingestion("Streamed in chunks", utilities.iter_nfldb_play_data, **query_kwargs)
+    finally:
+        shutil.rmtree(temp_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark the memory use of dense and sparse one-hot encodings.
+
+Encodes synthetic plays with the offensive and defensive team in each season
+as categorical features (the kind of encoding a custom model might use) with
+``OneHotEncoderFromDataFrame``, once with a dense DataFrame output and once with
+``sparse=True``, reporting the size of the output and the peak memory
+allocated while encoding and converting it into the array passed to the model.
+Then fits a ``LogisticRegression`` on each and makes sure they agree.
+
+Usage::
+
+  $ python benchmarks/onehot_memory.py [--num-plays 50000] [--num-seasons 15]
+"""
+from __future__ import division, print_function
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+from nflwin import preprocessing
+
+
+def encode(plays, sparse):
+    """Encode the plays, returning the model features and the peak memory allocated."""
+    encoder = preprocessing.OneHotEncoderFromDataFrame(
+        categorical_feature_names=["offense_team_season", "defense_team_season"], sparse=sparse)
+    encoder.fit(plays)
+    tracemalloc.start()
+    start = time.time()
+    features = encoder.transform(plays)
+    if not sparse:
+        features = np.asarray(features, dtype=np.float64)
+    elapsed_time = time.time() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return features, elapsed_time, peak_memory
+
+
+def get_nbytes(features):
+    """The number of bytes used by a dense or sparse matrix."""
+    if isinstance(features, np.ndarray):
+        return features.nbytes
+    return features.data.nbytes + features.indices.nbytes + features.indptr.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-plays", type=int, default=50000,
+                        help="How many plays to encode.")
+    parser.add_argument("--num-seasons", type=int, default=15,
+                        help="How many seasons the plays span.")
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    num_team_seasons = 32 * args.num_seasons
+    plays = pd.DataFrame({
+        "offense_team_season": random_state.randint(0, num_team_seasons, size=args.num_plays),
+        "defense_team_season": random_state.randint(0, num_team_seasons, size=args.num_plays),
+        "score_differential": random_state.randint(-21, 22, size=args.num_plays),
+        "total_elapsed_time": random_state.randint(0, 3600, size=args.num_plays),
+        "yardline": random_state.randint(-50, 50, size=args.num_plays)})
+    offense_won = (plays["score_differential"] + random_state.normal(0, 10, size=args.num_plays)) > 0
+
+    predictions = {}
+    for sparse in [False, True]:
+        description = "Sparse" if sparse else "Dense"
+        features, elapsed_time, peak_memory = encode(plays, sparse)
+        print("{0}: {1:d} features, {2:.1f} MB output, {3:.1f} MB peak, {4:.2f}s".format(
+            description, features.shape[1], get_nbytes(features) / 1e6, peak_memory / 1e6,
+            elapsed_time))
+
+        start = time.time()
+        classifier = LogisticRegression().fit(features, offense_won)
+        print("{0}: LogisticRegression fit in {1:.2f}s".format(description, time.time() - start))
+        predictions[sparse] = classifier.predict_proba(features)[:, 1]
+
+    print("Largest difference in predictions: {0:.2g}".format(
+        np.max(np.abs(predictions[True] - predictions[False]))))
+
+
+if __name__ == "__main__":
+    main()
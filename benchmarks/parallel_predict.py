@@ -0,0 +1,111 @@
+"""Benchmark scoring plays in parallel with ``predict_wp(n_jobs=...)``.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+then measures what scoring in parallel costs and saves:
+
+* the time per play of scoring in one process;
+* the fixed cost of a parallel call (dispatching the tasks to the pool of
+  workers, which is started before timing), from scoring a tiny batch;
+* the time per play the calling process spends sending the plays to the
+  workers (pickling them), which isn't spread across the jobs.
+
+From these it estimates, for each number of jobs, the batch size at which
+scoring in parallel starts to pay off and the most it can speed scoring up,
+which is where ``WPModel.min_plays_per_job`` comes from. Then it scores a large
+batch with each number of jobs, reporting the time and speedup over a single
+job. The speedup can't be more than the number of CPUs on the machine (which
+is printed first).
+
+Usage::
+
+  $ python benchmarks/parallel_predict.py [--num-plays 2000000] [--n-jobs 1 2 4 8]
+"""
+from __future__ import division, print_function
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from nflwin import model, nfldb_sqlite, utilities
+
+
+def best_time(function, repeats=5):
+    """The fastest of several runs of a function, in seconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-plays", type=int, default=2000000,
+                        help="How many plays to score.")
+    parser.add_argument("--n-jobs", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="The numbers of jobs to try.")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Score each partition in chunks of this size.")
+    args = parser.parse_args()
+    print("{0:d} CPUs".format(multiprocessing.cpu_count()))
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+    finally:
+        shutil.rmtree(temp_directory)
+
+    wpmodel = model.WPModel()
+    wpmodel.train_model(source_data=plays)
+    #(Each copy of the plays gets its own game ids, so games can be partitioned.)
+    num_copies = args.num_plays // len(plays) + 1
+    plays = pd.concat([plays.assign(gsis_id=plays["gsis_id"] + "_{0:d}".format(i))
+                       for i in range(num_copies)], ignore_index=True).iloc[:args.num_plays]
+
+    #The costs the threshold is based on (with every batch split into jobs):
+    wpmodel.min_plays_per_job = 1
+    sample = plays.iloc[:200000]
+    serial_time = best_time(lambda: wpmodel.predict_wp(sample)) / len(sample)
+    sending_time = best_time(lambda: pickle.dumps(sample[wpmodel.required_columns],
+                                                  pickle.HIGHEST_PROTOCOL)) / len(sample)
+    print("one job: {0:.2f}us per play".format(serial_time * 1e6))
+    print("sending plays to the workers: {0:.2f}us per play".format(sending_time * 1e6))
+    tiny_batch = plays.iloc[:64]
+    for n_jobs in args.n_jobs:
+        if n_jobs < 2:
+            continue
+        #(The first call starts the workers, which later calls reuse.)
+        wpmodel.predict_wp(tiny_batch, n_jobs=n_jobs)
+        fixed_cost = (best_time(lambda: wpmodel.predict_wp(tiny_batch, n_jobs=n_jobs)) -
+                      best_time(lambda: wpmodel.predict_wp(tiny_batch)))
+        saving = serial_time * (1 - 1 / n_jobs) - sending_time
+        if saving > 0:
+            break_even = "pays off above about {0:,.0f} plays ({1:,.0f} per job)".format(
+                fixed_cost / saving, fixed_cost / saving / n_jobs)
+        else:
+            break_even = "never pays off"
+        print("n_jobs={0:d}: {1:.1f}ms per call, {2}; at most {3:.2f}x".format(
+            n_jobs, fixed_cost * 1e3, break_even,
+            serial_time / (serial_time / n_jobs + sending_time)))
+
+    serial_time = None
+    serial_wp = None
+    for n_jobs in args.n_jobs:
+        start = timeit.default_timer()
+        win_probabilities = wpmodel.predict_wp(plays, chunksize=args.chunksize, n_jobs=n_jobs)
+        elapsed_time = timeit.default_timer() - start
+        if serial_time is None:
+            serial_time = elapsed_time
+            serial_wp = win_probabilities
+        np.testing.assert_allclose(win_probabilities, serial_wp, rtol=1e-12, atol=1e-14)
+        print("n_jobs={0:d}: {1:.2f}s for {2:d} plays ({3:.2f}x)".format(
+            n_jobs, elapsed_time, len(plays), serial_time / elapsed_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark the prediction cache of ``WPModel.predict_wp`` on repetitive live traffic.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+then simulates live requests: each asks for a small batch of plays, drawn
+from the plays with a skewed (Zipf) distribution so that some game states
+(and every request's most recent plays) come up over and over. Times serving
+the requests with and without a cache, reports the hit rate, and makes sure
+the answers agree. Then times scoring a large batch of distinct game states
+without a cache, with an empty cache (all misses) and with a cache that already
+holds them (all hits), which shows the cost of building and looking up the keys.
+
+Usage::
+
+  $ python benchmarks/prediction_cache.py [--num-requests 5000] [--cache-size 10000] [--batch-copies 20]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from nflwin import model, nfldb_sqlite, utilities
+
+
+def best_time(function, repeats=3):
+    """The fastest of several runs of a function, in seconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-requests", type=int, default=5000,
+                        help="How many requests to serve.")
+    parser.add_argument("--plays-per-request", type=int, default=8,
+                        help="How many plays each request asks for.")
+    parser.add_argument("--cache-size", type=int, default=10000,
+                        help="How many game states the cache holds.")
+    parser.add_argument("--zipf-exponent", type=float, default=1.3,
+                        help="How skewed the popularity of the plays is.")
+    parser.add_argument("--batch-copies", type=int, default=20,
+                        help="How many copies of the plays (with different times) "
+                        "are in the large batch.")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+    finally:
+        shutil.rmtree(temp_directory)
+
+    uncached_model = model.WPModel()
+    uncached_model.train_model(source_data=plays)
+    cached_model = model.WPModel(cache_size=args.cache_size)
+    cached_model.model = uncached_model.model
+    cached_model._training_seasons = uncached_model.training_seasons
+
+    random_state = np.random.RandomState(0)
+    popularity = random_state.permutation(len(plays))
+    requests = [plays.iloc[popularity[np.minimum(random_state.zipf(args.zipf_exponent,
+                                                                   size=args.plays_per_request) - 1,
+                                                 len(plays) - 1)]]
+                for i in range(args.num_requests)]
+
+    results = {}
+    for description, wpmodel in [("no cache", uncached_model),
+                                 ("cache_size={0}".format(args.cache_size), cached_model)]:
+        start = timeit.default_timer()
+        results[description] = [wpmodel.predict_wp(request) for request in requests]
+        seconds = timeit.default_timer() - start
+        print("{0}: {1:.0f} requests/s".format(description, len(requests) / seconds))
+
+    info = cached_model.cache_info()
+    print("hit rate {0:.1%} ({1})".format(info.hits / (info.hits + info.misses), info))
+    np.testing.assert_allclose(np.concatenate(results["no cache"]),
+                               np.concatenate(results["cache_size={0}".format(args.cache_size)]),
+                               rtol=1e-12, atol=1e-14)
+
+    batch = pd.concat([plays.assign(seconds_elapsed=plays["seconds_elapsed"] + i / 1000)
+                       for i in range(args.batch_copies)], ignore_index=True)
+    batch_model = model.WPModel(cache_size=len(batch))
+    batch_model.model = uncached_model.model
+    batch_model._training_seasons = uncached_model.training_seasons
+    def score_with_empty_cache():
+        batch_model.clear_cache()
+        return batch_model.predict_wp(batch)
+    uncached_time = best_time(lambda: uncached_model.predict_wp(batch))
+    print("{0:d} plays, no cache: {1:.2f}s".format(len(batch), uncached_time))
+    for description, function in [("all misses", score_with_empty_cache),
+                                  ("all hits", lambda: batch_model.predict_wp(batch))]:
+        seconds = best_time(function)
+        print("{0:d} plays, {1}: {2:.2f}s ({3:.2f}x)".format(len(batch), description, seconds,
+                                                             uncached_time / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark the latency of scoring a single play.
+
+Fits the default ``WPModel`` on synthetic plays (from ``nflwin.nfldb_sqlite``),
+then scores plays one at a time with ``predict_wp`` on a one-row DataFrame and
+with ``predict_wp_single``, reporting the median and 99th percentile latency
+of each and making sure they agree.
+
+Usage::
+
+  $ python benchmarks/single_play_latency.py [--num-plays 20000]
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from nflwin import model, nfldb_sqlite, utilities
+
+
+def time_calls(function, arguments):
+    """Time calling a function on each set of arguments, returning the outputs and latencies."""
+    timer = timeit.default_timer
+    outputs = []
+    latencies = np.empty(len(arguments))
+    for i, (args, kwargs) in enumerate(arguments):
+        start = timer()
+        outputs.append(function(*args, **kwargs))
+        latencies[i] = timer() - start
+    return np.array(outputs, dtype=np.float64).ravel(), latencies
+
+
+def report(description, latencies):
+    """Print the median and 99th percentile latency."""
+    print("{0}: median {1:.1f}us, p99 {2:.1f}us".format(
+        description, np.median(latencies) * 1e6, np.percentile(latencies, 99) * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-plays", type=int, default=20000,
+                        help="How many plays to score with predict_wp_single.")
+    parser.add_argument("--num-dataframe-plays", type=int, default=500,
+                        help="How many plays to score with predict_wp (which is much slower).")
+    args = parser.parse_args()
+
+    temp_directory = tempfile.mkdtemp()
+    try:
+        database_url = nfldb_sqlite.create_database(os.path.join(temp_directory, "nfldb.sqlite"),
+                                                    games_per_season=64, random_state=0)
+        plays = utilities.get_nfldb_play_data(database_url=database_url)
+    finally:
+        shutil.rmtree(temp_directory)
+
+    wpmodel = model.WPModel()
+    wpmodel.train_model(source_data=plays)
+    plays = pd.concat([plays] * (args.num_plays // len(plays) + 1),
+                      ignore_index=True).iloc[:args.num_plays][wpmodel.required_columns]
+    records = plays.to_dict("records")
+
+    #(The first call builds the compact model.)
+    wpmodel.predict_wp_single(**records[0])
+    single_wp, single_latencies = time_calls(wpmodel.predict_wp_single,
+                                             [((), record) for record in records])
+    report("predict_wp_single", single_latencies)
+
+    num_dataframe_plays = min(args.num_dataframe_plays, len(plays))
+    dataframe_wp, dataframe_latencies = time_calls(
+        wpmodel.predict_wp, [((pd.DataFrame([record], columns=plays.columns),), {})
+                             for record in records[:num_dataframe_plays]])
+    report("predict_wp on a one-row DataFrame", dataframe_latencies)
+
+    np.testing.assert_allclose(single_wp[:num_dataframe_plays], dataframe_wp, rtol=1e-12, atol=1e-12)
+
+
+if __name__ == "__main__":
+    main()
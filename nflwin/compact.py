@@ -0,0 +1,463 @@
+"""A fitted model reduced to plain Python and NumPy, for scoring one play at a time.
+
+Pushing a single play through a Scikit-learn ``Pipeline`` means building a
+one-row DataFrame and running it through every preprocessing step and the
+model, which takes milliseconds even though the math takes microseconds.
+:class:`CompactWPModel` instead pulls the fitted parameters out of a pipeline
+built from the transformers in :mod:`nflwin.preprocessing` and a logistic
+regression (optionally calibrated with ``CalibratedClassifierCV``, like the
+default model), and computes the win probability of a play directly from a
+dict of its values.
+
+The results match ``predict_proba`` on the full pipeline up to floating-point
+rounding (the dot products are added up in a different order).
+
+A ``CompactWPModel`` can be saved to a small ``.npz`` file with
+:meth:`CompactWPModel.save` (or :meth:`nflwin.model.WPModel.export_compact`)
+and loaded back with :meth:`CompactWPModel.load`. Only
+:meth:`CompactWPModel.from_pipeline` needs Scikit-learn and Pandas, so a
+service that just loads an exported model and scores plays only needs NumPy
+installed (and only imports NumPy).
+
+The same parameters also make a :class:`nflwin.fused.FusedCalibratedClassifier`,
+which scores batches of plays with all the cross-validation folds of a
+calibrated classifier at once, as the final step of a regular pipeline.
+"""
+from __future__ import print_function, division
+
+import bisect
+import json
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+_FORMAT_VERSION = 1
+
+
+class CompactWPModel(object):
+    """Compute win probabilities one play at a time without Pandas or Scikit-learn.
+
+    Use :meth:`from_pipeline` to make one from a fitted pipeline.
+
+    Parameters
+    ----------
+    steps : list of dicts
+        The preprocessing steps, each a dict with a ``"type"`` key (the name of
+        the transformer class in :mod:`nflwin.preprocessing`) and the fitted
+        parameters of the transformer (see ``from_pipeline``).
+    coefficients : Numpy array, of shape(number of models, number of features)
+        The coefficients of each logistic regression.
+    intercepts : Numpy array, of length number of models
+        The intercepts of each logistic regression.
+    calibrations : list of dicts or ``None``
+        How to calibrate the output of each logistic regression. Each dict has
+        a ``"method"`` key: ``"isotonic"`` (with ``"x"`` and ``"y"`` arrays to
+        interpolate between) or ``"sigmoid"`` (with ``"a"`` and ``"b"``). If
+        ``None``, the probabilities from the logistic regression are used directly.
+        The win probability is the average of the calibrated probabilities.
+    """
+    def __init__(self, steps, coefficients, intercepts, calibrations=None):
+        self.steps = steps
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.intercepts = np.asarray(intercepts, dtype=np.float64)
+        self.calibrations = calibrations
+
+        #Python lists and dicts are much faster than arrays for one value at a time:
+        self._coefficients = self.coefficients.tolist()
+        self._intercepts = self.intercepts.tolist()
+        self._calibrations = (None if calibrations is None else
+                              [_prepare_calibration(calibration) for calibration in calibrations])
+        self._mappings = [dict(zip(step["keys"], step["values"])) if "keys" in step else None
+                          for step in steps]
+        self._active_features = [
+            dict((feature, position) for position, feature in enumerate(step["active_features"]))
+            if step["type"] == "OneHotEncoderFromDataFrame" else None
+            for step in steps]
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Extract the fitted parameters of a pipeline.
+
+        Parameters
+        ----------
+        pipeline : Scikit-learn ``Pipeline``
+            A fitted pipeline whose preprocessing steps are transformers from
+            :mod:`nflwin.preprocessing` (possibly fused with
+            :func:`nflwin.preprocessing.compile_pipeline`) working on DataFrames,
+            ending in a binary ``LogisticRegression`` or a ``CalibratedClassifierCV``
+            wrapping one.
+
+        Returns
+        -------
+        ``CompactWPModel``
+
+        Raises
+        ------
+        TypeError
+            If any of the steps can't be converted, or there's no ``CheckColumnNames``
+            step to fix the order of the features.
+        """
+        from . import preprocessing
+
+        transformers = []
+        for name, step in pipeline.steps[:-1]:
+            if isinstance(step, preprocessing.FusedFeatureBuilder):
+                transformers.extend(step.steps)
+            else:
+                transformers.append(step)
+        steps = [_get_step_parameters(transformer) for transformer in transformers]
+        if not any(step["type"] == "CheckColumnNames" for step in steps):
+            #(Otherwise the order of the features would depend on the order of the input columns.)
+            raise TypeError("CompactWPModel: pipeline must have a CheckColumnNames step")
+
+        coefficients, intercepts, calibrations = _get_classifier_parameters(
+            pipeline.steps[-1][1], "CompactWPModel")[1:]
+        return cls(steps, coefficients, intercepts, calibrations)
+
+    def save(self, filename):
+        """Save the model to a ``.npz`` file that can be loaded with only NumPy.
+
+        The steps and the scalar calibration parameters are stored as JSON,
+        and the coefficients, intercepts and isotonic calibration points as
+        arrays, so nothing is pickled.
+
+        Parameters
+        ----------
+        filename : string or file-like object
+            Where to save the model. As with ``np.savez``, ``.npz`` is added to
+            the filename if it doesn't already end with it.
+
+        Returns
+        -------
+        ``None``
+        """
+        arrays = {"format_version": np.array(_FORMAT_VERSION),
+                  "steps": np.array(json.dumps(self.steps)),
+                  "coefficients": self.coefficients,
+                  "intercepts": self.intercepts}
+        if self.calibrations is not None:
+            calibrations = []
+            for i, calibration in enumerate(self.calibrations):
+                if calibration["method"] == "isotonic":
+                    arrays["calibration_{0}_x".format(i)] = np.asarray(calibration["x"], dtype=np.float64)
+                    arrays["calibration_{0}_y".format(i)] = np.asarray(calibration["y"], dtype=np.float64)
+                    calibration = {"method": "isotonic"}
+                calibrations.append(calibration)
+            arrays["calibrations"] = np.array(json.dumps(calibrations))
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a model saved with ``save``.
+
+        Parameters
+        ----------
+        filename : string or file-like object
+            The ``.npz`` file to load.
+
+        Returns
+        -------
+        ``CompactWPModel``
+
+        Raises
+        ------
+        ValueError
+            If the file was saved by a newer, incompatible version of NFLWin.
+        """
+        with np.load(filename, allow_pickle=False) as arrays:
+            format_version = int(arrays["format_version"])
+            if format_version > _FORMAT_VERSION:
+                raise ValueError("CompactWPModel: can't load format version {0} "
+                                 "(this version of NFLWin supports up to {1})"
+                                 .format(format_version, _FORMAT_VERSION))
+            steps = json.loads(arrays["steps"].item())
+            calibrations = None
+            if "calibrations" in arrays.files:
+                calibrations = json.loads(arrays["calibrations"].item())
+                for i, calibration in enumerate(calibrations):
+                    if calibration["method"] == "isotonic":
+                        calibration["x"] = arrays["calibration_{0}_x".format(i)]
+                        calibration["y"] = arrays["calibration_{0}_y".format(i)]
+            return cls(steps, arrays["coefficients"], arrays["intercepts"], calibrations)
+
+    def predict_wp(self, plays):
+        """Estimate the win probabilities for several plays, one at a time.
+
+        Parameters
+        ----------
+        plays : iterable of dicts
+            The value of each input column of the model for each play, as for
+            ``predict_wp_single``.
+
+        Returns
+        -------
+        Numpy array, of length number of plays
+            Predicted probability that the offensive team in each play
+            will go on to win the game.
+        """
+        return np.array([self.predict_wp_single(**play) for play in plays], dtype=np.float64)
+
+    def predict_wp_single(self, **game_state):
+        """Estimate the win probability for a single play.
+
+        Parameters
+        ----------
+        **game_state
+            The value of each input column of the model for the play, e.g.
+            ``offense_team="NE", home_team="NE", down=1, ...``.
+
+        Returns
+        -------
+        float
+            Predicted probability that the offensive team will go on to win the game.
+
+        Raises
+        ------
+        KeyError
+            If a column needed by the model is missing.
+        TypeError or ValueError
+            If a value can't be handled by the model (under the same conditions
+            as the transformers themselves).
+        """
+        features, encoded_positions = self._compute_features(game_state)
+
+        win_probability = 0.
+        for i, (coefficients, intercept) in enumerate(zip(self._coefficients, self._intercepts)):
+            decision = intercept
+            for coefficient, feature in zip(coefficients, features):
+                decision += coefficient * feature
+            for position in encoded_positions:
+                decision += coefficients[position]
+
+            if self._calibrations is None:
+                probability = _logistic(decision)
+            else:
+                probability = _calibrate(self._calibrations[i], decision)
+            win_probability += probability
+
+        return win_probability / len(self._coefficients)
+
+    def _compute_features(self, state):
+        """Run the preprocessing steps on one play.
+
+        Returns
+        -------
+        features : list of floats
+            The values of the features that aren't one-hot encoded.
+        encoded_positions : list of ints
+            The positions of the one-hot encoded features that are 1.
+        """
+        state = dict(state)
+        encoded_positions = []
+        for step, mapping, active_features in zip(self.steps, self._mappings, self._active_features):
+            step_type = step["type"]
+            if step_type == "ComputeIfOffenseIsHome":
+                state[step["offense_home_team_colname"]] = (state[step["home_team_colname"]] ==
+                                                            state[step["offense_team_colname"]])
+            elif step_type == "CreateScoreDifferential":
+                state[step["score_differential_colname"]] = (
+                    (state[step["home_score_colname"]] - state[step["away_score_colname"]]) *
+                    (2 * state[step["offense_home_colname"]] - 1))
+            elif step_type == "MapToInt":
+                state[step["colname"]] = _map_value(state[step["colname"]], mapping,
+                                                    step["handle_unknown"], ValueError,
+                                                    "MapStringsToInt: value not seen in fit")
+            elif step_type == "ComputeElapsedTime":
+                total_time = _map_value(
+                    state[step["quarter_colname"]], mapping, step["handle_unknown"], TypeError,
+                    "ComputeElapsedTime: Total time elapsed not numeric. "
+                    "Check your mapping from quarter name to time.",
+                    offset=state[step["quarter_time_colname"]])
+                #(The transformer truncates the times to integers, unless some are missing.)
+                state[step["total_time_colname"]] = (total_time if total_time != total_time
+                                                     else int(total_time))
+            elif step_type == "CheckColumnNames":
+                state = OrderedDict((colname, state[colname]) for colname in step["column_names"])
+            elif step_type == "OneHotEncoderFromDataFrame":
+                encoded_positions = self._encode(step, active_features, state)
+
+        #Encoded positions are relative to the end of the other features:
+        features = [float(value) for value in state.values()]
+        return features, [len(features) + position for position in encoded_positions]
+
+    def _encode(self, step, active_features, state):
+        """Find which one-hot encoded features are 1, removing the encoded columns from ``state``."""
+        encoded_positions = []
+        for i, colname in enumerate(step["categorical_feature_names"]):
+            value = state.pop(colname)
+            if value is None or value != value:
+                raise ValueError("Input contains NaN, infinity or a value too large for dtype('float64').")
+            value = int(value)
+            if value < 0:
+                raise ValueError("X needs to contain only non-negative integers.")
+            if value >= step["n_values"][i]:
+                if step["handle_unknown"] == "error":
+                    raise ValueError("unknown categorical feature present {0} during transform."
+                                     .format(value))
+                continue
+            position = active_features.get(value + step["feature_indices"][i])
+            if position is not None:
+                encoded_positions.append(position)
+        return encoded_positions
+
+
+def _get_classifier_parameters(classifier, caller):
+    """Get the classes, stacked coefficients and intercepts, and calibrations of a classifier."""
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.linear_model import LogisticRegression
+
+    from . import fused
+
+    if isinstance(classifier, fused.FusedCalibratedClassifier):
+        if not hasattr(classifier, "coefficients_"):
+            raise TypeError("{0}: model has not been fit".format(caller))
+        return (classifier.classes_, classifier.coefficients_, classifier.intercepts_,
+                classifier.calibrations_)
+
+    if isinstance(classifier, CalibratedClassifierCV):
+        if not hasattr(classifier, "calibrated_classifiers_"):
+            raise TypeError("{0}: model has not been fit".format(caller))
+        regressions = [calibrated_classifier.base_estimator
+                       for calibrated_classifier in classifier.calibrated_classifiers_]
+        calibrations = [_get_calibration_parameters(calibrated_classifier)
+                        for calibrated_classifier in classifier.calibrated_classifiers_]
+    else:
+        regressions = [classifier]
+        calibrations = None
+    for regression in regressions:
+        if not isinstance(regression, LogisticRegression) or not hasattr(regression, "coef_"):
+            raise TypeError("{0}: final step must be a fitted LogisticRegression, "
+                            "or a CalibratedClassifierCV wrapping one".format(caller))
+        if len(regression.classes_) != 2:
+            raise TypeError("{0}: only binary classifiers are supported".format(caller))
+
+    return (np.asarray(classifier.classes_),
+            np.vstack([regression.coef_[0] for regression in regressions]),
+            np.array([regression.intercept_[0] for regression in regressions]),
+            calibrations)
+
+
+def _get_step_parameters(transformer):
+    """Get the fitted parameters of a transformer as a dict of plain Python values."""
+    from . import preprocessing
+
+    step = {"type": type(transformer).__name__}
+    if isinstance(transformer, preprocessing.ComputeIfOffenseIsHome):
+        for param in ["offense_team_colname", "home_team_colname", "offense_home_team_colname"]:
+            step[param] = getattr(transformer, param)
+    elif isinstance(transformer, preprocessing.CreateScoreDifferential):
+        for param in ["home_score_colname", "away_score_colname", "offense_home_colname",
+                      "score_differential_colname"]:
+            step[param] = getattr(transformer, param)
+    elif isinstance(transformer, preprocessing.MapToInt):
+        if not transformer.mapping:
+            raise TypeError("CompactWPModel: MapToInt has not been fit")
+        step["colname"] = transformer.colname
+        step["keys"] = [_to_python(key) for key in transformer.mapping.keys()]
+        step["values"] = [_to_python(value) for value in transformer.mapping.values()]
+        step["handle_unknown"] = _to_python(getattr(transformer, "handle_unknown", "passthrough"))
+    elif isinstance(transformer, preprocessing.ComputeElapsedTime):
+        for param in ["quarter_colname", "quarter_time_colname", "total_time_colname"]:
+            step[param] = getattr(transformer, param)
+        step["keys"] = [_to_python(key) for key in transformer.quarter_to_second_mapping.keys()]
+        step["values"] = [_to_python(value) for value in transformer.quarter_to_second_mapping.values()]
+        step["handle_unknown"] = _to_python(getattr(transformer, "handle_unknown", "error"))
+    elif isinstance(transformer, preprocessing.CheckColumnNames):
+        if not transformer._fit:
+            raise TypeError("CompactWPModel: CheckColumnNames has not been fit")
+        step["column_names"] = list(transformer.column_names)
+    elif isinstance(transformer, preprocessing.OneHotEncoderFromDataFrame):
+        if not hasattr(transformer.onehot, "active_features_"):
+            raise TypeError("CompactWPModel: OneHotEncoderFromDataFrame has not been fit")
+        step["categorical_feature_names"] = list(transformer.categorical_feature_names)
+        step["n_values"] = transformer.onehot.n_values_.tolist()
+        step["feature_indices"] = transformer.onehot.feature_indices_.tolist()
+        step["active_features"] = transformer.onehot.active_features_.tolist()
+        step["handle_unknown"] = transformer.handle_unknown
+    else:
+        raise TypeError("CompactWPModel: can't convert step of type {0}"
+                        .format(type(transformer).__name__))
+
+    if getattr(transformer, "_input_mode", "dataframe") != "dataframe":
+        raise TypeError("CompactWPModel: steps must be fit on DataFrames")
+    return step
+
+
+def _get_calibration_parameters(calibrated_classifier):
+    """Get the fitted parameters of a calibrator from a ``CalibratedClassifierCV``."""
+    calibrator, = calibrated_classifier.calibrators_
+    if calibrated_classifier.method == "isotonic":
+        return {"method": "isotonic",
+                "x": np.asarray(calibrator._necessary_X_, dtype=np.float64),
+                "y": np.asarray(calibrator._necessary_y_, dtype=np.float64)}
+    return {"method": "sigmoid", "a": float(calibrator.a_), "b": float(calibrator.b_)}
+
+
+def _prepare_calibration(calibration):
+    """Convert the arrays of a calibration to lists, for fast scalar lookups."""
+    calibration = dict(calibration)
+    if calibration["method"] == "isotonic":
+        calibration["x"] = np.asarray(calibration["x"], dtype=np.float64).tolist()
+        calibration["y"] = np.asarray(calibration["y"], dtype=np.float64).tolist()
+    return calibration
+
+
+def _calibrate(calibration, decision):
+    """Calibrate the decision function of a logistic regression, like ``CalibratedClassifierCV``."""
+    if calibration["method"] == "isotonic":
+        probability = _interpolate(calibration["x"], calibration["y"], decision)
+    else:
+        probability = 1. / (1. + math.exp(calibration["a"] * decision + calibration["b"]))
+
+    if probability != probability:
+        return 0.5
+    if 1. < probability <= 1. + 1e-5:
+        return 1.
+    return probability
+
+
+def _interpolate(x, y, value):
+    """Linearly interpolate like ``IsotonicRegression(out_of_bounds="clip").predict`` on one value."""
+    if len(x) == 1:
+        return y[0]
+    if value <= x[0]:
+        return y[0]
+    if value >= x[-1]:
+        return y[-1]
+    #(The same arithmetic as ``np.interp``.)
+    i = bisect.bisect_right(x, value) - 1
+    slope = (y[i + 1] - y[i]) / (x[i + 1] - x[i])
+    interpolated = slope * (value - x[i]) + y[i]
+    if interpolated != interpolated:
+        interpolated = slope * (value - x[i + 1]) + y[i + 1]
+        if interpolated != interpolated and y[i] == y[i + 1]:
+            interpolated = y[i]
+    return interpolated
+
+
+def _logistic(decision):
+    """The logistic function, like ``LogisticRegression.predict_proba`` for binary problems."""
+    return 1. / (1. + math.exp(-decision))
+
+
+def _map_value(value, mapping, handle_unknown, error_class, error_message, offset=0):
+    """Map a single value (adding ``offset`` if it's known), like ``MapToInt`` and ``ComputeElapsedTime``."""
+    if value is None or value != value:
+        return float("nan")
+    try:
+        return mapping[value] + offset
+    except (KeyError, TypeError):
+        pass
+    if handle_unknown == "error":
+        raise error_class(error_message)
+    if handle_unknown == "nan":
+        return float("nan")
+    if handle_unknown == "passthrough":
+        return value
+    return handle_unknown
+
+
+def _to_python(value):
+    """Convert a Numpy scalar to the equivalent Python value."""
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,229 @@
+"""A calibrated logistic regression with its cross-validation folds scored together.
+
+``CalibratedClassifierCV`` (the final step of the default model) keeps a
+logistic regression and a calibrator for each cross-validation fold, and its
+``predict_proba`` runs each of them in turn (validating the input every time)
+before averaging. :class:`FusedCalibratedClassifier` holds the same fitted
+parameters (extracted as for :class:`nflwin.compact.CompactWPModel`) stacked
+together, so that scoring a batch of plays takes one matrix product and one
+``np.interp`` per fold. :func:`fuse_pipeline` (or
+:meth:`nflwin.model.WPModel.fuse_model`) swaps it in for the final step of a
+fitted pipeline, and it can also be fit itself, like the classifier it stands in for.
+"""
+from __future__ import print_function, division
+
+import numpy as np
+
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+from sklearn.utils.validation import check_is_fitted
+
+from . import compact
+
+
+class FusedCalibratedClassifier(BaseEstimator, ClassifierMixin):
+    """Score a batch of plays with all the folds of a calibrated logistic regression at once.
+
+    The decision functions of every fold come from a single matrix product,
+    and each fold's isotonic calibration is a ``np.interp`` over its calibration
+    points, which is what ``IsotonicRegression(out_of_bounds="clip")`` computes.
+    Use it as the final step of a pipeline in place of the classifier it was made
+    from (see ``fuse_pipeline``). Fitting it fits a copy of ``estimator`` and
+    fuses that, so a fused pipeline can be cloned and refit (e.g. by
+    ``cross_val_score`` or a grid search) like the original.
+
+    The results match the original classifier up to floating-point rounding
+    (the matrix product may add up the dot products in a different order).
+
+    Parameters
+    ----------
+    estimator : ``CalibratedClassifierCV``, ``LogisticRegression`` or ``None`` (default=``None``)
+        The classifier to fit and fuse when this is fit, as accepted by
+        ``from_classifier`` once it's fit. If ``None``, the one in the default
+        model: a ``LogisticRegression`` in a ``CalibratedClassifierCV`` with
+        two folds and isotonic calibration.
+
+    Attributes
+    ----------
+    classes_ : Numpy array, of length 2
+        The class labels, as in the ``classes_`` attribute of the fused classifier.
+    coefficients_, intercepts_, calibrations_
+        As the parameters of :class:`nflwin.compact.CompactWPModel`.
+    """
+    def __init__(self, estimator=None):
+        self.estimator = estimator
+
+    @classmethod
+    def from_classifier(cls, classifier):
+        """Fuse a fitted classifier.
+
+        Parameters
+        ----------
+        classifier : ``CalibratedClassifierCV`` or ``LogisticRegression``
+            A fitted binary ``LogisticRegression``, or a ``CalibratedClassifierCV``
+            wrapping one (with any number of folds, calibrated with either method).
+
+        Returns
+        -------
+        ``FusedCalibratedClassifier``
+            Fit, with an unfitted copy of ``classifier`` as its ``estimator``.
+
+        Raises
+        ------
+        TypeError
+            If the classifier isn't one of these, or hasn't been fit.
+        """
+        fused_classifier = cls(estimator=clone(classifier))
+        fused_classifier._fuse(classifier)
+        return fused_classifier
+
+    def fit(self, X, y):
+        """Fit a copy of ``estimator``, and fuse it.
+
+        Parameters
+        ----------
+        X : Numpy array, SciPy sparse matrix or Pandas DataFrame, of shape(number of plays, number of features)
+            The features.
+        y : Numpy array, of length number of plays
+            The classes.
+
+        Returns
+        -------
+        self
+
+        Raises
+        ------
+        TypeError
+            If ``estimator`` can't be fused.
+        """
+        if self.estimator is None:
+            from sklearn.calibration import CalibratedClassifierCV
+            from sklearn.linear_model import LogisticRegression
+            estimator = CalibratedClassifierCV(LogisticRegression(), cv=2, method="isotonic")
+        else:
+            estimator = clone(self.estimator)
+        self._fuse(estimator.fit(X, y))
+        return self
+
+    def _fuse(self, classifier):
+        """Take the fitted parameters of a classifier."""
+        (self.classes_, self.coefficients_, self.intercepts_,
+         self.calibrations_) = compact._get_classifier_parameters(classifier,
+                                                                  "FusedCalibratedClassifier")
+
+    def decision_function(self, X):
+        """Compute the decision function of every fold's logistic regression.
+
+        Parameters
+        ----------
+        X : Numpy array, SciPy sparse matrix or Pandas DataFrame, of shape(number of plays, number of features)
+            The features.
+
+        Returns
+        -------
+        Numpy array, of shape(number of plays, number of folds)
+
+        Raises
+        ------
+        NotFittedError
+            If the classifier hasn't been fit.
+        """
+        check_is_fitted(self, "coefficients_")
+        #(Fortran order, so each fold's coefficients are contiguous like ``coef_.T``.)
+        weights = np.asfortranarray(self.coefficients_.T)
+        if not hasattr(X, "tocsr"):
+            X = np.asarray(X, dtype=np.float64)
+            if X.ndim != 2:
+                raise ValueError("FusedCalibratedClassifier: expected a 2D array of features")
+        if X.shape[1] != weights.shape[0]:
+            raise ValueError("FusedCalibratedClassifier: X has {0} features per sample; "
+                             "expecting {1}".format(X.shape[1], weights.shape[0]))
+        decisions = np.asarray(X.dot(weights))
+        decisions += self.intercepts_
+        return decisions
+
+    def predict_proba(self, X):
+        """Estimate the probability of each class, like the original classifier.
+
+        Parameters
+        ----------
+        X : Numpy array, SciPy sparse matrix or Pandas DataFrame, of shape(number of plays, number of features)
+            The features.
+
+        Returns
+        -------
+        Numpy array, of shape(number of plays, 2)
+            The probabilities of ``classes_[0]`` and ``classes_[1]``.
+        """
+        decisions = self.decision_function(X)
+        proba = np.zeros((decisions.shape[0], 2))
+        for i in range(decisions.shape[1]):
+            if self.calibrations_ is None:
+                probabilities = 1. / (1. + np.exp(-decisions[:, i]))
+                proba[:, 0] += 1. - probabilities
+            else:
+                #(Fixed up and summed in the same order as ``CalibratedClassifierCV``.)
+                probabilities = _calibrate(self.calibrations_[i], decisions[:, i])
+                probabilities[np.isnan(probabilities)] = 0.5
+                proba[:, 0] += 1. - probabilities
+                probabilities[(1. < probabilities) & (probabilities <= 1. + 1e-5)] = 1.
+            proba[:, 1] += probabilities
+        proba /= decisions.shape[1]
+        return proba
+
+    def predict(self, X):
+        """Predict the more likely class of each play.
+
+        Parameters
+        ----------
+        X : Numpy array, SciPy sparse matrix or Pandas DataFrame, of shape(number of plays, number of features)
+            The features.
+
+        Returns
+        -------
+        Numpy array, of length number of plays
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def fuse_pipeline(pipeline):
+    """Replace the final step of a fitted pipeline with a ``FusedCalibratedClassifier``.
+
+    Parameters
+    ----------
+    pipeline : Scikit-learn ``Pipeline``
+        A fitted pipeline ending in a classifier that
+        :meth:`FusedCalibratedClassifier.from_classifier` accepts, like the one
+        made by :meth:`nflwin.model.WPModel.create_default_pipeline`.
+
+    Returns
+    -------
+    Scikit-learn ``Pipeline``
+        A pipeline with the same preprocessing steps (shared with ``pipeline``,
+        not copied) and a ``FusedCalibratedClassifier`` as its final step, under
+        the same name.
+
+    Raises
+    ------
+    TypeError
+        If the final step can't be fused.
+    """
+    from sklearn.pipeline import Pipeline
+
+    name, classifier = pipeline.steps[-1]
+    return Pipeline(pipeline.steps[:-1] +
+                    [(name, FusedCalibratedClassifier.from_classifier(classifier))])
+
+
+def _calibrate(calibration, decisions):
+    """Calibrate an array of decision functions of a logistic regression, like ``CalibratedClassifierCV``."""
+    if calibration["method"] == "isotonic":
+        x = np.asarray(calibration["x"], dtype=np.float64)
+        y = np.asarray(calibration["y"], dtype=np.float64)
+        if len(x) == 1:
+            probabilities = np.repeat(y, len(decisions))
+        else:
+            #(``np.interp`` holds the end values outside the points, the same as clipping first.)
+            probabilities = np.interp(decisions, x, y)
+    else:
+        probabilities = 1. / (1. + np.exp(calibration["a"] * decisions + calibration["b"]))
+    return probabilities
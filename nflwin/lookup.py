@@ -0,0 +1,576 @@
+"""A precomputed table of win probabilities over a grid of game states.
+
+The features the default model is fit on are few and mostly discrete (whether
+the offense is at home, the score differential, the time elapsed, the yardline,
+the yards to go and the down), so the win probability of every combination of
+them on a reasonably fine grid fits in a single array. :class:`WPLookupTable`
+holds that array and its axes: scoring a play is then just computing its
+features, finding its place on each axis (a division, for evenly spaced axes)
+and reading the table, optionally interpolating linearly between the
+neighboring grid points.
+
+Build a table with :meth:`nflwin.model.WPModel.build_lookup_table`, which
+reports how far the table is from the full model. Tables are saved as a
+``.npy`` array (which can be memory-mapped, so processes serving from the same
+table share it) and a JSON file describing the axes and the steps to compute
+the features. Like :mod:`nflwin.compact`, loading and scoring a table only
+needs NumPy; building one needs the fitted model.
+"""
+from __future__ import print_function, division
+
+import bisect
+import copy
+import json
+import os
+
+import numpy as np
+
+from . import compact
+
+_FORMAT_VERSION = 1
+_TABLE_FILENAME = "table.npy"
+_METADATA_FILENAME = "axes.json"
+
+#The grid for the features of the default model (``None`` means every category the
+#model was fit on, for one-hot encoded features). As float32, the table is 95MB.
+#Against the default model on synthetic plays (``benchmarks/lookup_table.py``), the
+#mean absolute error is about 0.0015, but the largest is about 0.05. Those are
+#plays near a step of the isotonic calibration, which interpolating can't follow.
+#A finer grid barely helps: points every 30s instead of 60s double the size and
+#leave the largest error as it is; every 2 yards instead of 5 make the table 231MB
+#and bring it down only to about 0.04. Where that matters, score with the model.
+DEFAULT_GRID = {"is_offense_home": [0, 1],
+                "score_differential": np.arange(-35, 36),
+                "total_elapsed_time": np.arange(0, 4501, 60),
+                "yardline": np.arange(-50, 51, 5),
+                "yards_to_go": np.arange(0, 21),
+                "down": None}
+
+
+class WPLookupTable(object):
+    """Win probabilities precomputed over a grid of game states.
+
+    Use :meth:`from_model` (or :meth:`nflwin.model.WPModel.build_lookup_table`)
+    to build one, and :meth:`load` to load a saved one.
+
+    Parameters
+    ----------
+    feature_steps : list of dicts
+        The steps that compute the features from the input columns, in the
+        format used by :class:`nflwin.compact.CompactWPModel`, ending with a
+        ``CheckColumnNames`` step.
+    axes : list of (string, Numpy array) tuples
+        The name of each feature and its (sorted, unique) grid points, in the
+        order of the dimensions of ``table``.
+    table : Numpy array (or memory-mapped array)
+        The win probability at every combination of grid points.
+    discrete_features : list of strings or ``None`` (default=``None``)
+        Features that are never interpolated: values are looked up at the
+        nearest grid point instead (e.g. the one-hot encoded down). ``None``
+        means none are.
+    max_error : float or ``None`` (default=``None``)
+        The largest absolute difference from the full model found when the
+        table was built.
+    mean_error : float or ``None`` (default=``None``)
+        The mean absolute difference from the full model found when the
+        table was built.
+    """
+    def __init__(self, feature_steps, axes, table, discrete_features=None,
+                 max_error=None, mean_error=None):
+        self.feature_steps = feature_steps
+        self.axes = [(name, np.asarray(points, dtype=np.float64)) for name, points in axes]
+        self.table = table
+        self.discrete_features = tuple(discrete_features) if discrete_features is not None else ()
+        self.max_error = max_error
+        self.mean_error = mean_error
+
+        if self.table.shape != tuple(len(points) for name, points in self.axes):
+            raise ValueError("WPLookupTable: table of shape {0} doesn't match the axes"
+                             .format(self.table.shape))
+        self._mappings = [dict(zip(step["keys"], step["values"])) if "keys" in step else None
+                          for step in feature_steps]
+        #(Only used to compute the features of single plays, so it has no regressions.)
+        self._feature_model = compact.CompactWPModel(feature_steps, np.empty((0, len(self.axes))),
+                                                     np.empty(0))
+        self._spacings = [_get_spacing(points) for name, points in self.axes]
+        self._interpolated = [name not in self.discrete_features and len(points) > 1
+                              for name, points in self.axes]
+        self._strides = [stride // self.table.itemsize for stride in self.table.strides]
+        #(A plain array, since indexing a memory-mapped one is slower.)
+        self._flat_table = self.table.reshape(-1).view(np.ndarray)
+        #For single plays, what's needed to locate a value on each axis, as Python values:
+        self._single_axes = [(points.tolist(), float(points[0]), spacing, len(points) - 1.,
+                              len(points) - 2, stride, can_interpolate)
+                             for (name, points), spacing, stride, can_interpolate
+                             in zip(self.axes, self._spacings, self._strides, self._interpolated)]
+        #The offsets of the corners of a cell, by the strides of the axes interpolated along:
+        self._corner_offsets = {}
+
+    @classmethod
+    def from_model(cls, wpmodel, grid=None, directory=None, check_plays=None,
+                   num_check_points=10000, chunksize=2**20, n_jobs=1, dtype=np.float32,
+                   random_state=0):
+        """Build a table by scoring every grid point with a fitted model.
+
+        The features at the grid points are run through the steps of the model
+        after its ``CheckColumnNames`` step (usually just the one-hot encoding)
+        and the classifier, ``chunksize`` grid points at a time, so the model can be
+        anything that works on the features. The features of the plays looked up
+        in the table are computed as in :class:`nflwin.compact.CompactWPModel`,
+        so the steps before ``CheckColumnNames`` must be ones it supports.
+
+        Parameters
+        ----------
+        wpmodel : ``nflwin.model.WPModel``
+            The fitted model.
+        grid : dict or ``None`` (default=``None``)
+            The grid points for each feature of the model (after ``CheckColumnNames``),
+            as a sequence of values. For one-hot encoded features the points may be
+            ``None``, to use every category the model was fit on. If ``None``, use
+            ``DEFAULT_GRID``, which covers the features of the default model.
+        directory : string or ``None`` (default=``None``)
+            If given, build the table in a memory-mapped file in this directory
+            (which is created if needed) and save the table there, so the table
+            doesn't have to fit in memory.
+        check_plays : Pandas DataFrame or ``None`` (default=``None``)
+            Plays to measure the error of the table on, against ``wpmodel.predict_wp``.
+            If ``None``, measure the error on ``num_check_points`` random points
+            inside the grid (which are uniformly distributed, so not necessarily
+            realistic game states).
+        num_check_points : int (default=10000)
+            How many random points to check, if there are no ``check_plays``.
+        chunksize : int (default=2**20)
+            How many grid points to score at a time.
+        n_jobs : int (default=1)
+            How many jobs to score each chunk with (see ``WPModel.predict_wp``).
+        dtype : Numpy dtype (default=``np.float32``)
+            The type of the table. Single precision halves the size of the table,
+            adding errors much smaller than those from discretizing the features.
+        random_state : int or ``None`` (default=0)
+            Seed for choosing the random check points.
+
+        Returns
+        -------
+        ``WPLookupTable``
+            With ``max_error`` and ``mean_error`` set to the errors found in the check.
+
+        Raises
+        ------
+        ValueError
+            If there are no grid points for a feature of the model, or there are
+            grid points for a feature it doesn't have.
+        TypeError
+            If there's no ``CheckColumnNames`` step in the model, or the steps
+            before it can't be converted (see ``CompactWPModel.from_pipeline``).
+        """
+        import pandas as pd
+        from sklearn.pipeline import Pipeline
+
+        from . import preprocessing
+
+        transformers = []
+        for name, step in wpmodel.model.steps[:-1]:
+            if isinstance(step, preprocessing.FusedFeatureBuilder):
+                transformers.extend(step.steps)
+            else:
+                transformers.append(step)
+        check_positions = [i for i, transformer in enumerate(transformers)
+                           if isinstance(transformer, preprocessing.CheckColumnNames)]
+        if len(check_positions) == 0:
+            raise TypeError("WPLookupTable: model must have a CheckColumnNames step")
+        feature_steps = [compact._get_step_parameters(transformer)
+                         for transformer in transformers[:check_positions[0] + 1]]
+        feature_names = feature_steps[-1]["column_names"]
+
+        #Score the features with a copy of the model that starts from them:
+        feature_model = copy.copy(wpmodel)
+        feature_model.model = Pipeline(
+            [("step_{0}".format(i), transformer)
+             for i, transformer in enumerate(transformers[check_positions[0] + 1:])] +
+            [wpmodel.model.steps[-1]])
+
+        categories = {}
+        for transformer in transformers[check_positions[0] + 1:]:
+            if isinstance(transformer, preprocessing.OneHotEncoderFromDataFrame):
+                categories.update(_get_categories(transformer))
+        axes = _get_axes(feature_names, DEFAULT_GRID if grid is None else grid, categories)
+
+        shape = tuple(len(points) for name, points in axes)
+        if directory is None:
+            table = np.empty(shape, dtype=dtype)
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            table = np.lib.format.open_memmap(os.path.join(directory, _TABLE_FILENAME),
+                                              mode="w+", dtype=dtype, shape=shape)
+        flat_table = table.reshape(-1)
+        for start in range(0, flat_table.size, chunksize):
+            positions = np.unravel_index(np.arange(start, min(start + chunksize, flat_table.size)),
+                                         shape)
+            features = pd.DataFrame(dict((name, points[position]) for (name, points), position
+                                         in zip(axes, positions)),
+                                    columns=feature_names)
+            flat_table[start:start + chunksize] = feature_model.predict_wp(features, n_jobs=n_jobs)
+
+        lookup_table = cls(feature_steps, axes, table, discrete_features=sorted(categories))
+        if check_plays is not None:
+            errors = np.abs(lookup_table.predict_wp(check_plays) -
+                            wpmodel.predict_wp(check_plays, n_jobs=n_jobs))
+        else:
+            random_state = np.random.RandomState(random_state)
+            features = dict((name, random_state.choice(points, size=num_check_points)
+                             if name in categories else
+                             random_state.uniform(points[0], points[-1], size=num_check_points))
+                            for name, points in axes)
+            errors = np.abs(lookup_table.lookup(features) -
+                            feature_model.predict_wp(pd.DataFrame(features, columns=feature_names),
+                                                     n_jobs=n_jobs))
+        lookup_table.max_error = float(np.nanmax(errors))
+        lookup_table.mean_error = float(np.nanmean(errors))
+
+        if directory is not None:
+            table.flush()
+            lookup_table._save_metadata(directory)
+        return lookup_table
+
+    def save(self, directory):
+        """Save the table to a directory, to be loaded with ``load``.
+
+        Parameters
+        ----------
+        directory : string
+            The directory to save the table in (created if needed). Any table
+            already saved there is overwritten.
+
+        Returns
+        -------
+        ``None``
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        np.save(os.path.join(directory, _TABLE_FILENAME), self.table)
+        self._save_metadata(directory)
+
+    def _save_metadata(self, directory):
+        """Save everything but the table itself as JSON."""
+        metadata = {"format_version": _FORMAT_VERSION,
+                    "feature_steps": self.feature_steps,
+                    "axes": [[name, points.tolist()] for name, points in self.axes],
+                    "discrete_features": list(self.discrete_features),
+                    "max_error": self.max_error,
+                    "mean_error": self.mean_error}
+        with open(os.path.join(directory, _METADATA_FILENAME), "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Load a table saved with ``save`` (or built in a directory).
+
+        Parameters
+        ----------
+        directory : string
+            The directory the table was saved in.
+        mmap_mode : ``None`` or string (default=``"r"``)
+            How to memory-map the table, as in ``np.load``. With the default,
+            only the parts of the table that are looked up are read from disk,
+            and processes on the same machine share them. If ``None``, read
+            the whole table into memory.
+
+        Returns
+        -------
+        ``WPLookupTable``
+
+        Raises
+        ------
+        ValueError
+            If the table was saved by a newer, incompatible version of NFLWin.
+        """
+        with open(os.path.join(directory, _METADATA_FILENAME)) as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata["format_version"] > _FORMAT_VERSION:
+            raise ValueError("WPLookupTable: can't load format version {0} "
+                             "(this version of NFLWin supports up to {1})"
+                             .format(metadata["format_version"], _FORMAT_VERSION))
+        table = np.load(os.path.join(directory, _TABLE_FILENAME), mmap_mode=mmap_mode,
+                        allow_pickle=False)
+        return cls(metadata["feature_steps"], metadata["axes"], table,
+                   discrete_features=metadata["discrete_features"],
+                   max_error=metadata["max_error"], mean_error=metadata["mean_error"])
+
+    def predict_wp(self, plays, interpolate=True):
+        """Look up the win probabilities for a set of plays.
+
+        Parameters
+        ----------
+        plays : Pandas DataFrame or dict of arrays
+            The values of the input columns of the model for each play.
+        interpolate : boolean (default=``True``)
+            Whether to interpolate linearly between the grid points around each
+            play (for all but the ``discrete_features``), or to use the nearest one.
+
+        Returns
+        -------
+        Numpy array, of length number of plays
+            Predicted probability that the offensive team in each play
+            will go on to win the game. Features outside the grid are clipped to
+            its edges, and plays with missing features get NaN.
+
+        Raises
+        ------
+        KeyError
+            If a column needed by the model is missing.
+        TypeError or ValueError
+            If a value can't be handled by the model (under the same conditions
+            as the transformers themselves).
+        """
+        return self.lookup(self._compute_features(plays), interpolate=interpolate)
+
+    def predict_wp_single(self, interpolate=True, **game_state):
+        """Look up the win probability for a single play.
+
+        Parameters
+        ----------
+        interpolate : boolean (default=``True``)
+            As for ``predict_wp``.
+        **game_state
+            The value of each input column of the model for the play, e.g.
+            ``offense_team="NE", home_team="NE", down=1, ...``.
+
+        Returns
+        -------
+        float
+            Predicted probability that the offensive team will go on to win the game.
+        """
+        features, encoded_positions = self._feature_model._compute_features(game_state)
+
+        flat_index = 0
+        strides = ()
+        fractions = []
+        for value, (points, first_point, spacing, last_position, last_lower, stride,
+                    can_interpolate) in zip(features, self._single_axes):
+            if value != value:
+                return float("nan")
+            if last_lower < 0:
+                continue
+            if spacing is not None:
+                position = (value - first_point) / spacing
+            else:
+                lower = min(max(bisect.bisect_right(points, value) - 1, 0), last_lower)
+                position = lower + (value - points[lower]) / (points[lower + 1] - points[lower])
+            #(Clipped without calling ``min`` and ``max``, which is most of the time taken here.)
+            if position <= 0.:
+                lower, fraction = 0, 0.
+            elif position >= last_position:
+                lower, fraction = last_lower, 1.
+            else:
+                lower = int(position)
+                fraction = position - lower
+            if interpolate and can_interpolate and fraction != 0:
+                flat_index += lower * stride
+                strides += (stride,)
+                fractions.append(fraction)
+            else:
+                #(Values on a grid point don't need interpolating: the weight of the next one is 0.)
+                flat_index += (lower + (fraction >= 0.5)) * stride
+
+        #Read all the corners needed at once, then interpolate as in ``lookup``:
+        offsets = self._corner_offsets.get(strides)
+        if offsets is None:
+            offsets = self._corner_offsets[strides] = _get_corner_offsets(strides)
+        corner_values = self._flat_table.take(offsets + flat_index).tolist()
+        for fraction in reversed(fractions):
+            corner_values = [corner_values[i] * (1. - fraction) + corner_values[i + 1] * fraction
+                             for i in range(0, len(corner_values), 2)]
+        return corner_values[0]
+
+    def lookup(self, features, interpolate=True):
+        """Look up the win probabilities for the features of a set of plays.
+
+        Parameters
+        ----------
+        features : Pandas DataFrame or dict of arrays
+            The value of each feature (the name of each axis) for each play.
+        interpolate : boolean (default=``True``)
+            As for ``predict_wp``.
+
+        Returns
+        -------
+        Numpy array
+            The win probability of each play.
+        """
+        values = np.broadcast_arrays(*[np.atleast_1d(np.asarray(features[name], dtype=np.float64))
+                                       for name, points in self.axes])
+        shape = values[0].shape
+        missing = np.zeros(shape, dtype=np.bool_)
+        for feature_values in values:
+            missing |= np.isnan(feature_values)
+
+        flat_index = np.zeros(shape, dtype=np.intp)
+        interpolated = []
+        for (name, points), spacing, stride, can_interpolate, feature_values in zip(
+                self.axes, self._spacings, self._strides, self._interpolated, values):
+            lower, fraction = _locate(points, spacing, np.where(missing, points[0], feature_values))
+            if interpolate and can_interpolate:
+                flat_index += lower * stride
+                interpolated.append((stride, fraction.ravel()))
+            else:
+                flat_index += (lower + (fraction >= 0.5)) * stride
+
+        #Read the table at every corner of the cell around each play at once, then
+        #interpolate along one axis at a time (starting from the last):
+        offsets = _get_corner_offsets([stride for stride, fraction in interpolated])
+        corner_values = np.take(self._flat_table, flat_index.ravel() + offsets[:, np.newaxis])
+        corner_values = corner_values.astype(np.float64).reshape((2,) * len(interpolated) + (-1,))
+        for stride, fraction in reversed(interpolated):
+            corner_values = corner_values[..., 0, :] * (1. - fraction) + corner_values[..., 1, :] * fraction
+
+        win_probabilities = corner_values.reshape(shape)
+        win_probabilities[missing] = np.nan
+        return win_probabilities
+
+    def _compute_features(self, plays):
+        """Run the feature steps on a set of plays, returning a dict of feature arrays."""
+        state = {}
+        def get_column(colname):
+            if colname not in state:
+                state[colname] = np.asarray(plays[colname])
+            return state[colname]
+
+        for step, mapping in zip(self.feature_steps, self._mappings):
+            step_type = step["type"]
+            if step_type == "ComputeIfOffenseIsHome":
+                state[step["offense_home_team_colname"]] = (get_column(step["home_team_colname"]) ==
+                                                            get_column(step["offense_team_colname"]))
+            elif step_type == "CreateScoreDifferential":
+                state[step["score_differential_colname"]] = (
+                    (get_column(step["home_score_colname"]) - get_column(step["away_score_colname"])) *
+                    (2 * get_column(step["offense_home_colname"]) - 1))
+            elif step_type == "MapToInt":
+                state[step["colname"]] = _map_column(get_column(step["colname"]), mapping,
+                                                     step["handle_unknown"], ValueError,
+                                                     "MapStringsToInt: value not seen in fit")[0]
+            elif step_type == "ComputeElapsedTime":
+                quarter_start, known = _map_column(
+                    get_column(step["quarter_colname"]), mapping, step["handle_unknown"], TypeError,
+                    "ComputeElapsedTime: Total time elapsed not numeric. "
+                    "Check your mapping from quarter name to time.")
+                total_time = np.where(known, quarter_start + get_column(step["quarter_time_colname"]),
+                                      quarter_start)
+                #(Truncated to integers, like CompactWPModel.)
+                state[step["total_time_colname"]] = np.where(np.isnan(total_time), total_time,
+                                                             np.trunc(total_time))
+            elif step_type == "CheckColumnNames":
+                return dict((colname, get_column(colname)) for colname in step["column_names"])
+        raise TypeError("WPLookupTable: feature steps must end with CheckColumnNames")
+
+
+def _map_column(values, mapping, handle_unknown, error_class, error_message):
+    """Map a column of values, like ``MapToInt`` and ``ComputeElapsedTime``.
+
+    Returns
+    -------
+    mapped : Numpy array of floats
+        The mapped values.
+    known : Numpy array of booleans
+        Whether each value was in ``mapping`` (rather than handled as unknown).
+    """
+    try:
+        if values.dtype.kind == "O":
+            #(Sorting objects is slow, so find the unique values with a dict instead.)
+            codes = {}
+            inverse = np.fromiter((codes.setdefault(value, len(codes)) for value in values),
+                                  dtype=np.intp, count=len(values))
+            uniques = [None] * len(codes)
+            for value, code in codes.items():
+                uniques[code] = value
+        else:
+            uniques, inverse = np.unique(values, return_inverse=True)
+    except TypeError:
+        #(Unhashable values, or values of mixed types that can't be sorted, so map each one.)
+        uniques, inverse = values, np.arange(len(values))
+    mapped = np.array([compact._map_value(value, mapping, handle_unknown, error_class, error_message)
+                       for value in uniques], dtype=np.float64)
+    known = np.array([value is not None and value == value and _in_mapping(value, mapping)
+                      for value in uniques], dtype=np.bool_)
+    return mapped[inverse], known[inverse]
+
+
+def _in_mapping(value, mapping):
+    """Whether a value is a key of a mapping (unhashable values aren't)."""
+    try:
+        return value in mapping
+    except TypeError:
+        return False
+
+
+def _get_categories(encoder):
+    """Get the categories a fitted ``OneHotEncoderFromDataFrame`` knows about, for each feature."""
+    onehot = encoder.onehot
+    categories = {}
+    for i, colname in enumerate(encoder.categorical_feature_names):
+        start, stop = onehot.feature_indices_[i], onehot.feature_indices_[i + 1]
+        active_features = onehot.active_features_
+        categories[colname] = active_features[(active_features >= start) &
+                                              (active_features < stop)] - start
+    return categories
+
+
+def _get_axes(feature_names, grid, categories):
+    """Get the sorted, unique grid points for each feature."""
+    unknown_features = sorted(set(grid) - set(feature_names))
+    if unknown_features:
+        raise ValueError("WPLookupTable: grid has points for features the model doesn't use: {0}"
+                         .format(unknown_features))
+    axes = []
+    for name in feature_names:
+        points = grid.get(name)
+        if points is None and name in categories:
+            points = categories[name]
+        if points is None or len(points) == 0:
+            raise ValueError("WPLookupTable: no grid points for feature {0}".format(name))
+        axes.append((name, np.unique(np.asarray(points, dtype=np.float64))))
+    return axes
+
+
+def _get_spacing(points):
+    """Get the spacing of evenly spaced grid points, or ``None``."""
+    if len(points) < 2:
+        return None
+    differences = np.diff(points)
+    if np.allclose(differences, differences[0], rtol=1e-12, atol=0):
+        return float(differences[0])
+    return None
+
+
+def _get_corner_offsets(strides):
+    """Get the offsets in the flattened table of the corners of a cell, along axes with these strides.
+
+    The corners are in order of their position along each axis in turn, with the
+    first axis varying slowest.
+    """
+    offsets = np.zeros(1, dtype=np.intp)
+    for stride in strides:
+        offsets = (offsets[:, np.newaxis] + np.array([0, stride], dtype=np.intp)).ravel()
+    return offsets
+
+
+def _locate(points, spacing, values):
+    """Find the grid cell containing each value (clipped to the grid).
+
+    Returns
+    -------
+    lower : Numpy array of ints
+        The index of the grid point at or below each value.
+    fraction : Numpy array of floats
+        How far each value is towards the next grid point, from 0 to 1.
+    """
+    if len(points) == 1:
+        return np.zeros(values.shape, dtype=np.intp), np.zeros(values.shape, dtype=np.float64)
+    if spacing is not None:
+        position = (values - points[0]) / spacing
+    else:
+        lower = np.clip(np.searchsorted(points, values, side="right") - 1, 0, len(points) - 2)
+        position = lower + (values - points[lower]) / (points[lower + 1] - points[lower])
+    position = np.clip(position, 0, len(points) - 1)
+    lower = np.minimum(position.astype(np.intp), len(points) - 2)
+    return lower, position - lower
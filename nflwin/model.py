@@ -1,21 +1,24 @@
-"""Tools for creating and running the model."""
+"""Tools for creating and running the model.
+
+Only what's needed to load a saved model and make predictions with it is
+imported with this module. The rest (the default model's classifiers, the
+statistics used by ``validate_model``, and the compact, fused, lookup table
+and profiling tools) is imported by the methods that use it, so short-lived
+scoring jobs don't pay for it.
+"""
 from __future__ import print_function, division
 
+import collections
+import itertools
+import multiprocessing
 import os
+import threading
 
 import numpy as np
-from scipy import integrate
-from scipy import stats
+import pandas as pd
 
 import joblib
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.calibration import CalibratedClassifierCV
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.metrics import brier_score_loss
-from sklearn.neighbors import KernelDensity
-from sklearn.pipeline import Pipeline
 from sklearn.utils.validation import NotFittedError
 
 from . import preprocessing, utilities
@@ -32,13 +35,23 @@ class WPModel(object):
     copy_data : boolean (default=``True``)
         Whether or not to copy data when fitting and applying the model. Running the model
         in-place (``copy_data=False``) will be faster and have a smaller memory footprint,
-        but if not done carefully can lead to data integrity issues.
+        but the preprocessing steps of the default model then add (and replace) columns
+        in the DataFrame you pass in, so don't reuse it afterwards. The steps' ``copy``
+        parameters describe exactly what they modify, and
+        :func:`nflwin.profiling.account_copies` reports what each step copies.
+    cache_size : int (default=0)
+        If positive, ``predict_wp`` keeps the win probabilities of up to this many
+        game states in a least-recently-used cache, and only runs the plays it
+        hasn't seen recently through the model (see ``predict_wp``).
 
     Attributes
     ----------
     model : A Scikit-learn pipeline (or equivalent)
         The actual model used to compute WP. Upon initialization it will be set to
-        a default model, but can be overridden by the user.
+        a default model, but can be overridden by the user. Setting it (or
+        retraining it with ``train_model``) empties the caches of predictions made
+        with the old model; if you change the model some other way (e.g. by
+        setting its parameters), call ``clear_cache``.
     column_descriptions : dictionary
         A dictionary whose keys are the names of the columns used in the model, and the values are
         string descriptions of what the columns mean. Set at initialization to be the default model,
@@ -63,15 +76,23 @@ class WPModel(object):
         element of ``predicted_win_percents``.
     model_directory : string
         The directory where all models will be saved to or loaded from.
+    min_plays_per_job : int (default=10000)
+        The fewest plays ``predict_wp`` gives each parallel job (see ``predict_wp``).
 
     """
     model_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
     _default_model_filename = "default_model.nflwin"
+    #(``benchmarks/parallel_predict.py`` measures a parallel call of the default model
+    #as costing 1-3ms, and saving at most 0.4us per play with two jobs: it pays off
+    #above about 2,000 plays per job, and this leaves a margin for slower machines.)
+    min_plays_per_job = 10000
 
     def __init__(self,
-                 copy_data=True
+                 copy_data=True,
+                 cache_size=0
                 ):
         self.copy_data = copy_data
+        self._cache_size = cache_size
 
         self.model = self.create_default_pipeline()
         self._training_seasons = None
@@ -83,6 +104,61 @@ class WPModel(object):
         self._predicted_win_percents = None
         self._num_plays_used = None
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        #(The caches are rebuilt when the model is loaded, and locks can't be pickled.)
+        del state["_compact_model"]
+        del state["_prediction_cache"]
+        return state
+
+    def __setstate__(self, state):
+        #Models pickled by older versions store the pipeline as ``model``, and have no caches:
+        if "model" in state:
+            state["_model"] = state.pop("model")
+        state.setdefault("_cache_size", 0)
+        state.pop("_unfused_model", None)
+        state.pop("_compact_model_source", None)
+        self.__dict__.update(state)
+        self._clear_caches()
+
+    @property
+    def model(self):
+        return self._model
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self._clear_caches()
+
+    @property
+    def cache_size(self):
+        return self._cache_size
+    @cache_size.setter
+    def cache_size(self, cache_size):
+        self._cache_size = cache_size
+        self._prediction_cache = _PredictionCache(cache_size) if cache_size > 0 else None
+
+    def cache_info(self):
+        """Get statistics about the cache of ``predict_wp``.
+
+        Returns
+        -------
+        ``CacheInfo``
+            The hits, misses, maximum size and current size of the cache (all 0 if
+            there's no cache). Emptying the cache resets them.
+        """
+        if self._prediction_cache is None:
+            return CacheInfo(0, 0, 0, 0)
+        return self._prediction_cache.info()
+
+    def clear_cache(self):
+        """Empty the cache of ``predict_wp``, and anything else computed from ``model``."""
+        self._clear_caches()
+
+    def _clear_caches(self):
+        """Forget everything computed from the model (because it changed)."""
+        self._compact_model = None
+        #(A new cache rather than emptying the old one, which copies of this WPModel may share.)
+        self.cache_size = self._cache_size
 
     @property
     def training_seasons(self):
@@ -107,11 +183,54 @@ class WPModel(object):
     def num_plays_used(self):
         return self._num_plays_used
 
+    @property
+    def required_columns(self):
+        """The raw input columns needed by the model, or ``None`` if they can't be determined.
+
+        See :func:`nflwin.preprocessing.get_required_columns`.
+        """
+        return preprocessing.get_required_columns(self.model)
+
+    def profile(self, trace_memory=True):
+        """Record the time and memory used by each step of the model.
+
+        Use it as a context manager around calls to ``train_model``, ``validate_model``
+        or ``predict_wp``, then look at (or ship off) the resulting profile::
+
+          >>> with win_probability_model.profile() as profile: #doctest: +SKIP
+          ...     win_probability_model.predict_wp(plays)
+          >>> profile.summarize() #doctest: +SKIP
+
+        Parameters
+        ----------
+        trace_memory : boolean (default=``True``)
+            Whether to record the peak memory allocated by each step, which
+            slows the steps down a bit.
+
+        Returns
+        -------
+        A context manager, which yields a :class:`nflwin.profiling.PipelineProfile`.
+        Only the steps of ``model`` as of entering the context are profiled, and
+        since that's done by patching their methods, it isn't thread-safe (see
+        :func:`nflwin.profiling.profile_pipeline`).
+        """
+        from . import profiling
+
+        return profiling.profile_pipeline(self.model, trace_memory=trace_memory)
+
+    def _get_nfldb_columns(self, target_colname):
+        """Get the columns to query from nfldb, or ``None`` to query all of them."""
+        required_columns = self.required_columns
+        if required_columns is None:
+            return None
+        return required_columns + [target_colname]
+
     def train_model(self,
                     source_data="nfldb",
                     training_seasons=(2009, 2010, 2011, 2012, 2013, 2014),
                     training_season_types=("Regular", "Postseason"),
-                    target_colname="offense_won"):
+                    target_colname="offense_won",
+                    cache_directory=None):
         """Train the model.
 
         Once a modeling pipeline is set up (either the default or something
@@ -140,7 +259,8 @@ class WPModel(object):
         source_data : the string ``"nfldb"`` or a Pandas DataFrame (default=``"nfldb"``)
             The data to be used to train the model. If ``"nfldb"``, will query the nfldb
             database for the training data (note that this requires a correctly configured
-            installation of nfldb's database).
+            installation of nfldb's database). Only the columns in ``required_columns``
+            (plus the target) are queried.
         training_seasons : list of ints (default=``[2009, 2010, 2011, 2012, 2013, 2014]``)
             What seasons to use to train the model if getting data from the nfldb database.
             If ``source_data`` is not ``"nfldb"``, this argument will be ignored.
@@ -154,6 +274,10 @@ class WPModel(object):
             ``"nfldb"``, this argument will be ignored.
         target_colname : string or integer (default=``"offense_won"``)
             The name of the target variable column. 
+        cache_directory : string or ``None`` (default=``None``)
+            If querying from the nfldb database, a directory in which to cache the
+            query results (see :func:`nflwin.utilities.get_nfldb_play_data`). If
+            ``source_data`` is not ``"nfldb"``, this argument will be ignored.
 
         Returns
         -------
@@ -164,7 +288,9 @@ class WPModel(object):
         if isinstance(source_data, str):
             if source_data == "nfldb":
                 source_data = utilities.get_nfldb_play_data(season_years=training_seasons,
-                                                            season_types=training_season_types)
+                                                            season_types=training_season_types,
+                                                            cache_directory=cache_directory,
+                                                            columns=self._get_nfldb_columns(target_colname))
                 self._training_seasons = training_seasons
                 self._training_season_types = training_season_types
             else:
@@ -172,12 +298,14 @@ class WPModel(object):
         target_col = source_data[target_colname]
         feature_cols = source_data.drop(target_colname, axis=1)
         self.model.fit(feature_cols, target_col)
+        self._clear_caches()
 
     def validate_model(self,
                        source_data="nfldb",
                        validation_seasons=(2015,),
                        validation_season_types=("Regular", "Postseason"),
-                       target_colname="offense_won"):
+                       target_colname="offense_won",
+                       cache_directory=None):
         """Validate the model.
 
         Once a modeling pipeline is trained, a different dataset must be fed into the trained model
@@ -207,7 +335,8 @@ class WPModel(object):
         source_data : the string ``"nfldb"`` or a Pandas DataFrame (default=``"nfldb"``)
             The data to be used to train the model. If ``"nfldb"``, will query the nfldb
             database for the training data (note that this requires a correctly configured
-            installation of nfldb's database).
+            installation of nfldb's database). Only the columns in ``required_columns``
+            (plus the target) are queried.
         training_seasons : list of ints (default=``[2015]``)
             What seasons to use to validate the model if getting data from the nfldb database.
             If ``source_data`` is not ``"nfldb"``, this argument will be ignored.
@@ -221,6 +350,10 @@ class WPModel(object):
             ``"nfldb"``, this argument will be ignored.
         target_colname : string or integer (default=``"offense_won"``)
             The name of the target variable column. 
+        cache_directory : string or ``None`` (default=``None``)
+            If querying from the nfldb database, a directory in which to cache the
+            query results (see :func:`nflwin.utilities.get_nfldb_play_data`). If
+            ``source_data`` is not ``"nfldb"``, this argument will be ignored.
 
         Returns
         -------
@@ -255,7 +388,9 @@ class WPModel(object):
         if isinstance(source_data, str):
             if source_data == "nfldb":
                 source_data = utilities.get_nfldb_play_data(season_years=validation_seasons,
-                                                            season_types=validation_season_types)
+                                                            season_types=validation_season_types,
+                                                            cache_directory=cache_directory,
+                                                            columns=self._get_nfldb_columns(target_colname))
                 self._validation_seasons = validation_seasons
                 self._validation_season_types = validation_season_types
             else:
@@ -294,12 +429,14 @@ class WPModel(object):
         """
         abs_deviations = np.abs(predicted_win_percents - sample_probabilities)
         max_deviation = np.max(abs_deviations)
+        from scipy import integrate
+
         residual_area = integrate.simps(abs_deviations,
                                         sample_probabilities)
         return (max_deviation, residual_area)
                                        
 
-    def predict_wp(self, plays):
+    def predict_wp(self, plays, chunksize=None, n_jobs=1):
         """Estimate the win probability for a set of plays.
 
         Basically a simple wrapper around ``WPModel.model.predict_proba``,
@@ -310,6 +447,37 @@ class WPModel(object):
         ----------
         plays : Pandas DataFrame
             The input data to use to make the predictions.
+        chunksize : int or ``None`` (default=``None``)
+            If given, score the plays this many at a time, writing the results
+            into a single preallocated array. Any copies made by the model then only
+            ever hold one chunk, so the peak memory used doesn't depend on how many
+            plays there are. If ``None``, score all the plays at once. With
+            ``copy_data=False`` each chunk is copied once (instead of at every step),
+            and ``plays`` is left as-is. The results are the same as scoring all
+            the plays at once, up to floating-point rounding.
+        n_jobs : int (default=1)
+            If greater than 1, split the plays into ``n_jobs`` partitions (keeping
+            all the plays from each game together, if there's a ``gsis_id`` column)
+            and score them in parallel, in joblib's pool of worker processes
+            (started by the first call and kept for later ones, or whichever
+            ``joblib.parallel_backend`` is active). If -1, use as many jobs as
+            there are CPUs. The model and each partition (only the columns in
+            ``required_columns``, if they're known) are sent to the workers, and
+            each partition is scored in chunks of ``chunksize``, if given. Since a
+            parallel call has a fixed cost (a few milliseconds) and sending the plays
+            isn't free, each job gets at least ``min_plays_per_job`` plays: fewer
+            jobs are used for smaller batches, and batches of fewer than twice
+            that many plays are scored in this process.
+
+        If the model has a cache (``cache_size`` is positive) and ``plays`` is a
+        DataFrame, the plays are looked up in the cache by their values in
+        ``required_columns`` (or all their columns, if those aren't known), and
+        only the game states that aren't there are run through the model
+        (each once), then added to the cache. This helps when the same game states
+        are scored over and over, as in live use; for scoring a large set of plays
+        once it only adds the cost of looking up and storing every play (which
+        can double the time taken, if none of them are in the cache). See
+        ``cache_info`` for how well the cache is working.
 
         Returns
         -------
@@ -321,11 +489,271 @@ class WPModel(object):
         ------
         NotFittedError
             If the model hasn't been fit.
+        ValueError
+            If ``chunksize`` is less than 1.
         """
         if self.training_seasons is None:
             raise NotFittedError("Must fit model before predicting WP.")
+        if chunksize is not None and chunksize < 1:
+            raise ValueError("WPModel: chunksize must be at least 1, not {0}".format(chunksize))
+        if n_jobs < 0:
+            n_jobs = multiprocessing.cpu_count()
+        if self._prediction_cache is not None and isinstance(plays, pd.DataFrame):
+            return self._predict_wp_cached(plays, chunksize, n_jobs)
+        return self._predict_wp_uncached(plays, chunksize, n_jobs)
+
+    def _predict_wp_cached(self, plays, chunksize, n_jobs):
+        """Score plays, taking the win probabilities of the game states in the cache from it."""
+        cache = self._prediction_cache
+        columns = self.required_columns
+        if columns is None:
+            columns = plays.columns
+        keys = cache.make_keys(plays, columns)
+        win_probabilities, found = cache.get_many(keys)
+
+        #Score each missing game state once, in the order the plays came in (so the
+        #later plays end up the most recently used):
+        missing_positions = np.flatnonzero(~found)
+        inverse, missing_keys = _factorize(list(map(keys.__getitem__, missing_positions)))
+        if len(missing_keys) > 0:
+            first_positions = missing_positions[np.unique(inverse, return_index=True)[1]]
+            missing_win_probabilities = self._predict_wp_uncached(
+                self._get_rows(plays, first_positions), chunksize, n_jobs)
+            win_probabilities[missing_positions] = missing_win_probabilities[inverse]
+            cache.put_many(list(missing_keys), missing_win_probabilities.tolist())
+        cache.count(hits=len(plays) - len(missing_keys), misses=len(missing_keys))
+        return win_probabilities
+
+    def _predict_wp_uncached(self, plays, chunksize, n_jobs):
+        """Score plays with the model, in parallel or in chunks if asked to."""
+        n_jobs = min(n_jobs, len(plays) // max(self.min_plays_per_job, 1))
+        if n_jobs > 1:
+            return _predict_wp_parallel(self, plays, chunksize, n_jobs)
+        if chunksize is None:
+            return self.model.predict_proba(plays)[:,1]
+
+        win_probabilities = np.empty(len(plays), dtype=np.float64)
+        for start in range(0, len(plays), chunksize):
+            chunk = self._get_rows(plays, slice(start, start + chunksize))
+            win_probabilities[start:start + chunksize] = self.model.predict_proba(chunk)[:,1]
+
+        return win_probabilities
+
+    def _get_rows(self, plays, rows):
+        """Get some of the plays (by position), making sure the model won't modify ``plays``."""
+        #(By position, since the index of a DataFrame may not be a range.)
+        plays_subset = plays.iloc[rows] if hasattr(plays, "iloc") else plays[rows]
+        if not self.copy_data:
+            #The steps would otherwise modify a view of ``plays``:
+            plays_subset = plays_subset.copy()
+        return plays_subset
+
+    def predict_wp_single(self, **game_state):
+        """Estimate the win probability for a single play, as fast as possible.
+
+        Scoring one play with ``predict_wp`` means building a one-row DataFrame and
+        running it through the whole pipeline, which takes milliseconds. This instead
+        uses a :class:`nflwin.compact.CompactWPModel` made from the fitted model
+        (the first time it's called after the model changes), which computes the
+        features and probability directly in a few microseconds. The results agree
+        with ``predict_wp`` up to floating-point rounding.
+
+        Parameters
+        ----------
+        **game_state
+            The value of each column in ``required_columns`` for the play, e.g.
+            ``offense_team="NE", home_team="NE", curr_home_score=7, ...``.
 
-        return self.model.predict_proba(plays)[:,1]
+        Returns
+        -------
+        float
+            Predicted probability that the offensive team will go on to win the game.
+
+        Raises
+        ------
+        NotFittedError
+            If the model hasn't been fit.
+        TypeError
+            If the model can't be converted to a ``CompactWPModel`` (see
+            :meth:`nflwin.compact.CompactWPModel.from_pipeline`).
+        """
+        return self._get_compact_model().predict_wp_single(**game_state)
+
+    def export_compact(self, filename):
+        """Export the fitted model to a small file that can be scored with only NumPy.
+
+        The file holds the parameters of a :class:`nflwin.compact.CompactWPModel`
+        (the feature definitions, the coefficients of each logistic regression and
+        their calibrations), with nothing pickled. Load it with
+        :meth:`nflwin.compact.CompactWPModel.load`, which doesn't need Pandas or
+        Scikit-learn, and score plays with its ``predict_wp_single`` or ``predict_wp``.
+
+        Parameters
+        ----------
+        filename : string or file-like object
+            Where to save the model. Unlike ``save_model``, this is a full path.
+            ``.npz`` is added to the filename if it doesn't already end with it.
+
+        Returns
+        -------
+        ``None``
+
+        Raises
+        ------
+        NotFittedError
+            If the model hasn't been fit.
+        TypeError
+            If the model can't be converted to a ``CompactWPModel`` (see
+            :meth:`nflwin.compact.CompactWPModel.from_pipeline`).
+        """
+        self._get_compact_model().save(filename)
+
+    def build_lookup_table(self, grid=None, directory=None, check_plays=None, n_jobs=1, **kwargs):
+        """Precompute the win probabilities over a grid of game states.
+
+        Scoring plays with the resulting :class:`nflwin.lookup.WPLookupTable`
+        just computes their features and reads (and interpolates) the table,
+        and needs only NumPy. The errors of the table against this model are
+        measured as it's built, and kept in its ``max_error`` and ``mean_error``.
+
+        Parameters
+        ----------
+        grid : dict or ``None`` (default=``None``)
+            The grid points for each feature of the model. If ``None``, use
+            ``nflwin.lookup.DEFAULT_GRID``, which covers the default model.
+        directory : string or ``None`` (default=``None``)
+            If given, build the table in a memory-mapped file in this directory
+            and save it there, to be loaded with :meth:`nflwin.lookup.WPLookupTable.load`.
+        check_plays : Pandas DataFrame or ``None`` (default=``None``)
+            Plays to measure the error of the table on. If ``None``, use random
+            points inside the grid.
+        n_jobs : int (default=1)
+            How many jobs to score the grid with, as for ``predict_wp``.
+        **kwargs
+            Passed to :meth:`nflwin.lookup.WPLookupTable.from_model`.
+
+        Returns
+        -------
+        ``nflwin.lookup.WPLookupTable``
+
+        Raises
+        ------
+        NotFittedError
+            If the model hasn't been fit.
+        """
+        if self.training_seasons is None:
+            raise NotFittedError("Must fit model before predicting WP.")
+        from . import lookup
+
+        return lookup.WPLookupTable.from_model(self, grid=grid, directory=directory,
+                                               check_plays=check_plays, n_jobs=n_jobs, **kwargs)
+
+    def fuse_model(self, check_plays=None, tolerance=1e-10):
+        """Fuse the steps of the fitted model, so it scores plays in fewer passes.
+
+        The preprocessing steps of the default model each copy the DataFrame
+        to add or change a column, and its calibrated classifier keeps a
+        logistic regression and an isotonic calibration for each fold, which it
+        runs one after the other. This replaces the preprocessing steps with a
+        :class:`nflwin.preprocessing.FusedFeatureBuilder` (see
+        :func:`nflwin.preprocessing.compile_pipeline`; steps that can't be compiled,
+        or already are, are kept as they are), and the final step with a
+        :class:`nflwin.fused.FusedCalibratedClassifier`, which scores all the folds
+        with one matrix product and a ``np.interp`` per fold (see
+        :func:`nflwin.fused.fuse_pipeline`). The predictions are the same up
+        to floating-point rounding.
+
+        Both fused steps can be fit, so ``train_model`` trains the fused model
+        (with the same classifier settings), and it stays fused.
+
+        Parameters
+        ----------
+        check_plays : Pandas DataFrame or ``None`` (default=``None``)
+            If given, score these plays with both the original and the fused
+            model, and only replace the model if they agree.
+        tolerance : float (default=1e-10)
+            The largest difference in win probability allowed on ``check_plays``.
+
+        Returns
+        -------
+        float or ``None``
+            The largest difference in win probability on ``check_plays``, or
+            ``None`` if none were given.
+
+        Raises
+        ------
+        NotFittedError
+            If the model hasn't been fit.
+        TypeError
+            If the final step of the model can't be fused.
+        ValueError
+            If the fused model differs from the original by more than
+            ``tolerance`` on ``check_plays`` (the model is then left as it was).
+        """
+        if self.training_seasons is None:
+            raise NotFittedError("Must fit model before predicting WP.")
+
+        from . import fused
+
+        fused_model = self.model
+        if len(fused_model.steps) > 1:
+            try:
+                fused_model = preprocessing.compile_pipeline(fused_model)
+            except TypeError:
+                #(Steps not from ``nflwin.preprocessing``, or already compiled.)
+                pass
+        fused_model = fused.fuse_pipeline(fused_model)
+        max_difference = None
+        if check_plays is not None:
+            #(Each model gets its own copy, in case the steps modify the plays.)
+            original_wp = self.model.predict_proba(self._get_rows(check_plays, slice(None)))[:,1]
+            fused_wp = fused_model.predict_proba(self._get_rows(check_plays, slice(None)))[:,1]
+            max_difference = float(np.max(np.abs(original_wp - fused_wp))) if len(fused_wp) > 0 else 0.
+            if not max_difference <= tolerance:
+                raise ValueError("WPModel: fused model differs from the original by up to {0} "
+                                 "(tolerance {1})".format(max_difference, tolerance))
+        self.model = fused_model
+        return max_difference
+
+    def _get_compact_model(self):
+        """Get a ``CompactWPModel`` of the fitted model, making one if needed."""
+        if self.training_seasons is None:
+            raise NotFittedError("Must fit model before predicting WP.")
+
+        if self._compact_model is None:
+            from . import compact
+
+            self._compact_model = compact.CompactWPModel.from_pipeline(self.model)
+        return self._compact_model
+
+    def predict_wp_iter(self, plays):
+        """Estimate the win probabilities for chunks of plays, one chunk at a time.
+
+        Useful for scoring data that doesn't fit in memory, for instance
+        the chunks from :func:`nflwin.utilities.iter_nfldb_play_data`.
+        As when ``predict_wp`` is given a ``chunksize``, with ``copy_data=False``
+        each chunk is copied once before it's scored, and left as-is.
+
+        Parameters
+        ----------
+        plays : iterable of Pandas DataFrames
+            The chunks of input data to use to make the predictions.
+
+        Returns
+        -------
+        generator of Numpy arrays
+            The predicted probability that the offensive team in each play of
+            each chunk will go on to win the game, computed as each chunk is read.
+
+        Raises
+        ------
+        NotFittedError
+            If the model hasn't been fit.
+        """
+        if self.training_seasons is None:
+            raise NotFittedError("Must fit model before predicting WP.")
+
+        return (self.model.predict_proba(self._get_rows(chunk, slice(None)))[:,1] for chunk in plays)
 
 
     def plot_validation(self, axis=None, **kwargs):
@@ -369,6 +797,7 @@ class WPModel(object):
     @staticmethod
     def _test_distribution(sample_probabilities, predicted_win_percents, num_plays_used):
         """Based off assuming the data at each probability is a Bernoulli distribution."""
+        from scipy import stats
 
         #Get the p-values:
         p_values = [stats.binom_test(np.round(predicted_win_percents[i] * num_plays_used[i]),
@@ -381,6 +810,8 @@ class WPModel(object):
     def _compute_predicted_percentages(actual_results, predicted_win_probabilities):
         """Compute the sample percentages from a validation data set.
         """
+        from sklearn.neighbors import KernelDensity
+
         kde_offense_won = KernelDensity(kernel='gaussian', bandwidth=0.01).fit(
             (predicted_win_probabilities[(actual_results == 1)])[:, np.newaxis])
         kde_total = KernelDensity(kernel='gaussian', bandwidth=0.01).fit(
@@ -407,6 +838,9 @@ class WPModel(object):
         This can be run any time a new default pipeline is required,
         and either set to the ``model`` attribute or used independently.
         """
+        from sklearn.calibration import CalibratedClassifierCV
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import Pipeline
 
         steps = []
 
@@ -493,12 +927,19 @@ class WPModel(object):
         joblib.dump(self, os.path.join(self.model_directory, filename))
 
     @classmethod
-    def load_model(cls, filename=None):
+    def load_model(cls, filename=None, mmap_mode=None):
         """Load a saved WPModel.
 
+        Each call reads the file again and returns a new instance. To share one
+        instance of a model around a process, use ``get_model``.
+
         Parameters
         ----------
-        Same as ``save_model``.
+        filename : string (default=None)
+            Same as ``save_model``.
+        mmap_mode : ``None`` or string (default=``None``)
+            If given, memory-map the arrays in the model instead of reading them
+            into memory, as in ``joblib.load`` (e.g. ``"r"`` for read-only).
 
         Returns
         -------
@@ -507,7 +948,39 @@ class WPModel(object):
         if filename is None:
             filename = cls._default_model_filename
             
-        return joblib.load(os.path.join(cls.model_directory, filename))
+        return joblib.load(os.path.join(cls.model_directory, filename), mmap_mode=mmap_mode)
+
+    @classmethod
+    def get_model(cls, filename=None, mmap_mode="r"):
+        """Get a saved WPModel, loading it only the first time it's asked for.
+
+        Models are kept in ``nflwin.model.model_registry``, which is shared by the
+        whole process: every call for the same file gets the same instance,
+        until the file changes on disk (when it's loaded again) or the model is
+        evicted from the registry for not having been used in a while. Load
+        models in a parent process before forking workers, and the workers share
+        them too.
+
+        Since the instance is shared, don't modify it (e.g. by retraining it);
+        use ``load_model`` to get a private copy instead.
+
+        Parameters
+        ----------
+        filename : string (default=None)
+            Same as ``save_model``.
+        mmap_mode : ``None`` or string (default=``"r"``)
+            As for ``load_model``. By default the arrays in the model are
+            memory-mapped read-only, so processes that load the same file share
+            their memory.
+
+        Returns
+        -------
+        ``nflwin.WPModel`` instance.
+        """
+        if filename is None:
+            filename = cls._default_model_filename
+
+        return model_registry.load(os.path.join(cls.model_directory, filename), mmap_mode=mmap_mode)
 
     @staticmethod
     def _brier_loss_scorer(estimator, X, y):
@@ -515,5 +988,314 @@ class WPModel(object):
 
         For use in GridSearchCV, instead of accuracy.
         """
+        from sklearn.metrics import brier_score_loss
+
         predicted_positive_probabilities = estimator.predict_proba(X)[:, 1]
         return 1. - brier_score_loss(y, predicted_positive_probabilities)
+
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+CacheInfo.__doc__ = """Statistics about the cache of ``WPModel.predict_wp``.
+
+Attributes
+----------
+hits : int
+    How many plays were scored without running them through the model
+    (because their game state was in the cache, or earlier in the same call).
+misses : int
+    How many game states were run through the model.
+maxsize : int
+    The most game states the cache holds.
+currsize : int
+    How many game states the cache holds now.
+"""
+
+
+#The kinds of values in game state keys (see ``_PredictionCache.make_keys``):
+_NUMBER_KEY, _CODE_KEY, _MISSING_KEY = 0, 1, 2
+
+
+class _PredictionCache(object):
+    """A bounded least-recently-used cache of win probabilities, keyed by game state."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._win_probabilities = collections.OrderedDict()
+        #(For each column, the codes given to its non-numeric values.)
+        self._value_codes = collections.defaultdict(dict)
+        #(The cache may be shared by threads serving predictions.)
+        self._lock = threading.Lock()
+
+    def make_keys(self, plays, columns):
+        """Pack the game state of each play into a bytes key, without looping over the plays.
+
+        Each value takes 9 bytes: a float64 and a byte saying what it is. Numbers
+        are stored as they are (as floats, so e.g. 1 and 1.0 are the same game state),
+        other values (e.g. team names) as a code for the value in that column, and
+        missing values (which aren't equal to themselves) all the same way.
+
+        Returns
+        -------
+        list of bytes
+            The key of each play.
+        """
+        values = np.empty((len(plays), len(columns)), dtype=np.float64)
+        kinds = np.full((len(plays), len(columns)), _NUMBER_KEY, dtype=np.uint8)
+        for i, colname in enumerate(columns):
+            column = plays[colname].values
+            if _is_exact_float(column):
+                values[:, i] = column
+                is_missing = np.isnan(values[:, i])
+            else:
+                values[:, i] = self._get_value_codes(colname, column)
+                kinds[:, i] = _CODE_KEY
+                is_missing = values[:, i] < 0
+            values[is_missing, i] = 0.
+            kinds[is_missing, i] = _MISSING_KEY
+        #(Adding 0 makes -0.0 the same as 0.0.)
+        values += 0.
+        packed_keys = np.hstack([values.view(np.uint8), kinds])
+        return packed_keys.view("V{0:d}".format(packed_keys.shape[1])).ravel().tolist()
+
+    def _get_value_codes(self, colname, column):
+        """Code the values of a column (-1 if missing), giving new values the next unused codes."""
+        if isinstance(column, pd.Categorical):
+            positions, uniques = column.codes, column.categories
+        else:
+            positions, uniques = _factorize(column)
+        with self._lock:
+            value_codes = self._value_codes[colname]
+            codes = [value_codes.setdefault(value, len(value_codes)) for value in uniques]
+        #(Missing values have a position of -1, which picks out the -1 appended at the end.)
+        return np.array(codes + [-1], dtype=np.float64)[positions]
+
+    def get_many(self, keys):
+        """Look up keys, marking the ones found as most recently used (in order).
+
+        Returns
+        -------
+        win_probabilities : Numpy array
+            The cached win probability for each key (NaN where not found).
+        found : Numpy array of booleans
+            Whether each key was in the cache.
+        """
+        with self._lock:
+            cache = self._win_probabilities
+            #(Looked up with ``map``, rather than a loop, since there may be a lot of keys.)
+            win_probabilities = np.fromiter(
+                map(cache.get, keys, itertools.repeat(np.nan, len(keys))),
+                dtype=np.float64, count=len(keys))
+            #(Win probabilities are never NaN, so NaNs are the keys that weren't found.)
+            found = ~np.isnan(win_probabilities)
+            _move_to_end(cache, itertools.compress(keys, found))
+        return win_probabilities, found
+
+    def put_many(self, keys, win_probabilities):
+        """Add (new) win probabilities, dropping the least recently used ones beyond ``maxsize``."""
+        #(Only the most recent ones would be kept anyway.)
+        keys, win_probabilities = keys[-self.maxsize:], win_probabilities[-self.maxsize:]
+        with self._lock:
+            cache = self._win_probabilities
+            cache.update(zip(keys, win_probabilities))
+            for i in range(len(cache) - self.maxsize):
+                cache.popitem(last=False)
+
+    def count(self, hits, misses):
+        """Add to the hit and miss counts."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def info(self):
+        """Get the cache statistics as a ``CacheInfo``."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._win_probabilities))
+
+
+def _move_to_end(ordered_dict, keys):
+    """Move keys of an ``OrderedDict`` to the end (``move_to_end``, which Python 2 doesn't have)."""
+    if hasattr(ordered_dict, "move_to_end"):
+        collections.deque(map(ordered_dict.move_to_end, keys), maxlen=0)
+    else:
+        for key in keys:
+            ordered_dict[key] = ordered_dict.pop(key)
+
+
+def _factorize(values):
+    """Get the position of each (non-missing) value in the unique values, and the unique values.
+
+    Like ``pd.factorize`` (missing values have a position of -1, and the unique values are
+    in the order they first appear), which takes a tenth of a millisecond even for a few
+    values, so small arrays are done in Python instead.
+    """
+    if len(values) < 1000:
+        return _factorize_small(values)
+    return pd.factorize(np.asarray(values, dtype=object))
+
+
+def _factorize_small(values):
+    """Like ``pd.factorize``, in pure Python (for a small array)."""
+    positions = np.empty(len(values), dtype=np.intp)
+    uniques = []
+    unique_positions = {}
+    for i, value in enumerate(values):
+        if value is None or value != value:
+            positions[i] = -1
+            continue
+        position = unique_positions.get(value)
+        if position is None:
+            position = unique_positions[value] = len(uniques)
+            uniques.append(value)
+        positions[i] = position
+    return positions, uniques
+
+
+def _is_exact_float(column):
+    """Whether an array is numeric, and converting it to float64 doesn't change any values."""
+    kind = column.dtype.kind
+    if kind in "bf":
+        return True
+    if kind not in "iu":
+        return False
+    #(Larger integers might be rounded to the same float.)
+    return len(column) == 0 or np.abs(column).max() <= 2 ** 53
+
+
+class ModelRegistry(object):
+    """Saved models loaded once and shared, evicting the least recently used.
+
+    ``nflwin.model.model_registry`` is the registry used by ``WPModel.get_model``.
+
+    Parameters
+    ----------
+    maxsize : int (default=8)
+        The most models to keep loaded. Can be changed at any time; the least
+        recently used models are evicted on the next load.
+    """
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._models = collections.OrderedDict()
+        #(Only held to look up and update ``_models``, so models that are already
+        #loaded can be found while another one is loading.)
+        self._lock = threading.Lock()
+        #(A lock per model, held while loading it, so threads asking for the same
+        #model only load it once.)
+        self._load_locks = {}
+
+    def __len__(self):
+        return len(self._models)
+
+    def load(self, path, mmap_mode=None):
+        """Get the model saved at a path, loading it if it isn't loaded or the file has changed.
+
+        Parameters
+        ----------
+        path : string
+            The path of the saved model.
+        mmap_mode : ``None`` or string (default=``None``)
+            As for ``WPModel.load_model``. Models loaded with different
+            ``mmap_mode`` are kept separately.
+
+        Returns
+        -------
+        ``nflwin.WPModel`` instance.
+        """
+        key = (os.path.abspath(path), mmap_mode)
+        file_stats = os.stat(path)
+        file_version = (file_stats.st_mtime, file_stats.st_size)
+        wpmodel = self._get_loaded(key, file_version)
+        if wpmodel is not None:
+            return wpmodel
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            #(Another thread may have loaded it while this one waited.)
+            wpmodel = self._get_loaded(key, file_version)
+            if wpmodel is not None:
+                return wpmodel
+            wpmodel = joblib.load(path, mmap_mode=mmap_mode)
+            with self._lock:
+                self._models.pop(key, None)
+                self._models[key] = (file_version, wpmodel)
+                while len(self._models) > max(self.maxsize, 1):
+                    evicted_key = self._models.popitem(last=False)[0]
+                    self._load_locks.pop(evicted_key, None)
+        return wpmodel
+
+    def _get_loaded(self, key, file_version):
+        """Get a loaded model if it's up to date, marking it as most recently used, or ``None``."""
+        with self._lock:
+            version, wpmodel = self._models.get(key, (None, None))
+            if version != file_version:
+                return None
+            #(Putting it back moves it to the most recently used end.)
+            self._models[key] = self._models.pop(key)
+            return wpmodel
+
+    def clear(self):
+        """Forget all the loaded models."""
+        with self._lock:
+            self._models.clear()
+            self._load_locks.clear()
+
+model_registry = ModelRegistry()
+
+
+def _predict_wp_parallel(wpmodel, plays, chunksize, n_jobs):
+    """Score partitions of the plays with joblib's pool of worker processes, in input order."""
+    partitions = _partition_plays(plays, n_jobs)
+    columns = wpmodel.required_columns
+    if columns is not None and hasattr(plays, "columns") and set(columns) <= set(plays.columns):
+        #(Only the columns the model uses are sent to the workers.)
+        plays = plays[list(columns)]
+    #(The pool is kept between calls, and shut down when Python exits; see
+    #``joblib.parallel_backend`` to use another one.)
+    partition_win_probabilities = joblib.Parallel(n_jobs=len(partitions))(
+        joblib.delayed(_predict_wp_partition)(wpmodel, wpmodel._get_rows(plays, partition), chunksize)
+        for partition in partitions)
+
+    win_probabilities = np.empty(len(plays), dtype=np.float64)
+    for partition, partition_win_probability in zip(partitions, partition_win_probabilities):
+        win_probabilities[partition] = partition_win_probability
+    return win_probabilities
+
+
+def _predict_wp_partition(wpmodel, plays, chunksize):
+    """Score one partition of the plays from a call to ``_predict_wp_parallel``."""
+    return wpmodel._predict_wp_uncached(plays, chunksize, 1)
+
+
+def _partition_plays(plays, num_partitions):
+    """Split plays into (at most) ``num_partitions`` partitions of similar sizes.
+
+    If there is a ``gsis_id`` column, the plays from each game all go into the same
+    partition (with the games in order of their first play).
+
+    Returns
+    -------
+    list of slices or Numpy arrays
+        The positions of the rows in each partition: slices for contiguous
+        partitions, or arrays of positions otherwise.
+    """
+    num_partitions = min(num_partitions, len(plays))
+    if not hasattr(plays, "columns") or "gsis_id" not in plays.columns:
+        boundaries = np.linspace(0, len(plays), num_partitions + 1).round().astype(np.int64)
+        return [slice(start, stop) for start, stop in zip(boundaries[:-1], boundaries[1:])]
+
+    game_codes = pd.factorize(plays["gsis_id"])[0]
+    game_sizes = np.bincount(game_codes)
+    #Assign each game to a partition based on how many plays come before it:
+    game_starts = np.cumsum(game_sizes) - game_sizes
+    game_partitions = (game_starts * num_partitions) // len(plays)
+    play_partitions = game_partitions[game_codes]
+
+    partitions = []
+    for partition_number in np.unique(play_partitions):
+        positions = np.flatnonzero(play_partitions == partition_number)
+        if positions[-1] - positions[0] + 1 == len(positions):
+            partitions.append(slice(positions[0], positions[-1] + 1))
+        else:
+            partitions.append(positions)
+    return partitions
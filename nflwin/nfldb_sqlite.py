@@ -0,0 +1,286 @@
+"""Build SQLite databases with the parts of the nfldb schema that NFLWin uses.
+
+Normally NFLWin gets its data from a Postgres database set up by ``nfldb``,
+which makes it hard to test or profile the ingestion code on a machine without one.
+This module creates a SQLite stand-in with the ``game``, ``play``, and ``agg_play``
+tables (only the columns NFLWin queries), filled with either synthetic data or
+your own fixture data. Composite nfldb types are stored as their text representations,
+(e.g. ``"(Q1,152)"`` for a ``play.time`` and ``"(-15)"`` for a ``play.yardline``),
+which is the same format Postgres returns them in.
+
+The database can then be used anywhere nfldb is, by passing its url as the
+``database_url`` argument of :func:`nflwin.utilities.get_nfldb_play_data` (and the
+other ingestion functions)::
+
+    >>> from nflwin import nfldb_sqlite, utilities
+    >>> url = nfldb_sqlite.create_database("nfldb.sqlite", season_years=[2015]) #doctest: +SKIP
+    >>> plays = utilities.get_nfldb_play_data(season_years=[2015], database_url=url) #doctest: +SKIP
+"""
+from __future__ import print_function, division
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+#The columns of each table, in the order they're created:
+GAME_COLUMNS = ["gsis_id", "season_year", "season_type", "finished",
+                "home_team", "away_team", "home_score", "away_score"]
+PLAY_COLUMNS = ["gsis_id", "drive_id", "play_id", "time", "pos_team",
+                "yardline", "down", "yards_to_go"]
+AGG_PLAY_COLUMNS = ["gsis_id", "drive_id", "play_id",
+                    "fumbles_rec_tds", "kicking_rec_tds", "passing_tds", "receiving_tds",
+                    "rushing_tds", "kicking_xpmade", "passing_twoptm", "receiving_twoptm",
+                    "rushing_twoptm", "kicking_fgm", "defense_frec_tds", "defense_int_tds",
+                    "defense_misc_tds", "kickret_tds", "puntret_tds", "defense_safe"]
+
+_TEAMS = ["ARI", "ATL", "BAL", "BUF", "CAR", "CHI", "CIN", "CLE",
+          "DAL", "DEN", "DET", "GB", "HOU", "IND", "JAC", "KC",
+          "MIA", "MIN", "NE", "NO", "NYG", "NYJ", "OAK", "PHI",
+          "PIT", "SD", "SEA", "SF", "STL", "TB", "TEN", "WAS"]
+
+#The month games in each part of the season are (nominally) played in, used for the gsis_ids:
+_SEASON_TYPE_MONTHS = {"Preseason": 8, "Regular": 9, "Postseason": 12}
+
+
+def create_database(filename, tables=None, **synthetic_kwargs):
+    """Create a SQLite database with the nfldb tables NFLWin uses.
+
+    Parameters
+    ----------
+    filename : string
+        The path to the SQLite database file. Any existing ``game``, ``play``,
+        and ``agg_play`` tables in it are replaced.
+    tables : dict of Pandas DataFrames or ``None`` (default=``None``)
+        The contents of the tables, keyed by table name (``"game"``, ``"play"``, and
+        ``"agg_play"``), with the columns in ``GAME_COLUMNS``, ``PLAY_COLUMNS``, and
+        ``AGG_PLAY_COLUMNS`` respectively. If ``None``, synthetic data are
+        generated with ``make_synthetic_tables``.
+    **synthetic_kwargs
+        Passed on to ``make_synthetic_tables`` if ``tables`` is ``None``.
+
+    Returns
+    -------
+    string
+        The SQLAlchemy url of the database (see ``get_database_url``).
+
+    Raises
+    ------
+    ValueError
+        If any of the tables are missing, or are missing columns.
+    """
+    if tables is None:
+        tables = make_synthetic_tables(**synthetic_kwargs)
+
+    table_columns = {"game": GAME_COLUMNS, "play": PLAY_COLUMNS, "agg_play": AGG_PLAY_COLUMNS}
+    for table_name, column_names in table_columns.items():
+        if table_name not in tables:
+            raise ValueError("create_database: no data for the '{0}' table".format(table_name))
+        missing_columns = [colname for colname in column_names
+                           if colname not in tables[table_name].columns]
+        if len(missing_columns) > 0:
+            raise ValueError("create_database: '{0}' table is missing columns {1}"
+                             "".format(table_name, missing_columns))
+
+    connection = sqlite3.connect(filename)
+    try:
+        for table_name, column_names in table_columns.items():
+            tables[table_name][column_names].to_sql(table_name, connection,
+                                                    if_exists="replace", index=False)
+        connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS game_key ON game (gsis_id)")
+        for table_name in ["play", "agg_play"]:
+            connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0}_key ON {0} "
+                               "(gsis_id, drive_id, play_id)".format(table_name))
+        connection.commit()
+    finally:
+        connection.close()
+
+    return get_database_url(filename)
+
+
+def get_database_url(filename):
+    """Get the SQLAlchemy url of a SQLite database file.
+
+    Notes
+    -----
+    The path is made absolute, so the url works regardless of the working directory.
+    In-memory databases (``":memory:"``) aren't supported, as every connection
+    to one gets its own empty database.
+    """
+    return "sqlite:///" + os.path.abspath(filename)
+
+
+def make_synthetic_tables(season_years=(2015,), season_types=("Regular",),
+                          games_per_season=16, drives_per_game=24, random_state=None):
+    """Generate synthetic nfldb data.
+
+    The games aren't realistic, but they contain everything the NFLWin queries
+    depend on: plays in every quarter (plus ``Pregame``, ``Half``, and ``Final`` plays,
+    which the queries filter out), kickoffs, downs, touchdowns, extra points
+    (some of which are missing from the play-by-play, as happens in nfldb), field goals,
+    safeties, defensive touchdowns, and the occasional tie or unfinished game.
+    Final scores in the ``game`` table are consistent with the plays.
+
+    Parameters
+    ----------
+    season_years : list of ints (default=``[2015]``)
+        The seasons to make games for.
+    season_types : list of strings (default=``["Regular"]``)
+        The parts of each season to make games for
+        ("Preseason", "Regular", and/or "Postseason").
+    games_per_season : int (default=16)
+        The number of games in each part of each season.
+    drives_per_game : int (default=24)
+        The number of drives in each game (the number of plays depends on the drives).
+    random_state : int, ``numpy.random.RandomState``, or ``None`` (default=``None``)
+        Seeds the random number generator, for reproducible data.
+
+    Returns
+    -------
+    dict of Pandas DataFrames
+        The ``"game"``, ``"play"``, and ``"agg_play"`` tables, suitable for ``create_database``.
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    game_rows = []
+    play_rows = []
+    points_rows = []
+    for season_year in season_years:
+        for season_type in season_types:
+            for game_number in range(games_per_season):
+                gsis_id = "{0}{1:02d}{2:02d}{3:02d}".format(
+                    season_year, _SEASON_TYPE_MONTHS[season_type],
+                    10 + game_number // 100, game_number % 100)
+                home_team, away_team = random_state.choice(_TEAMS, size=2, replace=False)
+                game_plays, game_points = _make_synthetic_game(gsis_id, home_team, away_team,
+                                                               drives_per_game, random_state)
+                play_rows.extend(game_plays)
+                points_rows.extend(game_points)
+
+                home_score, away_score = _compute_final_scores(game_plays, game_points,
+                                                               home_team, away_team)
+                game_rows.append({"gsis_id": gsis_id, "season_year": season_year,
+                                  "season_type": season_type,
+                                  "finished": random_state.uniform() > 0.02,
+                                  "home_team": home_team, "away_team": away_team,
+                                  "home_score": home_score, "away_score": away_score})
+
+    play_df = pd.DataFrame(play_rows, columns=PLAY_COLUMNS)
+    agg_play_df = play_df[["gsis_id", "drive_id", "play_id"]].copy()
+    play_stats = np.array([stat for stat, value in points_rows], dtype=object)
+    play_values = np.array([value for stat, value in points_rows])
+    for stat in AGG_PLAY_COLUMNS[3:]:
+        agg_play_df[stat] = np.where(play_stats == stat, play_values, 0)
+
+    return {"game": pd.DataFrame(game_rows, columns=GAME_COLUMNS),
+            "play": play_df,
+            "agg_play": agg_play_df}
+
+
+def _make_synthetic_game(gsis_id, home_team, away_team, num_drives, random_state):
+    """Make the plays of one synthetic game.
+
+    Returns a list of play rows and a parallel list of ``(stat, value)`` pairs giving
+    the scoring stat (if any, otherwise ``None``) recorded in ``agg_play`` for each play.
+    """
+    plays = []
+    points = []
+    game_seconds = 3600.
+    seconds_per_drive = game_seconds / num_drives
+
+    def add_play(drive_id, elapsed, offense, yardline, down, yards_to_go, stat=None, value=1):
+        quarter = min(int(elapsed // 900), 3)
+        plays.append([gsis_id, drive_id, len(plays) * 20 + 36,
+                      "(Q{0},{1})".format(quarter + 1, int(elapsed - quarter * 900)),
+                      offense, None if yardline is None else "({0})".format(yardline),
+                      down, yards_to_go])
+        points.append((stat, value))
+
+    plays.append([gsis_id, 0, 1, "(Pregame,0)", away_team, None, None, 0])
+    points.append((None, 1))
+
+    teams = [away_team, home_team]
+    for drive_number in range(num_drives):
+        offense = teams[drive_number % 2]
+        drive_id = drive_number + 1
+        drive_start = drive_number * seconds_per_drive
+
+        #Halftime happens between the drives on either side of the half:
+        if drive_start >= 1800 > (drive_number - 1) * seconds_per_drive:
+            plays.append([gsis_id, drive_id, len(plays) * 20 + 36, "(Half,0)",
+                          offense, None, None, 0])
+            points.append((None, 1))
+
+        add_play(drive_id, drive_start, offense, -15, None, 0)
+
+        num_downs = random_state.randint(2, 10)
+        yardline = int(random_state.randint(-40, -10))
+        for play_number in range(num_downs):
+            elapsed = drive_start + (play_number + 1) * seconds_per_drive / (num_downs + 2)
+            yardline = min(yardline + int(random_state.randint(-2, 12)), 49)
+            add_play(drive_id, elapsed, offense, yardline, play_number % 4 + 1,
+                     int(random_state.randint(1, 11)))
+
+        outcome = random_state.uniform()
+        last_elapsed = drive_start + (num_downs + 1) * seconds_per_drive / (num_downs + 2)
+        if outcome < 0.3:
+            #Offensive touchdown, usually followed by an extra point (which is
+            #sometimes missing from the data):
+            points[-1] = (random_state.choice(["passing_tds", "rushing_tds"]), 1)
+            extra_point = random_state.uniform()
+            if extra_point < 0.85:
+                add_play(drive_id, last_elapsed, offense, 48, None, 0, "kicking_xpmade", 1)
+            elif extra_point < 0.9:
+                add_play(drive_id, last_elapsed, offense, 48, None, 0, "rushing_twoptm", 1)
+        elif outcome < 0.5:
+            add_play(drive_id, last_elapsed, offense, yardline, 4,
+                     int(random_state.randint(1, 11)), "kicking_fgm", 1)
+        elif outcome < 0.53:
+            add_play(drive_id, last_elapsed, offense, -49, 3, 10, "defense_safe", 1)
+        elif outcome < 0.56:
+            add_play(drive_id, last_elapsed, offense, yardline, 3, 10, "defense_int_tds", 1)
+
+    #End the game with a kneel-down, so that the score at the start of the last play is the final score:
+    add_play(num_drives, game_seconds - 1, teams[(num_drives - 1) % 2], 20, 1, 10)
+    plays.append([gsis_id, num_drives, len(plays) * 20 + 36, "(Final,0)",
+                  teams[(num_drives - 1) % 2], None, None, 0])
+    points.append((None, 1))
+
+    return plays, points
+
+
+#The points scored by the offense and defense from each scoring stat:
+_OFFENSE_STAT_POINTS = {"passing_tds": 6, "rushing_tds": 6, "kicking_xpmade": 1,
+                        "rushing_twoptm": 2, "kicking_fgm": 3}
+_DEFENSE_STAT_POINTS = {"defense_safe": 2, "defense_int_tds": 6}
+
+
+def _compute_final_scores(plays, points, home_team, away_team):
+    """Compute the final score of a synthetic game.
+
+    Touchdowns followed directly by a kickoff are assumed to have had a
+    successful extra point that's missing from the data, in the same way as
+    :func:`nflwin.utilities.get_nfldb_play_data` does.
+    """
+    scores = {home_team: 0, away_team: 0}
+    in_game_plays = [(play, play_points) for play, play_points in zip(plays, points)
+                     if play[3].split(",")[0][1:] not in ("Pregame", "Half", "Final")]
+    for play_index, (play, (stat, value)) in enumerate(in_game_plays):
+        offense = play[4]
+        defense = away_team if offense == home_team else home_team
+        if stat in _OFFENSE_STAT_POINTS:
+            scoring_team, play_points = offense, _OFFENSE_STAT_POINTS[stat] * value
+        elif stat in _DEFENSE_STAT_POINTS:
+            scoring_team, play_points = defense, _DEFENSE_STAT_POINTS[stat] * value
+        else:
+            continue
+
+        if play_points == 6 and play_index + 1 < len(in_game_plays):
+            next_yardline = in_game_plays[play_index + 1][0][5]
+            if next_yardline is not None and int(next_yardline[1:-1]) < 0:
+                play_points += 1
+        scores[scoring_team] += play_points
+
+    return scores[home_team], scores[away_team]
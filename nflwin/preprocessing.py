@@ -1,11 +1,22 @@
-"""Tools to get raw data ready for modeling."""
+"""Tools to get raw data ready for modeling.
+
+All of the transformers work on Pandas DataFrames by default, identifying columns
+by name. They can also work on Numpy arrays, which avoids the overhead of Pandas
+when scoring lots of plays: with a 2D array, columns are identified by their
+integer index and any new columns are appended after the existing ones, while with
+a structured array columns are identified by their field names. Which kind of data a
+transformer works on is set when it is fit, and it will raise a ``TypeError``
+if given a different kind afterwards. In array mode ``transform``
+always returns a new array, regardless of ``copy``.
+"""
 from __future__ import print_function, division
 
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 
 from sklearn.base import BaseEstimator
-from sklearn.preprocessing import OneHotEncoder
 from sklearn.utils.validation import NotFittedError
 
 class ComputeElapsedTime(BaseEstimator):
@@ -25,19 +36,33 @@ class ComputeElapsedTime(BaseEstimator):
     total_time_colname : string (default="total_elapsed_time")
         What column name to store the total elapsed time under.
     copy : boolean (default=True)
-        Whether to add the new column in place.
+        If ``False``, add the new column to the input DataFrame in place (and
+        return it) rather than to a copy.
+    handle_unknown : "error" (default), "nan", or a number
+        What to do with quarters that aren't in ``quarter_to_second_mapping``: raise
+        a ``TypeError``, set the total elapsed time to NaN, or set the total elapsed
+        time to the given value. Missing quarters always result in NaN.
+
+    Notes
+    -----
+    The total elapsed time is stored as integers, unless there are NaNs.
     """
+    _input_colname_params = ("quarter_colname", "quarter_time_colname")
+    _output_colname_params = ("total_time_colname",)
+
     def __init__(self, quarter_colname, quarter_time_colname,
                  quarter_to_second_mapping={"Q1": 0, "Q2": 900, "Q3": 1800, "Q4": 2700,
                                             "OT": 3600, "OT2": 4500, "OT3": 5400},
-                 total_time_colname="total_elapsed_time", copy=True):
+                 total_time_colname="total_elapsed_time", copy=True, handle_unknown="error"):
         self.quarter_colname = quarter_colname
         self.quarter_time_colname = quarter_time_colname
         self.quarter_to_second_mapping = quarter_to_second_mapping
         self.total_time_colname = total_time_colname
         self.copy = copy
+        self.handle_unknown = handle_unknown
 
     def fit(self, X, y=None):
+        self._input_mode = _get_data_mode(X)
         return self
 
     
@@ -46,7 +71,7 @@ class ComputeElapsedTime(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -63,9 +88,11 @@ class ComputeElapsedTime(BaseEstimator):
             If ``quarter_colname`` or ``quarter_time_colname`` don't exist, or
             if ``total_time_colname`` **does** exist.
         TypeError
-            If the total time elapsed is not a numeric column, which typically indicates
-            that the mapping did not apply to every row.
+            If any quarters aren't in ``quarter_to_second_mapping`` and ``handle_unknown``
+            is ``"error"``.
         """
+        if _get_input_mode(self, X) != "dataframe":
+            return _transform_array(self, X)
 
         if self.quarter_colname not in X.columns:
             raise KeyError("ComputeElapsedTime: quarter_colname {0} does not exist in dataset."
@@ -81,14 +108,37 @@ class ComputeElapsedTime(BaseEstimator):
         if self.copy:
             X = X.copy()
 
-        try:
-            time_elapsed = X[self.quarter_colname].replace(self.quarter_to_second_mapping) + X[self.quarter_time_colname]
-        except TypeError:
+        X[self.total_time_colname] = self._compute_total_time(X[self.quarter_colname],
+                                                              X[self.quarter_time_colname])
+
+        return X
+
+    def _compute_total_time(self, quarters, quarter_times):
+        """Add the start time of each quarter (looked up in a single gather) to the time in the quarter."""
+        #Models pickled before handle_unknown existed always raised an error:
+        handle_unknown = getattr(self, "handle_unknown", "error")
+        quarter_start_times, is_unknown = _apply_mapping(quarters, self.quarter_to_second_mapping,
+                                                         handle_unknown)
+        if is_unknown.any() and _is_error_policy(handle_unknown):
             raise TypeError("ComputeElapsedTime: Total time elapsed not numeric. Check your mapping from quarter name to time.")
 
-        X[self.total_time_colname] = time_elapsed.astype(np.int)
+        time_elapsed = quarter_start_times + np.asarray(quarter_times)
+        if is_unknown.any():
+            time_elapsed[is_unknown] = np.nan if _is_nan_policy(handle_unknown) else handle_unknown
 
-        return X
+        if pd.isnull(time_elapsed).any():
+            return time_elapsed
+        return time_elapsed.astype(np.int64)
+
+    def _transform_columns(self, columns):
+        """Equivalent of ``transform`` on an ``OrderedDict`` of column arrays (see ``FusedFeatureBuilder``)."""
+        _check_input_columns(self, columns, ["quarter_colname", "quarter_time_colname"],
+                             ["total_time_colname"])
+
+        columns[self.total_time_colname] = self._compute_total_time(columns[self.quarter_colname],
+                                                                    columns[self.quarter_time_colname])
+
+        return columns
     
 
 class ComputeIfOffenseIsHome(BaseEstimator):
@@ -104,8 +154,12 @@ class ComputeIfOffenseIsHome(BaseEstimator):
     offense_home_team_colname : string (default="is_offense_home")
         What column to store whether or not the offense was the home team.
     copy : boolean (default=True)
-        Whether to add the new column in place.
+        If ``False``, add the new column to the input DataFrame in place (and
+        return it) rather than to a copy.
     """
+    _input_colname_params = ("offense_team_colname", "home_team_colname")
+    _output_colname_params = ("offense_home_team_colname",)
+
     def __init__(self, offense_team_colname,
                  home_team_colname,
                  offense_home_team_colname="is_offense_home",
@@ -116,6 +170,7 @@ class ComputeIfOffenseIsHome(BaseEstimator):
         self.copy = copy
 
     def fit(self, X, y=None):
+        self._input_mode = _get_data_mode(X)
         return self
 
     def transform(self, X, y=None):
@@ -123,7 +178,7 @@ class ComputeIfOffenseIsHome(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -140,6 +195,8 @@ class ComputeIfOffenseIsHome(BaseEstimator):
             If ``offense_team_colname`` or ``home_team_colname`` don't exist, or
             if ``offense_home_team_colname`` **does** exist.
         """
+        if _get_input_mode(self, X) != "dataframe":
+            return _transform_array(self, X)
 
         if self.home_team_colname not in X.columns:
             raise KeyError("ComputeIfOffenseWon: home_team_colname {0} does not exist in dataset."
@@ -159,6 +216,16 @@ class ComputeIfOffenseIsHome(BaseEstimator):
 
         return X
 
+    def _transform_columns(self, columns):
+        """Equivalent of ``transform`` on an ``OrderedDict`` of column arrays (see ``FusedFeatureBuilder``)."""
+        _check_input_columns(self, columns, ["home_team_colname", "offense_team_colname"],
+                             ["offense_home_team_colname"])
+
+        columns[self.offense_home_team_colname] = (np.asarray(columns[self.home_team_colname]) ==
+                                                   np.asarray(columns[self.offense_team_colname]))
+
+        return columns
+
 
 class MapToInt(BaseEstimator):
     """Map a column of values to integers.
@@ -172,7 +239,12 @@ class MapToInt(BaseEstimator):
     colname : string
         The name of the column to perform the mapping on.
     copy : boolean (default=True)
-        If ``False``, apply the mapping in-place.
+        If ``False``, replace the column in the input DataFrame in place (and
+        return it) rather than in a copy.
+    handle_unknown : "passthrough" (default), "nan", "error", or a number
+        What to do with values that weren't seen during ``fit``: leave them
+        as they are, map them to NaN, raise a ``ValueError``, or map them to
+        the given value.
 
     Attributes
     ----------
@@ -182,15 +254,18 @@ class MapToInt(BaseEstimator):
 
     Note
     ----
-    The ``transform`` method DOES NOT CHECK to see if the input
-    DataFrame only contains values in ``mapping``. Any values not
-    in ``mapping`` will be left alone, which can cause subtle bugs
-    if you're not careful.
+    Missing values are never put in ``mapping``, and are always mapped to NaN.
+    The mapped column is stored as integers, unless there are NaNs or unknown values
+    passed through.
     """
+    _input_colname_params = ("colname",)
+    _output_colname_params = ()
 
-    def __init__(self, colname, copy=True):
+
+    def __init__(self, colname, copy=True, handle_unknown="passthrough"):
         self.colname = colname
         self.copy = copy
+        self.handle_unknown = handle_unknown
         self.mapping = None
 
     def fit(self, X, y=None):
@@ -198,7 +273,7 @@ class MapToInt(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -214,17 +289,15 @@ class MapToInt(BaseEstimator):
             If ``colname`` is not in ``X``.
 
         """
-        if self.colname not in X.columns:
+        self._input_mode = _get_data_mode(X)
+        columns = X if self._input_mode == "dataframe" else _array_to_columns(X)
+        if self.colname not in columns:
             raise KeyError("MapStringsToInt: Required column {0} "
                            "not present in data".format(self.colname))
-        unique_values = X[self.colname].unique()
+        unique_values = pd.unique(columns[self.colname])
+        is_missing = pd.isnull(unique_values)
         
-        self.mapping = {unique_values[i]: i for i in range(len(unique_values))}
-        
-        try:
-            del self.mapping[np.nan]
-        except KeyError:
-            pass
+        self.mapping = {unique_values[i]: i for i in range(len(unique_values)) if not is_missing[i]}
         
         return self
 
@@ -233,7 +306,7 @@ class MapToInt(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -241,7 +314,7 @@ class MapToInt(BaseEstimator):
 
         Returns
         -------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             The input DataFrame, with the mapping applied.
 
         Raises
@@ -250,9 +323,14 @@ class MapToInt(BaseEstimator):
             If ``transform`` is called before ``fit``.
         KeyError
             If ``colname`` is not in ``X``.
+        ValueError
+            If ``X`` contains values that weren't seen during ``fit``, and
+            ``handle_unknown`` is ``"error"``.
         """
         if not self.mapping:
             raise NotFittedError("MapStringsToInt: Must fit before transform.")
+        if _get_input_mode(self, X) != "dataframe":
+            return _transform_array(self, X)
         
         if self.colname not in X.columns:
             raise KeyError("MapStringsToInt: Required column {0} "
@@ -261,9 +339,43 @@ class MapToInt(BaseEstimator):
         if self.copy:
             X = X.copy()
 
-        X[self.colname].replace(self.mapping, inplace=True)
+        X[self.colname] = self._map_column(X[self.colname])
 
         return X
+
+    def _map_column(self, column):
+        """Apply the mapping to a column with a single lookup-table gather."""
+        #Models pickled before handle_unknown existed left unknown values alone:
+        handle_unknown = getattr(self, "handle_unknown", "passthrough")
+        is_passthrough = isinstance(handle_unknown, str) and handle_unknown == "passthrough"
+        mapped_column, is_unknown = _apply_mapping(column, self.mapping,
+                                                   "nan" if is_passthrough else handle_unknown)
+        if is_unknown.any() and _is_error_policy(handle_unknown):
+            raise ValueError("MapStringsToInt: column {0} contains values not seen in fit: {1}"
+                             .format(self.colname, list(pd.unique(np.asarray(column)[is_unknown]))))
+        if is_unknown.any() and is_passthrough:
+            unknown_values = np.asarray(column)[is_unknown]
+            if unknown_values.dtype.kind in "biuf":
+                mapped_column[is_unknown] = unknown_values
+                if unknown_values.dtype.kind in "biu" and not np.isnan(mapped_column).any():
+                    mapped_column = mapped_column.astype(np.int64)
+            else:
+                is_mapped = pd.notnull(mapped_column)
+                passthrough_column = mapped_column.astype(object)
+                passthrough_column[is_mapped] = mapped_column[is_mapped].astype(np.int64)
+                passthrough_column[is_unknown] = unknown_values
+                mapped_column = passthrough_column
+        return mapped_column
+
+    def _transform_columns(self, columns):
+        """Equivalent of ``transform`` on an ``OrderedDict`` of column arrays (see ``FusedFeatureBuilder``)."""
+        if not self.mapping:
+            raise NotFittedError("MapStringsToInt: Must fit before transform.")
+        _check_input_columns(self, columns, ["colname"], [])
+
+        columns[self.colname] = self._map_column(columns[self.colname])
+
+        return columns
         
 
 class OneHotEncoderFromDataFrame(BaseEstimator):
@@ -284,8 +396,21 @@ class OneHotEncoderFromDataFrame(BaseEstimator):
         Whether to raise an error or ignore if an unknown categorical feature
         is present during transform.
     copy : boolean (default=True)
-        If ``False``, apply the encoding in-place.
+        If ``False``, delete the categorical columns from the input DataFrame and add
+        the encoded columns to it in place (and return it). Pandas still copies the
+        other columns that were stored in the same block as a deleted column
+        (generally, columns of the same dtype).
+    sparse : boolean (default=False)
+        If ``True``, ``transform`` returns a SciPy CSR matrix instead of a
+        DataFrame: the columns that aren't encoded (in their original order),
+        followed by the encoded columns. This saves a lot of memory when there
+        are many categories (e.g. teams, or teams in each season), but since the
+        output no longer has column names this must be the last step before
+        the model, which has to accept sparse input (like ``LogisticRegression``).
     """
+    _input_colname_params = ("categorical_feature_names",)
+    _output_colname_params = ()
+
 
     @property
     def dtype(self):
@@ -302,25 +427,39 @@ class OneHotEncoderFromDataFrame(BaseEstimator):
     def handle_unknown(self, handle_unknown):
         self._handle_unknown = handle_unknown
         self.onehot.handle_unknown = self._handle_unknown
+
+    @property
+    def sparse(self):
+        #(Encoders pickled before the sparse option existed are always dense.)
+        return getattr(self, "_sparse", False)
+    @sparse.setter
+    def sparse(self, sparse):
+        self._sparse = sparse
+        self.onehot.sparse = self._sparse
         
     def __init__(self,
                  categorical_feature_names="all",
                  dtype=np.float,
                  handle_unknown="error",
-                 copy=True):
+                 copy=True,
+                 sparse=False):
+        #(Importing sklearn.preprocessing is slow, and most users of this module don't need it.)
+        from sklearn.preprocessing import OneHotEncoder
+
         self.onehot = OneHotEncoder(sparse=False, n_values="auto",
                                     categorical_features="all") #We'll subset the DF
         self.categorical_feature_names = categorical_feature_names
         self.dtype = dtype
         self.handle_unknown = handle_unknown
         self.copy = copy
+        self.sparse = sparse
 
     def fit(self, X, y=None):
         """Convert the column names to indices, then compute the one hot encoding.
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -331,11 +470,19 @@ class OneHotEncoderFromDataFrame(BaseEstimator):
         self : For compatibility with Scikit-learn's ``Pipeline``.
         """
 
-        if self.categorical_feature_names == "all":
-            self.categorical_feature_names = X.columns
+        self._input_mode = _get_data_mode(X)
+        columns = X if self._input_mode == "dataframe" else _array_to_columns(X)
+
+        if isinstance(self.categorical_feature_names, str) and self.categorical_feature_names == "all":
+            self.categorical_feature_names = (X.columns if self._input_mode == "dataframe"
+                                              else list(columns.keys()))
 
         #Get all columns that need to be encoded:
-        data_to_encode = X[self.categorical_feature_names]
+        if self._input_mode == "dataframe":
+            data_to_encode = X[self.categorical_feature_names]
+        else:
+            data_to_encode = np.column_stack([columns[colname]
+                                              for colname in self.categorical_feature_names])
             
 
         self.onehot.fit(data_to_encode)
@@ -347,7 +494,7 @@ class OneHotEncoderFromDataFrame(BaseEstimator):
         
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -356,24 +503,123 @@ class OneHotEncoderFromDataFrame(BaseEstimator):
         Returns
         -------
         X : Pandas DataFrame, of shape(number of plays, number of new features)
-            The input DataFrame, with the encoding applied.
+            The input DataFrame, with the encoding applied. If ``sparse`` is ``True``,
+            a SciPy CSR matrix with the same values instead.
         """
-        if self.copy:
-            X = X.copy()
-        
+        if self.sparse:
+            _get_input_mode(self, X)
+            columns = _array_to_columns(X) if isinstance(X, np.ndarray) else X
+            return self._transform_sparse(columns)
+        if _get_input_mode(self, X) != "dataframe":
+            return _transform_array(self, X)
+
         data_to_transform = X[self.categorical_feature_names]
         transformed_data = self.onehot.transform(data_to_transform)
 
+        if self.copy:
+            #(Dropping the columns already makes a new DataFrame.)
+            X = X.drop(self.categorical_feature_names, axis=1)
+        else:
+            #Deleting the columns one at a time, rather than with drop (which copies
+            #every other column into a new DataFrame):
+            for colname in self.categorical_feature_names:
+                del X[colname]
+
         #TODO (AndrewRook): Find good column names for the encoded columns.
-        colnames = ["onehot_col{0}".format(i+1) for i in range(transformed_data.shape[1])]
-        #Create a dataframe from the transformed columns (setting the index is critical for
-        #merging with data containing non-standard indexes)
-        transformed_df = pd.DataFrame(transformed_data, columns=colnames, index=X.index)
-        
-        X.drop(self.categorical_feature_names, axis=1, inplace=True)
-        X[transformed_df.columns] = transformed_df
+        for i in range(transformed_data.shape[1]):
+            X["onehot_col{0}".format(i+1)] = transformed_data[:, i]
         
         return X
+
+    def _transform_sparse(self, columns):
+        """Encode a DataFrame (or ``OrderedDict`` of column arrays) into a CSR matrix."""
+        from scipy import sparse as sp
+
+        #Converting the other columns first, so a column that isn't numeric can be named:
+        passthrough_data = []
+        for colname in columns.keys():
+            if colname in self.categorical_feature_names:
+                continue
+            try:
+                passthrough_data.append(np.asarray(columns[colname], dtype=self.dtype))
+            except (TypeError, ValueError):
+                raise ValueError("OneHotEncoderFromDataFrame: column {0} (of dtype {1}) can't be "
+                                 "converted to {2}".format(colname, columns[colname].dtype,
+                                                           np.dtype(self.dtype).name))
+
+        try:
+            data_to_encode = np.column_stack([columns[colname] for colname in
+                                              self.categorical_feature_names])
+        except KeyError:
+            raise KeyError("OneHotEncoderFromDataFrame: data missing required columns {0}"
+                           .format(list(self.categorical_feature_names)))
+        encoded_data = self.onehot.transform(data_to_encode)
+
+        if len(passthrough_data) == 0:
+            return sp.csr_matrix(encoded_data)
+        return sp.hstack([sp.csr_matrix(np.column_stack(passthrough_data)), encoded_data],
+                         format="csr")
+
+    @property
+    def _num_encoded_columns(self):
+        """The number of columns produced by the encoding."""
+        return len(self.onehot.active_features_)
+
+    def _encode_into(self, columns, out):
+        """Write the encoding of an ``OrderedDict`` of column arrays into ``out``.
+
+        This gives the same result as ``OneHotEncoder.transform``, but without
+        building an intermediate sparse matrix.
+        """
+        from sklearn.utils.validation import check_array
+
+        try:
+            data_to_encode = check_array(np.column_stack([columns[colname] for colname in
+                                                          self.categorical_feature_names]),
+                                         dtype=np.int64)
+        except KeyError:
+            raise KeyError("OneHotEncoderFromDataFrame: data missing required columns {0}"
+                           .format(list(self.categorical_feature_names)))
+        if np.any(data_to_encode < 0):
+            raise ValueError("X needs to contain only non-negative integers.")
+
+        is_known = data_to_encode < self.onehot.n_values_
+        if not is_known.all():
+            if self.handle_unknown not in ['error', 'ignore']:
+                raise ValueError("handle_unknown should be either error or "
+                                 "unknown got %s" % self.handle_unknown)
+            if self.handle_unknown == 'error':
+                raise ValueError("unknown categorical feature present %s "
+                                 "during transform." % data_to_encode[~is_known])
+
+        #Map each value to its column in the output (values never seen in fit are dropped):
+        active_features = self.onehot.active_features_
+        feature_indices = data_to_encode + self.onehot.feature_indices_[:-1]
+        output_indices = np.searchsorted(active_features, feature_indices)
+        is_active = is_known & (active_features[np.minimum(output_indices, len(active_features) - 1)] ==
+                                feature_indices)
+
+        out[...] = 0
+        row_indices = np.repeat(np.arange(len(out)), data_to_encode.shape[1]).reshape(data_to_encode.shape)
+        out[row_indices[is_active], output_indices[is_active]] = 1
+
+        return out
+
+    def _transform_columns(self, columns):
+        """Equivalent of ``transform`` on an ``OrderedDict`` of column arrays (see ``FusedFeatureBuilder``)."""
+        if self.sparse:
+            raise TypeError("OneHotEncoderFromDataFrame: sparse encoding must be the last step "
+                            "before the model")
+        num_rows = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+        encoded_data = self._encode_into(columns, np.empty((num_rows, self._num_encoded_columns),
+                                                           dtype=self.dtype))
+
+        for colname in self.categorical_feature_names:
+            del columns[colname]
+        for i in range(encoded_data.shape[1]):
+            columns["onehot_col{0}".format(i+1)] = encoded_data[:, i]
+
+        return columns
             
     
 
@@ -392,8 +638,12 @@ class CreateScoreDifferential(BaseEstimator):
         The name of column containing the score differential. Must not already
         exist in the DataFrame.
     copy : boolean (default = ``True``)
-        If ``False``, add the score differential in place.
+        If ``False``, add the score differential to the input DataFrame in place
+        (and return it) rather than to a copy.
     """
+    _input_colname_params = ("home_score_colname", "away_score_colname", "offense_home_colname")
+    _output_colname_params = ("score_differential_colname",)
+
     def __init__(self, home_score_colname,
                  away_score_colname,
                  offense_home_colname,
@@ -406,6 +656,7 @@ class CreateScoreDifferential(BaseEstimator):
         self.copy = copy
 
     def fit(self, X, y=None):
+        self._input_mode = _get_data_mode(X)
         return self
 
     def transform(self, X, y=None):
@@ -413,7 +664,7 @@ class CreateScoreDifferential(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -424,6 +675,9 @@ class CreateScoreDifferential(BaseEstimator):
         X : Pandas DataFrame, of shape(number of plays, number of features + 1)
             The input DataFrame, with the score differential column added.
         """
+        if _get_input_mode(self, X) != "dataframe":
+            return _transform_array(self, X)
+
         try:
             score_differential = ((X[self.home_score_colname] - X[self.away_score_colname]) *
                                   (2 * X[self.offense_home_colname] - 1))
@@ -442,6 +696,24 @@ class CreateScoreDifferential(BaseEstimator):
         X[self.score_differential_colname] = score_differential
 
         return X
+
+    def _transform_columns(self, columns):
+        """Equivalent of ``transform`` on an ``OrderedDict`` of column arrays (see ``FusedFeatureBuilder``)."""
+        try:
+            score_differential = ((columns[self.home_score_colname] - columns[self.away_score_colname]) *
+                                  (2 * columns[self.offense_home_colname] - 1))
+        except KeyError:
+            raise KeyError("CreateScoreDifferential: data missing required column. Must "
+                           "include columns named {0}, {1}, and {2}".format(self.home_score_colname,
+                                                                            self.away_score_colname,
+                                                                            self.offense_home_colname))
+        if self.score_differential_colname in columns:
+            raise KeyError("CreateScoreDifferential: column {0} already in DataFrame, and can't "
+                           "be used for the score differential".format(self.score_differential_colname))
+
+        columns[self.score_differential_colname] = score_differential
+
+        return columns
         
 
 
@@ -463,9 +735,15 @@ class CheckColumnNames(BaseEstimator):
         will obtain every column in the DataFrame passed to the
         ``fit`` method.
     copy : boolean (default=``True``)
-        If ``False``, add the score differential in place.
+        If ``False``, and the input DataFrame already has exactly ``column_names``
+        in order, return it as-is. Otherwise (since Pandas can't select columns
+        without copying them) the output is always a new DataFrame, and the input
+        is never modified.
        
     """
+    _input_colname_params = ("column_names",)
+    _output_colname_params = ()
+
     def __init__(self, column_names=None, copy=True):
         self.column_names = column_names
         self.copy = copy
@@ -482,7 +760,7 @@ class CheckColumnNames(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -492,8 +770,12 @@ class CheckColumnNames(BaseEstimator):
         -------
         self : For compatibility with Scikit-learn's ``Pipeline``. 
         """
+        self._input_mode = _get_data_mode(X)
         if not self.user_specified_columns:
-            self.column_names = X.columns
+            if self._input_mode == "dataframe":
+                self.column_names = X.columns
+            else:
+                self.column_names = list(_array_to_columns(X).keys())
             self._fit = True
 
         return self
@@ -503,7 +785,7 @@ class CheckColumnNames(BaseEstimator):
 
         Parameters
         ----------
-        X : Pandas DataFrame, of shape(number of plays, number of features)
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
             NFL play data.
         y : Numpy array, with length = number of plays, or None
             1 if the home team won, 0 if not.
@@ -525,13 +807,361 @@ class CheckColumnNames(BaseEstimator):
         """
         if not self._fit:
             raise NotFittedError("CheckColumnName: Call 'fit' before 'transform")
+        if _get_input_mode(self, X) != "dataframe":
+            return _transform_array(self, X)
         
+        if any(colname not in X.columns for colname in self.column_names):
+            raise KeyError("CheckColumnName: DataFrame does not have required columns. "
+                           "Must contain at least {0}".format(self.column_names))
+
         if self.copy:
-            X = X.copy()
+            #(Selecting the columns already copies them.)
+            return X[self.column_names]
+        if X.columns.equals(pd.Index(self.column_names)):
+            return X
+        return X.reindex(columns=self.column_names, copy=False)
+
+    def _transform_columns(self, columns):
+        """Equivalent of ``transform`` on an ``OrderedDict`` of column arrays (see ``FusedFeatureBuilder``)."""
+        if not self._fit:
+            raise NotFittedError("CheckColumnName: Call 'fit' before 'transform")
 
         try:
-                
-            return X[self.column_names]
+            return OrderedDict((colname, columns[colname]) for colname in self.column_names)
         except KeyError:
             raise KeyError("CheckColumnName: DataFrame does not have required columns. "
                            "Must contain at least {0}".format(self.column_names))
+
+
+class FusedFeatureBuilder(BaseEstimator):
+    """Run a sequence of the transformers in this module in a single pass.
+
+    Chaining the transformers in a ``Pipeline`` means that every step copies the
+    whole DataFrame (unless ``copy=False``) just to add or change a column. This
+    transformer instead reads the columns it needs out of the input DataFrame (or array) once,
+    runs each step on just the affected columns, and writes every output feature
+    directly into one preallocated array. The result is identical to running the
+    steps one after the other, then converting the output DataFrame to an array
+    of ``dtype``.
+
+    Parameters
+    ----------
+    steps : list of transformers
+        Instances of the transformers in this module, in the order they should be run.
+        They can either be fit already (see ``compile_pipeline``) or fit with this
+        transformer's ``fit`` method.
+    dtype : number type (default=``np.float64``)
+        The dtype of the output array.
+    """
+
+    def __init__(self, steps, dtype=np.float64):
+        self.steps = steps
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        """Fit each of the steps, exactly as if they were in a ``Pipeline``.
+
+        Parameters
+        ----------
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
+            NFL play data.
+        y : Numpy array, with length = number of plays, or None
+            1 if the home team won, 0 if not.
+            (Used as part of Scikit-learn's ``Pipeline``)
+
+        Returns
+        -------
+        self : For compatibility with Scikit-learn's ``Pipeline``.
+        """
+        for i, step in enumerate(self.steps):
+            step.fit(X, y)
+            if i < len(self.steps) - 1:
+                X = step.transform(X)
+
+        return self
+
+    def transform(self, X, y=None):
+        """Compute the features.
+
+        Parameters
+        ----------
+        X : Pandas DataFrame or Numpy array, of shape(number of plays, number of features)
+            NFL play data.
+        y : Numpy array, with length = number of plays, or None
+            1 if the home team won, 0 if not.
+            (Used as part of Scikit-learn's ``Pipeline``)
+
+        Returns
+        -------
+        Numpy array, of shape(number of plays, number of output features)
+            The features, in the same order as the columns of the DataFrame
+            produced by running the steps one after the other. The array is stored
+            in column-major (Fortran) order. If the last step is a sparse
+            ``OneHotEncoderFromDataFrame``, a SciPy CSR matrix instead.
+
+        Raises
+        ------
+        KeyError, TypeError, ValueError, or NotFittedError
+            Under the same conditions as the individual steps.
+        """
+        data_mode = _get_data_mode(X)
+        for step in self.steps:
+            _get_input_mode(step, X)
+        if data_mode != "dataframe":
+            columns = _array_to_columns(X)
+        else:
+            #Without a CheckColumnNames step every input column ends up in the output:
+            required_columns = None
+            if any(isinstance(step, CheckColumnNames) for step in self.steps):
+                required_columns = _get_required_columns(self.steps)
+            if required_columns is None:
+                input_colnames = X.columns
+            else:
+                missing_columns = [colname for colname in required_columns if colname not in X.columns]
+                if len(missing_columns) > 0:
+                    raise KeyError("FusedFeatureBuilder: data missing required columns {0}"
+                                   .format(missing_columns))
+                input_colnames = [colname for colname in X.columns if colname in required_columns]
+            #(Categorical columns are kept as Categoricals, so that mappings can use their codes.)
+            columns = OrderedDict((colname, X[colname].values) for colname in input_colnames)
+
+        #If the last step is a one-hot encoding it can write straight into the output:
+        steps = list(self.steps)
+        final_encoder = None
+        if len(steps) > 0 and isinstance(steps[-1], OneHotEncoderFromDataFrame):
+            final_encoder = steps.pop()
+
+        for step in steps:
+            columns = step._transform_columns(columns)
+            if data_mode == "ndarray":
+                #Columns are identified by their position:
+                columns = OrderedDict(enumerate(columns.values()))
+
+        if final_encoder is not None and final_encoder.sparse:
+            return final_encoder._transform_sparse(columns)
+
+        num_encoded_columns = 0
+        passthrough_colnames = list(columns.keys())
+        if final_encoder is not None:
+            num_encoded_columns = final_encoder._num_encoded_columns
+            passthrough_colnames = [colname for colname in passthrough_colnames
+                                    if colname not in final_encoder.categorical_feature_names]
+
+        #(Column-major, like the array made from a DataFrame, so downstream matrix products
+        #are computed in the same order.)
+        features = np.empty((len(X), len(passthrough_colnames) + num_encoded_columns),
+                            dtype=self.dtype, order="F")
+        for i, colname in enumerate(passthrough_colnames):
+            features[:, i] = columns[colname]
+        if final_encoder is not None:
+            final_encoder._encode_into(columns, features[:, len(passthrough_colnames):])
+
+        return features
+
+
+def compile_pipeline(pipeline):
+    """Replace the preprocessing steps of a fitted pipeline with a ``FusedFeatureBuilder``.
+
+    Parameters
+    ----------
+    pipeline : Scikit-learn ``Pipeline``
+        A fitted pipeline whose steps (other than the last one, the model) are all
+        transformers from this module, like the one made by
+        :meth:`nflwin.model.WPModel.create_default_pipeline`.
+
+    Returns
+    -------
+    Scikit-learn ``Pipeline``
+        A pipeline with two steps, ``"build_features"`` and the final step of ``pipeline``,
+        which gives identical results. The transformers and model are shared with
+        ``pipeline``, not copied.
+
+    Raises
+    ------
+    TypeError
+        If any of the steps can't be fused.
+    """
+    transformers = [step for name, step in pipeline.steps[:-1]]
+    for transformer in transformers:
+        if not hasattr(transformer, "_transform_columns"):
+            raise TypeError("compile_pipeline: can't fuse step of type {0}"
+                            .format(type(transformer).__name__))
+
+    from sklearn.pipeline import Pipeline
+
+    return Pipeline([("build_features", FusedFeatureBuilder(transformers)), pipeline.steps[-1]])
+
+
+def _apply_mapping(column, mapping, handle_unknown="nan"):
+    """Map the values of a column through a dict with a single vectorized lookup.
+
+    The values of ``mapping`` are put in a lookup table, indexed by the position
+    of each value in the keys (found by hashing, or, for a categorical column, by
+    mapping its categories once and then gathering with its codes).
+
+    Returns
+    -------
+    mapped_column : Numpy array
+        The mapped values. Missing and unknown values are set to NaN (so the
+        array will be floats if there are any), other than unknown values under
+        a numeric ``handle_unknown`` policy, which are set to that number.
+    is_unknown : Numpy array of booleans
+        Which values were neither missing nor in ``mapping``.
+    """
+    _is_nan_policy(handle_unknown) #Check that the policy is valid.
+    keys = pd.Index(list(mapping.keys()))
+    lookup_table = np.asarray(list(mapping.values()))
+
+    if pd.api.types.is_categorical_dtype(column):
+        categorical = column.values if isinstance(column, pd.Series) else column
+        #(Missing values have a code of -1, which picks out the -1 appended at the end.)
+        category_positions = np.append(keys.get_indexer(categorical.categories), -1)
+        positions = category_positions[categorical.codes]
+    else:
+        positions = keys.get_indexer(np.asarray(column))
+
+    is_unmapped = positions == -1
+    if not is_unmapped.any():
+        return lookup_table[positions], is_unmapped
+
+    is_unknown = is_unmapped & pd.notnull(np.asarray(column))
+    mapped_column = np.append(lookup_table.astype(np.float64), np.nan)[positions]
+    if is_unknown.any() and not (_is_nan_policy(handle_unknown) or _is_error_policy(handle_unknown)):
+        mapped_column[is_unknown] = handle_unknown
+        if (not pd.isnull(mapped_column).any() and
+            np.issubdtype(lookup_table.dtype, np.integer) and float(handle_unknown).is_integer()):
+            mapped_column = mapped_column.astype(lookup_table.dtype)
+
+    return mapped_column, is_unknown
+
+
+def _is_error_policy(handle_unknown):
+    """Whether an unknown-value policy says to raise an error."""
+    return isinstance(handle_unknown, str) and handle_unknown == "error"
+
+
+def _is_nan_policy(handle_unknown):
+    """Whether an unknown-value policy says to use NaN, making sure it's a valid policy."""
+    if isinstance(handle_unknown, str):
+        if handle_unknown not in ("error", "nan"):
+            raise ValueError("handle_unknown must be 'error', 'nan', or a number, not '{0}'"
+                             .format(handle_unknown))
+        return handle_unknown == "nan"
+    return False
+
+
+def _get_data_mode(X):
+    """Determine whether ``X`` is a DataFrame (or similar), a structured array, or a 2D array."""
+    if not isinstance(X, np.ndarray):
+        return "dataframe"
+    if X.dtype.names is not None:
+        return "structured"
+    if X.ndim != 2:
+        raise ValueError("Expected a 2D array, got an array with {0} dimensions".format(X.ndim))
+    return "ndarray"
+
+
+def _get_input_mode(transformer, X):
+    """Get the kind of data a transformer works on, making sure ``X`` is that kind."""
+    data_mode = _get_data_mode(X)
+    fit_mode = getattr(transformer, "_input_mode", data_mode)
+    if data_mode != fit_mode:
+        raise TypeError("{0}: fit with {1} data, can't transform {2} data"
+                        .format(type(transformer).__name__, fit_mode, data_mode))
+    return fit_mode
+
+
+def _array_to_columns(X):
+    """Split a 2D or structured array into an ``OrderedDict`` of (views of) its columns."""
+    if X.dtype.names is not None:
+        return OrderedDict((name, X[name]) for name in X.dtype.names)
+    return OrderedDict((i, X[:, i]) for i in range(X.shape[1]))
+
+
+def _transform_array(transformer, X):
+    """Apply a transformer to a 2D or structured array (see ``_transform_columns``)."""
+    columns = transformer._transform_columns(_array_to_columns(X))
+    if X.dtype.names is None:
+        if len(columns) == 0:
+            return np.empty((len(X), 0), dtype=X.dtype)
+        return np.column_stack(list(columns.values()))
+
+    output = np.empty(len(X), dtype=[(str(name), column.dtype) for name, column in columns.items()])
+    for name, column in columns.items():
+        output[str(name)] = column
+    return output
+
+
+def _check_input_columns(transformer, columns, input_params, output_params):
+    """Make sure the input columns of a transformer exist, and its output columns don't."""
+    transformer_name = type(transformer).__name__
+    for param in input_params:
+        if getattr(transformer, param) not in columns:
+            raise KeyError("{0}: {1} {2} does not exist in dataset."
+                           .format(transformer_name, param, getattr(transformer, param)))
+    for param in output_params:
+        if getattr(transformer, param) in columns:
+            raise KeyError("{0}: {1} {2} already exists in dataset."
+                           .format(transformer_name, param, getattr(transformer, param)))
+
+
+def get_required_columns(model):
+    """Determine which raw input columns a model needs.
+
+    Walks through the preprocessing steps of a Scikit-learn ``Pipeline`` built from
+    the transformers in this module, collecting every column that a step reads but
+    that wasn't created by an earlier step. Everything after a ``CheckColumnNames``
+    step can only use the columns it keeps, so the search stops there.
+
+    Parameters
+    ----------
+    model : Scikit-learn ``Pipeline`` (or equivalent)
+        The model whose inputs should be found.
+
+    Returns
+    -------
+    list of strings, or ``None``
+        The names of the required input columns, in the order they are first used.
+        ``None`` if they can't be determined, e.g. because ``model`` isn't a
+        ``Pipeline``, contains a transformer not from this module, or contains one whose
+        columns are only set when it is fit, or has no ``CheckColumnNames`` step.
+    """
+    try:
+        transformers = [step for name, step in model.steps[:-1]]
+    except AttributeError:
+        return None
+
+    return _get_required_columns(transformers)
+
+
+def _get_required_columns(transformers):
+    """Find the input columns of a list of transformers (see ``get_required_columns``)."""
+    #Look inside any fused steps:
+    transformers = [step for transformer in transformers
+                    for step in (transformer.steps if isinstance(transformer, FusedFeatureBuilder)
+                                 else [transformer])]
+
+    required_columns = []
+    created_columns = set()
+    for transformer in transformers:
+        if not hasattr(transformer, "_input_colname_params"):
+            return None
+
+        for param in transformer._input_colname_params:
+            colnames = getattr(transformer, param)
+            if colnames is None or isinstance(colnames, str) and colnames == "all":
+                return None
+            if isinstance(colnames, str):
+                colnames = [colnames]
+            for colname in colnames:
+                if colname not in created_columns and colname not in required_columns:
+                    required_columns.append(colname)
+
+        created_columns.update(getattr(transformer, param)
+                               for param in transformer._output_colname_params)
+
+        if isinstance(transformer, CheckColumnNames):
+            return required_columns
+
+    #(Without a ``CheckColumnNames`` step, every column passes through to the model.)
+    return None
@@ -0,0 +1,267 @@
+"""Tools to measure where the steps of a model spend time and memory.
+
+:func:`profile_pipeline` (also available as :meth:`nflwin.model.WPModel.profile`)
+records the wall time, number of rows and peak memory of every call to ``fit``,
+``transform`` and ``predict_proba`` on each step of a pipeline while it's in
+use, so you can see which step is slowing down training or prediction.
+
+:func:`account_copies` runs the data through the steps of a pipeline one at a
+time, recording how much memory each step allocates and how much of its input
+it copies. A column counts as copied if the step's output has a column of the
+same name and values that doesn't share memory with the input column; columns
+that a step creates or changes aren't copies. This makes it possible to check
+that running with ``copy=False`` (see :class:`nflwin.model.WPModel`) really
+works in place.
+"""
+from __future__ import print_function, division
+
+import collections
+import contextlib
+import functools
+from timeit import default_timer
+
+import numpy as np
+import pandas as pd
+
+_PROFILED_METHODS = ("fit", "transform", "predict_proba")
+_PROFILE_COLUMNS = ["step", "method", "seconds", "rows", "peak_bytes"]
+
+
+class PipelineProfile(object):
+    """The time and memory used by each step of a pipeline, recorded by ``profile_pipeline``.
+
+    Attributes
+    ----------
+    records : list of dicts
+        One for each call to a step's ``fit``, ``transform`` or ``predict_proba``,
+        in the order they were made, with keys:
+
+        * ``"step"``: the name of the step in the pipeline.
+        * ``"method"``: the method called.
+        * ``"seconds"``: the wall time of the call (from ``time.perf_counter``,
+          where available).
+        * ``"rows"``: the number of rows passed in.
+        * ``"peak_bytes"``: the peak memory allocated during the call, according
+          to ``tracemalloc`` (``None`` if memory wasn't traced).
+    """
+    def __init__(self):
+        self.records = []
+
+    def to_dataframe(self):
+        """Get the records as a DataFrame, with one row per call."""
+        return pd.DataFrame(self.records, columns=_PROFILE_COLUMNS)
+
+    def summarize(self):
+        """Add up the records for each method of each step.
+
+        Returns
+        -------
+        Pandas DataFrame
+            Indexed by step and method (in the order they were first called), with
+            the number of calls, the total seconds and rows, and the largest peak memory.
+        """
+        records = self.to_dataframe()
+        grouped = records.groupby(["step", "method"], sort=False)
+        summary = grouped.agg({"seconds": "sum", "rows": "sum"})
+        summary["calls"] = grouped.size()
+        summary["peak_bytes"] = grouped["peak_bytes"].max()
+        return summary[["calls", "seconds", "rows", "peak_bytes"]]
+
+
+@contextlib.contextmanager
+def profile_pipeline(pipeline, trace_memory=True):
+    """Record the time and memory used by each step of a pipeline.
+
+    While the context is active, every call to ``fit``, ``transform``, or
+    ``predict_proba`` on one of the pipeline's steps (including the ones made by
+    the pipeline itself) is timed and added to the profile.
+
+    The steps are profiled by replacing those methods on the step objects
+    themselves, so this isn't thread-safe: calls made from other threads while the
+    context is active are recorded too (and, when tracing memory, they inflate
+    the peaks), and profiling the same pipeline from two threads at once can
+    leave methods patched. Profile a copy (e.g. ``copy.deepcopy(pipeline)``) if the
+    pipeline is in use elsewhere.
+
+    Parameters
+    ----------
+    pipeline : Scikit-learn ``Pipeline``
+        The pipeline to profile.
+    trace_memory : boolean (default=``True``)
+        Whether to record the peak memory of each call with ``tracemalloc``
+        (when it's available). Tracing memory slows down allocations, so turn
+        it off to get more accurate times.
+
+    Yields
+    ------
+    ``PipelineProfile``
+        The profile, which is filled in as the steps are called.
+
+    Raises
+    ------
+    RuntimeError
+        If ``trace_memory`` is ``True`` and ``tracemalloc`` is already tracing,
+        since the peak of each call can't be measured without restarting it
+        (which would discard its traces).
+
+    Examples
+    --------
+    >>> with profile_pipeline(pipeline) as profile: #doctest: +SKIP
+    ...     pipeline.fit(X, y)
+    >>> profile.summarize() #doctest: +SKIP
+    """
+    if trace_memory and _is_tracing():
+        raise RuntimeError("profile_pipeline: tracemalloc is already tracing; stop it, "
+                           "or pass trace_memory=False")
+    profile = PipelineProfile()
+    patched_methods = []
+    try:
+        for name, step in pipeline.steps:
+            if step is None:
+                continue
+            for method_name in _PROFILED_METHODS:
+                if hasattr(step, method_name):
+                    #(Wrapping the instance's method, so the class and other instances are untouched.)
+                    patched_methods.append((step, method_name, step.__dict__.get(method_name)))
+                    setattr(step, method_name,
+                            _profile_method(profile, name, method_name,
+                                            getattr(step, method_name), trace_memory))
+        yield profile
+    finally:
+        for step, method_name, original_method in patched_methods:
+            if original_method is None:
+                delattr(step, method_name)
+            else:
+                setattr(step, method_name, original_method)
+
+
+def _profile_method(profile, step_name, method_name, method, trace_memory):
+    """Wrap a method of a pipeline step so each call is recorded in a profile."""
+    @functools.wraps(method)
+    def profiled_method(X, *args, **kwargs):
+        start = default_timer()
+        if trace_memory:
+            output, peak_bytes = _trace_allocations(method, X, *args, **kwargs)
+        else:
+            output, peak_bytes = method(X, *args, **kwargs), None
+        profile.records.append({"step": step_name, "method": method_name,
+                                "seconds": default_timer() - start,
+                                "rows": X.shape[0] if hasattr(X, "shape") else len(X),
+                                "peak_bytes": peak_bytes})
+        return output
+    return profiled_method
+
+StepCopies = collections.namedtuple("StepCopies", ["name", "in_place", "bytes_allocated",
+                                                   "bytes_copied", "copied_columns"])
+StepCopies.__doc__ = """Copy accounting for a single step of a pipeline.
+
+Attributes
+----------
+name : string
+    The name of the step.
+in_place : boolean
+    Whether the step returned the same object it was given.
+bytes_allocated : int or ``None``
+    The peak memory allocated while running the step, according to ``tracemalloc``
+    (``None`` if ``tracemalloc`` isn't available, as on Python 2, or was already
+    tracing).
+bytes_copied : int
+    The total size of the copied columns.
+copied_columns : list
+    The names of the columns that were copied.
+"""
+
+
+def account_copies(pipeline, X):
+    """Run data through the preprocessing steps of a pipeline, accounting for copies.
+
+    Parameters
+    ----------
+    pipeline : Scikit-learn ``Pipeline``, or a list of (name, transformer) tuples
+        The steps to run. For a ``Pipeline`` the last step (the model) is skipped.
+        All of the steps must already be fit.
+    X : Pandas DataFrame or Numpy array
+        The data to run through the steps. If any of the steps have
+        ``copy=False``, this may be modified.
+
+    Returns
+    -------
+    A list of ``StepCopies``, one for each step.
+    """
+    steps = pipeline.steps[:-1] if hasattr(pipeline, "steps") else pipeline
+
+    reports = []
+    for name, step in steps:
+        input_columns = _get_columns(X)
+        output, bytes_allocated = _trace_allocations(step.transform, X)
+        output_columns = _get_columns(output)
+        copied_columns = [colname for colname, column in output_columns.items()
+                          if colname in input_columns and
+                          _is_copy(input_columns[colname], column)]
+        reports.append(StepCopies(name, output is X, bytes_allocated,
+                                  sum(_get_buffer(output_columns[colname]).nbytes
+                                      for colname in copied_columns),
+                                  copied_columns))
+        X = output
+
+    return reports
+
+
+def _trace_allocations(function, *args, **kwargs):
+    """Call a function, also returning the peak memory it allocated (or ``None``).
+
+    The peak is ``None`` if ``tracemalloc`` isn't available, or if it's already
+    tracing: measuring the peak of just this call would mean restarting it,
+    throwing away the existing traces.
+    """
+    #(``None`` if it isn't available.)
+    if _is_tracing() is not False:
+        return function(*args, **kwargs), None
+
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        output = function(*args, **kwargs)
+        bytes_allocated = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return output, bytes_allocated
+
+
+def _is_tracing():
+    """Whether ``tracemalloc`` is tracing, or ``None`` if it isn't available."""
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    return tracemalloc.is_tracing()
+
+
+def _get_columns(X):
+    """Get a dict of the columns of a DataFrame or array (other outputs have no columns)."""
+    if isinstance(X, pd.DataFrame):
+        return collections.OrderedDict((colname, X[colname].values) for colname in X.columns)
+    if isinstance(X, np.ndarray) and X.dtype.names is not None:
+        return collections.OrderedDict((name, X[name]) for name in X.dtype.names)
+    if isinstance(X, np.ndarray) and X.ndim == 2:
+        return collections.OrderedDict((i, X[:, i]) for i in range(X.shape[1]))
+    return collections.OrderedDict()
+
+
+def _get_buffer(column):
+    """Get the array that actually holds a column's data."""
+    if pd.api.types.is_categorical_dtype(column):
+        return column.codes
+    return np.asarray(column)
+
+
+def _is_copy(input_column, output_column):
+    """Whether a column is a copy of another (the same values in different memory)."""
+    input_buffer = _get_buffer(input_column)
+    output_buffer = _get_buffer(output_column)
+    if input_buffer.dtype != output_buffer.dtype or len(input_buffer) != len(output_buffer):
+        return False
+    if np.shares_memory(input_buffer, output_buffer):
+        return False
+    return pd.Series(input_buffer).equals(pd.Series(output_buffer))
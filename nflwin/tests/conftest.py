@@ -0,0 +1,35 @@
+from __future__ import print_function, division
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nflwin import model
+
+@pytest.fixture
+def synthetic_plays():
+    """Random plays, and whether the offense won each one (mostly decided by the score)."""
+    random_state = np.random.RandomState(0)
+    num_plays = 400
+    plays = pd.DataFrame({
+        "offense_team": random_state.choice(["NE", "PIT"], size=num_plays),
+        "home_team": random_state.choice(["NE", "PIT"], size=num_plays),
+        "curr_home_score": random_state.randint(0, 35, size=num_plays),
+        "curr_away_score": random_state.randint(0, 35, size=num_plays),
+        "down": random_state.randint(0, 5, size=num_plays),
+        "quarter": random_state.choice(["Q1", "Q2", "Q3", "Q4", "OT"], size=num_plays),
+        "seconds_elapsed": random_state.uniform(0, 900, size=num_plays),
+        "yardline": random_state.randint(-49, 50, size=num_plays).astype(np.float64),
+        "yards_to_go": random_state.randint(0, 20, size=num_plays)})
+    offense_won = ((plays["curr_home_score"] - plays["curr_away_score"]) *
+                   np.where(plays["offense_team"] == plays["home_team"], 1, -1) +
+                   random_state.normal(0, 10, size=num_plays)) > 0
+    return plays, offense_won
+
+@pytest.fixture
+def fitted_wpmodel(synthetic_plays):
+    """The default model, fit on ``synthetic_plays``."""
+    plays, offense_won = synthetic_plays
+    wpmodel = model.WPModel()
+    wpmodel.train_model(source_data=plays.assign(offense_won=offense_won))
+    return wpmodel
@@ -0,0 +1,346 @@
+from __future__ import print_function, division
+
+import os
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from nflwin import compact
+from nflwin import fused
+from nflwin import model
+from nflwin import preprocessing
+
+class CompactModelFixture(object):
+    """Plays and a fitted model to convert (not collected as tests itself)."""
+
+    @pytest.fixture(autouse=True)
+    def setup_model(self, synthetic_plays, fitted_wpmodel):
+        self.plays, self.offense_won = synthetic_plays
+        self.wpmodel = fitted_wpmodel
+
+    def _make_pipeline(self, classifier):
+        return Pipeline(self.wpmodel.create_default_pipeline().steps[:-1] + [("model", classifier)])
+
+
+class TestCompactWPModel(CompactModelFixture):
+    """Testing scoring single plays with a CompactWPModel."""
+
+    def _check_matches(self, pipeline):
+        compact_model = compact.CompactWPModel.from_pipeline(pipeline)
+        expected_wp = pipeline.predict_proba(self.plays)[:, 1]
+        compact_wp = [compact_model.predict_wp_single(**play)
+                      for play in self.plays.to_dict("records")]
+        np.testing.assert_allclose(compact_wp, expected_wp, rtol=1e-12, atol=1e-12)
+
+    def test_default_model(self):
+        self._check_matches(self.wpmodel.model)
+
+    def test_predict_wp_single(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays.iloc[:5])
+        single_wp = [self.wpmodel.predict_wp_single(**play)
+                     for play in self.plays.iloc[:5].to_dict("records")]
+        np.testing.assert_allclose(single_wp, expected_wp, rtol=1e-12, atol=1e-12)
+
+    def test_compact_model_updated(self):
+        play = self.plays.iloc[0].to_dict()
+        original_wp = self.wpmodel.predict_wp_single(**play)
+        self.wpmodel.train_model(source_data=self.plays.iloc[:200].assign(
+            offense_won=self.offense_won[:200]))
+        assert self.wpmodel.predict_wp_single(**play) == pytest.approx(
+            self.wpmodel.predict_wp(self.plays.iloc[:1])[0], abs=1e-12)
+        self.wpmodel.model = self._make_pipeline(LogisticRegression()).fit(self.plays, self.offense_won)
+        assert self.wpmodel.predict_wp_single(**play) == pytest.approx(
+            self.wpmodel.predict_wp(self.plays.iloc[:1])[0], abs=1e-12)
+        assert self.wpmodel.predict_wp_single(**play) != original_wp
+
+    def test_not_fit(self):
+        with pytest.raises(model.NotFittedError):
+            model.WPModel().predict_wp_single(down=1)
+
+    def test_sigmoid_calibration(self):
+        pipeline = self._make_pipeline(CalibratedClassifierCV(LogisticRegression(), cv=3,
+                                                              method="sigmoid"))
+        self._check_matches(pipeline.fit(self.plays, self.offense_won))
+
+    def test_uncalibrated(self):
+        pipeline = self._make_pipeline(LogisticRegression())
+        self._check_matches(pipeline.fit(self.plays, self.offense_won))
+
+    def test_compiled_pipeline(self):
+        self._check_matches(preprocessing.compile_pipeline(self.wpmodel.model))
+
+    def test_categorical_values(self):
+        compact_model = compact.CompactWPModel.from_pipeline(self.wpmodel.model)
+        play = self.plays.iloc[3].to_dict()
+        play_wp = compact_model.predict_wp_single(**play)
+        play["down"] = float(play["down"])
+        play["curr_home_score"] = np.int8(play["curr_home_score"])
+        assert compact_model.predict_wp_single(**play) == play_wp
+
+    def test_unknown_quarter(self):
+        compact_model = compact.CompactWPModel.from_pipeline(self.wpmodel.model)
+        play = self.plays.iloc[0].to_dict()
+        play["quarter"] = "Q5"
+        with pytest.raises(TypeError):
+            compact_model.predict_wp_single(**play)
+
+    def test_unknown_down(self):
+        compact_model = compact.CompactWPModel.from_pipeline(self.wpmodel.model)
+        play = self.plays.iloc[0].to_dict()
+        play["down"] = 7
+        #(Passed through as it is, and the one-hot encoder hasn't seen it.)
+        with pytest.raises(ValueError):
+            compact_model.predict_wp_single(**play)
+        with pytest.raises(ValueError):
+            self.wpmodel.model.predict_proba(pd.DataFrame([play]))
+
+    def test_missing_column(self):
+        compact_model = compact.CompactWPModel.from_pipeline(self.wpmodel.model)
+        play = self.plays.iloc[0].to_dict()
+        del play["yardline"]
+        with pytest.raises(KeyError):
+            compact_model.predict_wp_single(**play)
+
+    def test_unsupported_step(self):
+        pipeline = Pipeline([("scale", StandardScaler())] +
+                            self.wpmodel.model.steps)
+        with pytest.raises(TypeError):
+            compact.CompactWPModel.from_pipeline(pipeline)
+
+    def test_unsupported_classifier(self):
+        from sklearn.tree import DecisionTreeClassifier
+        pipeline = self._make_pipeline(DecisionTreeClassifier())
+        with pytest.raises(TypeError):
+            compact.CompactWPModel.from_pipeline(pipeline.fit(self.plays, self.offense_won))
+
+    def test_no_check_column_names(self):
+        pipeline = Pipeline([step for step in self.wpmodel.model.steps
+                             if not isinstance(step[1], preprocessing.CheckColumnNames)])
+        with pytest.raises(TypeError):
+            compact.CompactWPModel.from_pipeline(pipeline)
+
+    def test_not_fit_pipeline(self):
+        with pytest.raises(TypeError):
+            compact.CompactWPModel.from_pipeline(self.wpmodel.create_default_pipeline())
+
+
+class TestExportCompact(CompactModelFixture):
+    """Testing saving and loading CompactWPModels."""
+
+    def _check_round_trip(self, pipeline, filename):
+        compact.CompactWPModel.from_pipeline(pipeline).save(filename)
+        loaded_model = compact.CompactWPModel.load(filename)
+        np.testing.assert_allclose(loaded_model.predict_wp(self.plays.to_dict("records")),
+                                   pipeline.predict_proba(self.plays)[:, 1],
+                                   rtol=1e-12, atol=1e-12)
+
+    def test_export_compact(self, tmpdir):
+        filename = str(tmpdir.join("model.npz"))
+        self.wpmodel.export_compact(filename)
+        loaded_model = compact.CompactWPModel.load(filename)
+        np.testing.assert_allclose(loaded_model.predict_wp(self.plays.to_dict("records")),
+                                   self.wpmodel.predict_wp(self.plays),
+                                   rtol=1e-12, atol=1e-12)
+
+    def test_sigmoid_round_trip(self, tmpdir):
+        pipeline = self._make_pipeline(CalibratedClassifierCV(LogisticRegression(), cv=3,
+                                                              method="sigmoid"))
+        self._check_round_trip(pipeline.fit(self.plays, self.offense_won),
+                               str(tmpdir.join("model.npz")))
+
+    def test_uncalibrated_round_trip(self, tmpdir):
+        pipeline = self._make_pipeline(LogisticRegression())
+        self._check_round_trip(pipeline.fit(self.plays, self.offense_won),
+                               str(tmpdir.join("model.npz")))
+
+    def test_extension_added(self, tmpdir):
+        self.wpmodel.export_compact(str(tmpdir.join("model")))
+        assert os.path.exists(str(tmpdir.join("model.npz")))
+
+    def test_nothing_pickled(self, tmpdir):
+        filename = str(tmpdir.join("model.npz"))
+        self.wpmodel.export_compact(filename)
+        with np.load(filename, allow_pickle=False) as arrays:
+            for name in arrays.files:
+                assert arrays[name].dtype != np.object_
+
+    def test_not_fit(self, tmpdir):
+        with pytest.raises(model.NotFittedError):
+            model.WPModel().export_compact(str(tmpdir.join("model.npz")))
+
+    def test_newer_format(self, tmpdir):
+        filename = str(tmpdir.join("model.npz"))
+        self.wpmodel.export_compact(filename)
+        with np.load(filename) as arrays:
+            contents = dict((name, arrays[name]) for name in arrays.files)
+        contents["format_version"] = np.array(compact._FORMAT_VERSION + 1)
+        np.savez(filename, **contents)
+        with pytest.raises(ValueError):
+            compact.CompactWPModel.load(filename)
+
+    def test_scoring_only_imports_numpy(self, tmpdir):
+        filename = str(tmpdir.join("model.npz"))
+        self.wpmodel.export_compact(filename)
+        play = dict((key, value.item() if hasattr(value, "item") else value)
+                    for key, value in self.plays.iloc[0].to_dict().items())
+        script = ("import sys\n"
+                  "from nflwin.compact import CompactWPModel\n"
+                  "model = CompactWPModel.load({0!r})\n"
+                  "print(repr(model.predict_wp_single(**{1!r})))\n"
+                  "print(sorted(name for name in ['pandas', 'scipy', 'sklearn'] "
+                  "if name in sys.modules))\n").format(filename, play)
+        package_directory = os.path.dirname(os.path.dirname(os.path.abspath(compact.__file__)))
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         cwd=package_directory).decode("utf-8").splitlines()
+        assert float(output[0]) == pytest.approx(self.wpmodel.predict_wp(self.plays.iloc[:1])[0],
+                                                 abs=1e-12)
+        assert output[1] == "[]"
+
+
+class TestFusedCalibratedClassifier(CompactModelFixture):
+    """Testing merging the folds of a calibrated classifier."""
+
+    def _check_matches(self, pipeline):
+        fused_pipeline = fused.fuse_pipeline(pipeline)
+        assert isinstance(fused_pipeline.steps[-1][1], fused.FusedCalibratedClassifier)
+        assert fused_pipeline.steps[-1][0] == pipeline.steps[-1][0]
+        np.testing.assert_allclose(fused_pipeline.predict_proba(self.plays),
+                                   pipeline.predict_proba(self.plays), rtol=1e-12, atol=1e-12)
+        np.testing.assert_array_equal(fused_pipeline.predict(self.plays), pipeline.predict(self.plays))
+
+    def test_default_model(self):
+        self._check_matches(self.wpmodel.model)
+
+    def test_more_folds(self):
+        pipeline = self._make_pipeline(CalibratedClassifierCV(LogisticRegression(), cv=5,
+                                                              method="isotonic"))
+        self._check_matches(pipeline.fit(self.plays, self.offense_won))
+
+    def test_sigmoid_calibration(self):
+        pipeline = self._make_pipeline(CalibratedClassifierCV(LogisticRegression(), cv=3,
+                                                              method="sigmoid"))
+        self._check_matches(pipeline.fit(self.plays, self.offense_won))
+
+    def test_uncalibrated(self):
+        pipeline = self._make_pipeline(LogisticRegression())
+        self._check_matches(pipeline.fit(self.plays, self.offense_won))
+
+    def test_compiled_pipeline(self):
+        self._check_matches(preprocessing.compile_pipeline(self.wpmodel.model))
+
+    def test_out_of_range_decisions(self):
+        classifier = self.wpmodel.model.steps[-1][1]
+        fused_classifier = fused.FusedCalibratedClassifier.from_classifier(classifier)
+        features = np.zeros((3, fused_classifier.coefficients_.shape[1]))
+        features[:, 0] = [-1e6, 0., 1e6]
+        np.testing.assert_allclose(fused_classifier.predict_proba(features),
+                                   classifier.predict_proba(features), rtol=1e-12, atol=1e-12)
+
+    def test_wrong_number_of_features(self):
+        fused_classifier = fused.FusedCalibratedClassifier.from_classifier(
+            self.wpmodel.model.steps[-1][1])
+        with pytest.raises(ValueError):
+            fused_classifier.predict_proba(np.zeros((2, 3)))
+
+    def test_not_fit(self):
+        with pytest.raises(TypeError):
+            fused.FusedCalibratedClassifier.from_classifier(CalibratedClassifierCV(LogisticRegression()))
+
+    def test_refit(self):
+        fused_pipeline = fused.fuse_pipeline(self.wpmodel.model)
+        fused_pipeline.fit(self.plays.iloc[:200], self.offense_won[:200])
+        pipeline = self.wpmodel.model.fit(self.plays.iloc[:200], self.offense_won[:200])
+        np.testing.assert_allclose(fused_pipeline.predict_proba(self.plays),
+                                   pipeline.predict_proba(self.plays), rtol=1e-12, atol=1e-12)
+
+    def test_default_estimator(self):
+        pipeline = self._make_pipeline(fused.FusedCalibratedClassifier())
+        pipeline.fit(self.plays, self.offense_won)
+        np.testing.assert_allclose(pipeline.predict_proba(self.plays),
+                                   self.wpmodel.model.predict_proba(self.plays),
+                                   rtol=1e-12, atol=1e-12)
+
+    def test_not_fit_predict(self):
+        with pytest.raises(model.NotFittedError):
+            fused.FusedCalibratedClassifier().predict_proba(np.zeros((2, 3)))
+
+    def test_compact_model(self):
+        fused_pipeline = fused.fuse_pipeline(self.wpmodel.model)
+        compact_model = compact.CompactWPModel.from_pipeline(fused_pipeline)
+        expected_wp = self.wpmodel.predict_wp(self.plays.iloc[:5])
+        compact_wp = [compact_model.predict_wp_single(**play)
+                      for play in self.plays.iloc[:5].to_dict("records")]
+        np.testing.assert_allclose(compact_wp, expected_wp, rtol=1e-12, atol=1e-12)
+
+    def test_fuse_model(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        max_difference = self.wpmodel.fuse_model(check_plays=self.plays)
+        assert max_difference <= 1e-12
+        assert isinstance(self.wpmodel.model.steps[-1][1], fused.FusedCalibratedClassifier)
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays), expected_wp,
+                                   rtol=1e-12, atol=1e-12)
+
+    def test_sklearn_estimator(self):
+        from sklearn.base import clone
+        from sklearn.model_selection import cross_val_score
+        fused_pipeline = fused.fuse_pipeline(self.wpmodel.model)
+        name, fused_classifier = fused_pipeline.steps[-1]
+        assert fused_classifier.get_params()["estimator__method"] == "isotonic"
+        expected_scores = cross_val_score(self.wpmodel.model, self.plays, self.offense_won, cv=2)
+        np.testing.assert_allclose(cross_val_score(fused_pipeline, self.plays, self.offense_won, cv=2),
+                                   expected_scores)
+        cloned_pipeline = clone(fused_pipeline).set_params(**{name + "__estimator__method": "sigmoid"})
+        cloned_pipeline.fit(self.plays, self.offense_won)
+        assert cloned_pipeline.steps[-1][1].calibrations_[0]["method"] == "sigmoid"
+        assert fused_classifier.calibrations_[0]["method"] == "isotonic"
+
+    def test_retrain_after_fuse(self):
+        self.wpmodel.fuse_model()
+        fused_pipeline = self.wpmodel.model
+        training_data = self.plays.iloc[:200].assign(offense_won=self.offense_won[:200])
+        self.wpmodel.train_model(source_data=training_data)
+        assert self.wpmodel.model is fused_pipeline
+        expected_model = model.WPModel()
+        expected_model.train_model(source_data=training_data)
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays),
+                                   expected_model.predict_wp(self.plays), rtol=1e-12, atol=1e-12)
+
+    def test_fuse_model_compiles_features(self):
+        self.wpmodel.fuse_model()
+        assert [name for name, step in self.wpmodel.model.steps] == ["build_features", "compute_model"]
+        assert isinstance(self.wpmodel.model.steps[0][1], preprocessing.FusedFeatureBuilder)
+        self.wpmodel.fuse_model()
+        assert len(self.wpmodel.model.steps) == 2
+
+    def test_set_model_after_fuse(self):
+        self.wpmodel.fuse_model()
+        new_pipeline = self._make_pipeline(LogisticRegression())
+        self.wpmodel.model = new_pipeline
+        self.wpmodel.train_model(source_data=self.plays.assign(offense_won=self.offense_won))
+        assert self.wpmodel.model is new_pipeline
+
+    def test_fuse_model_pickled(self):
+        self.wpmodel.fuse_model()
+        loaded_model = pickle.loads(pickle.dumps(self.wpmodel))
+        np.testing.assert_array_equal(loaded_model.predict_wp(self.plays),
+                                      self.wpmodel.predict_wp(self.plays))
+
+    def test_fuse_model_tolerance(self, monkeypatch):
+        original_pipeline = self.wpmodel.model
+        monkeypatch.setattr(fused.FusedCalibratedClassifier, "predict_proba",
+                            lambda fused, X: np.tile([0.5, 0.5], (len(X), 1)))
+        with pytest.raises(ValueError):
+            self.wpmodel.fuse_model(check_plays=self.plays)
+        assert self.wpmodel.model is original_pipeline
+
+    def test_fuse_model_not_fit(self):
+        with pytest.raises(model.NotFittedError):
+            model.WPModel().fuse_model()
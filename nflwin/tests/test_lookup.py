@@ -0,0 +1,186 @@
+from __future__ import print_function, division
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+
+from nflwin import lookup
+from nflwin import model
+
+class TestWPLookupTable(object):
+    """Testing building and scoring plays with lookup tables."""
+
+    @pytest.fixture(autouse=True)
+    def setup_model(self, synthetic_plays, fitted_wpmodel):
+        self.plays, self.offense_won = synthetic_plays
+        self.wpmodel = fitted_wpmodel
+        self.grid = {"is_offense_home": [0, 1],
+                     "score_differential": np.arange(-40, 41, 10),
+                     "total_elapsed_time": [0, 1000, 2000, 3000, 4500],
+                     "yardline": np.arange(-50, 51, 25),
+                     "yards_to_go": [0, 5, 10, 20],
+                     "down": None}
+
+    def _grid_features(self, table):
+        """Get the features at every grid point of a table, as a DataFrame."""
+        positions = np.unravel_index(np.arange(table.table.size), table.table.shape)
+        return pd.DataFrame(dict((name, points[position])
+                                 for (name, points), position in zip(table.axes, positions)),
+                            columns=[name for name, points in table.axes])
+
+    def _score_features(self, features):
+        """Score features with the steps of the model after CheckColumnNames."""
+        return self.wpmodel.model.steps[-1][1].predict_proba(
+            self.wpmodel.model.named_steps["encode_categorical_columns"].transform(features.copy()))[:, 1]
+
+    def test_grid_points_exact(self):
+        table = self.wpmodel.build_lookup_table(self.grid, dtype=np.float64)
+        assert table.table.shape == (2, 9, 5, 5, 4, 5)
+        assert [name for name, points in table.axes] == [
+            "is_offense_home", "score_differential", "total_elapsed_time",
+            "yardline", "yards_to_go", "down"]
+        np.testing.assert_array_equal(table.axes[-1][1], [0, 1, 2, 3, 4])
+        features = self._grid_features(table)
+        np.testing.assert_allclose(table.lookup(features), self._score_features(features),
+                                   rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(table.table.ravel(), self._score_features(features),
+                                   rtol=1e-12, atol=1e-12)
+
+    def test_interpolation(self):
+        table = self.wpmodel.build_lookup_table(self.grid, dtype=np.float64)
+        features = {"is_offense_home": [1, 1], "score_differential": [0, 5],
+                    "total_elapsed_time": [1000, 1000], "yardline": [0, 0],
+                    "yards_to_go": [10, 10], "down": [1, 1]}
+        low_wp, mid_wp = table.lookup(features)
+        high_wp = table.lookup(dict(features, score_differential=10))[0]
+        assert mid_wp == pytest.approx((low_wp + high_wp) / 2, abs=1e-12)
+        nearest_wp = table.lookup(dict(features, score_differential=4), interpolate=False)[0]
+        assert nearest_wp == low_wp
+
+    def test_discrete_features_not_interpolated(self):
+        table = self.wpmodel.build_lookup_table(self.grid, dtype=np.float64)
+        assert table.discrete_features == ("down",)
+        features = {"is_offense_home": 1, "score_differential": 0, "total_elapsed_time": 1000,
+                    "yardline": 0, "yards_to_go": 10}
+        assert (table.lookup(dict(features, down=1.2))[0] ==
+                table.lookup(dict(features, down=1))[0])
+
+    def test_clipped_and_missing(self):
+        table = self.wpmodel.build_lookup_table(self.grid, dtype=np.float64)
+        features = {"is_offense_home": [1, 1, 1], "score_differential": [40, 100, np.nan],
+                    "total_elapsed_time": [1000] * 3, "yardline": [0] * 3,
+                    "yards_to_go": [10] * 3, "down": [1] * 3}
+        wp = table.lookup(features)
+        assert wp[0] == wp[1]
+        assert np.isnan(wp[2])
+
+    def test_predict_wp(self):
+        grid = dict(self.grid, score_differential=np.arange(-40, 41),
+                    yards_to_go=np.arange(0, 21))
+        table = self.wpmodel.build_lookup_table(grid, check_plays=self.plays, dtype=np.float64)
+        errors = np.abs(table.predict_wp(self.plays) - self.wpmodel.predict_wp(self.plays))
+        assert table.max_error == pytest.approx(errors.max(), abs=1e-12)
+        assert table.mean_error == pytest.approx(errors.mean(), abs=1e-12)
+
+    def test_predict_wp_single(self):
+        table = self.wpmodel.build_lookup_table(self.grid)
+        #(With plays off the edges of the grid, which are clipped.)
+        plays = pd.concat([self.plays, self.plays.iloc[:20].assign(curr_home_score=99, yardline=60.),
+                           self.plays.iloc[:20].assign(curr_away_score=99, yardline=-60.)],
+                          ignore_index=True)
+        for interpolate in [True, False]:
+            expected_wp = table.predict_wp(plays, interpolate=interpolate)
+            single_wp = [table.predict_wp_single(interpolate=interpolate, **play)
+                         for play in plays.to_dict("records")]
+            np.testing.assert_array_equal(single_wp, expected_wp)
+
+    def test_random_check_points(self):
+        table = self.wpmodel.build_lookup_table(self.grid, num_check_points=100)
+        assert 0 < table.mean_error <= table.max_error < 1
+
+    def test_chunked_and_parallel_build(self):
+        expected_table = self.wpmodel.build_lookup_table(self.grid).table
+        self.wpmodel.min_plays_per_job = 1
+        for kwargs in [{"chunksize": 7}, {"chunksize": 1000, "n_jobs": 2}]:
+            table = self.wpmodel.build_lookup_table(self.grid, **kwargs)
+            np.testing.assert_allclose(table.table, expected_table, rtol=1e-6, atol=1e-7)
+
+    def test_any_classifier(self):
+        self.wpmodel.model = Pipeline(self.wpmodel.model.steps[:-1] +
+                                      [("forest", RandomForestClassifier(n_estimators=5,
+                                                                         random_state=0))])
+        self.wpmodel.train_model(source_data=self.plays.assign(offense_won=self.offense_won))
+        table = self.wpmodel.build_lookup_table(self.grid, dtype=np.float64)
+        features = self._grid_features(table)
+        np.testing.assert_allclose(table.lookup(features), self._score_features(features),
+                                   rtol=1e-12, atol=1e-12)
+
+    def test_save_load(self, tmpdir):
+        table = self.wpmodel.build_lookup_table(self.grid)
+        directory = str(tmpdir.join("table"))
+        table.save(directory)
+        for mmap_mode in ["r", None]:
+            loaded_table = lookup.WPLookupTable.load(directory, mmap_mode=mmap_mode)
+            assert isinstance(loaded_table.table, np.memmap) == (mmap_mode is not None)
+            assert loaded_table.max_error == table.max_error
+            np.testing.assert_array_equal(loaded_table.predict_wp(self.plays),
+                                          table.predict_wp(self.plays))
+
+    def test_build_in_directory(self, tmpdir):
+        directory = str(tmpdir.join("table"))
+        table = self.wpmodel.build_lookup_table(self.grid, directory=directory)
+        assert sorted(os.listdir(directory)) == ["axes.json", "table.npy"]
+        loaded_table = lookup.WPLookupTable.load(directory)
+        np.testing.assert_array_equal(loaded_table.table, table.table)
+        assert loaded_table.discrete_features == ("down",)
+
+    def test_scoring_only_imports_numpy(self, tmpdir):
+        directory = str(tmpdir.join("table"))
+        self.wpmodel.build_lookup_table(self.grid, directory=directory)
+        play = dict((key, value.item() if hasattr(value, "item") else value)
+                    for key, value in self.plays.iloc[0].to_dict().items())
+        script = ("import sys\n"
+                  "from nflwin.lookup import WPLookupTable\n"
+                  "table = WPLookupTable.load({0!r})\n"
+                  "print(repr(table.predict_wp_single(**{1!r})))\n"
+                  "print(sorted(name for name in ['pandas', 'scipy', 'sklearn'] "
+                  "if name in sys.modules))\n").format(directory, play)
+        package_directory = os.path.dirname(os.path.dirname(os.path.abspath(lookup.__file__)))
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         cwd=package_directory).decode("utf-8").splitlines()
+        assert 0 <= float(output[0]) <= 1
+        assert output[1] == "[]"
+
+    def test_missing_grid_feature(self):
+        grid = dict(self.grid)
+        del grid["yardline"]
+        with pytest.raises(ValueError):
+            self.wpmodel.build_lookup_table(grid)
+
+    def test_unknown_grid_feature(self):
+        with pytest.raises(ValueError):
+            self.wpmodel.build_lookup_table(dict(self.grid, quarter=[1, 2]))
+
+    def test_table_shape_checked(self):
+        table = self.wpmodel.build_lookup_table(self.grid)
+        with pytest.raises(ValueError):
+            lookup.WPLookupTable(table.feature_steps, table.axes, table.table[:1, :1])
+
+    def test_no_discrete_features(self):
+        table = self.wpmodel.build_lookup_table(self.grid)
+        continuous_table = lookup.WPLookupTable(table.feature_steps, table.axes, table.table)
+        assert continuous_table.discrete_features == ()
+        features = {"is_offense_home": [1], "score_differential": [0], "total_elapsed_time": [1000],
+                    "yardline": [0], "yards_to_go": [10], "down": [1.5]}
+        assert (continuous_table.lookup(features)[0] ==
+                pytest.approx(table.lookup(dict(features, down=[1, 2])).mean()))
+
+    def test_not_fit(self):
+        with pytest.raises(model.NotFittedError):
+            model.WPModel().build_lookup_table(self.grid)
@@ -2,12 +2,19 @@ from __future__ import print_function, division
 
 import os
 import collections
+import pickle
+import subprocess
+import sys
+import threading
 
+import joblib
 import numpy as np
 import pandas as pd
 import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
 
-from nflwin import model
+from nflwin import model, utilities
 
 
 class TestDefaults(object):
@@ -16,6 +23,26 @@ class TestDefaults(object):
     def test_column_descriptions_set(self):
         wpmodel = model.WPModel()
         assert isinstance(wpmodel.column_descriptions, collections.Mapping)
+
+    def test_required_columns(self):
+        wpmodel = model.WPModel()
+        assert wpmodel.required_columns == ["offense_team", "home_team",
+                                            "curr_home_score", "curr_away_score",
+                                            "down", "quarter", "seconds_elapsed",
+                                            "yardline", "yards_to_go"]
+
+    def test_nfldb_queried_for_required_columns(self, monkeypatch):
+        queried_columns = []
+        def mock_get_nfldb_play_data(season_years=None, season_types=None,
+                                     cache_directory=None, columns=None):
+            queried_columns.append(columns)
+            raise RuntimeError("stop before fitting")
+        monkeypatch.setattr(utilities, "get_nfldb_play_data", mock_get_nfldb_play_data)
+
+        wpmodel = model.WPModel()
+        with pytest.raises(RuntimeError):
+            wpmodel.train_model()
+        assert queried_columns == [wpmodel.required_columns + ["offense_won"]]
         
 class TestModelTrain(object):
     """Tests for the train_model method."""
@@ -108,6 +135,283 @@ class TestModelValidate(object):
         wpmodel.train_model(source_data=self.test_df)
         wpmodel.validate_model(source_data=self.test_df)
 
+    def test_compact_dtypes(self):
+        wpmodel = model.WPModel()
+        wpmodel.train_model(source_data=self.test_df)
+        compact_df = utilities.compact_play_data(self.test_df.copy())
+        np.testing.assert_array_equal(wpmodel.predict_wp(compact_df.drop('offense_won', axis=1)),
+                                      wpmodel.predict_wp(self.test_df.drop('offense_won', axis=1)))
+
+        compact_wpmodel = model.WPModel()
+        compact_wpmodel.train_model(source_data=compact_df)
+        compact_wpmodel.validate_model(source_data=compact_df)
+
+class TestPredictWP(object):
+    """Tests for the predict_wp and predict_wp_iter methods."""
+
+    def setup_method(self, method):
+        validate_tests = TestModelValidate()
+        validate_tests.setup_method(method)
+        self.plays = validate_tests.test_df.drop("offense_won", axis=1)
+        self.wpmodel = model.WPModel()
+        self.wpmodel.train_model(source_data=validate_tests.test_df)
+
+    def test_not_fit(self):
+        with pytest.raises(model.NotFittedError):
+            model.WPModel().predict_wp(self.plays, chunksize=3)
+        with pytest.raises(model.NotFittedError):
+            model.WPModel().predict_wp_iter([self.plays])
+
+    def test_chunks_match(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        for chunksize in [1, 3, 10, 100]:
+            #(The matrix products can round differently with different numbers of rows.)
+            np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays, chunksize=chunksize),
+                                       expected_wp, rtol=1e-12, atol=1e-14)
+
+    def test_chunks_non_range_index(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        self.plays.index = self.plays.index[::-1] * 7
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays, chunksize=4), expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+
+    def test_chunks_without_copying(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        expected_plays = self.plays.copy()
+        wpmodel = model.WPModel(copy_data=False)
+        wpmodel.model = self.wpmodel.model
+        wpmodel._training_seasons = []
+        np.testing.assert_allclose(wpmodel.predict_wp(self.plays, chunksize=3), expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        pd.util.testing.assert_frame_equal(self.plays, expected_plays)
+
+    def test_bad_chunksize(self):
+        with pytest.raises(ValueError):
+            self.wpmodel.predict_wp(self.plays, chunksize=0)
+
+    def test_empty_plays(self):
+        assert len(self.wpmodel.predict_wp(self.plays.iloc[:0], chunksize=5)) == 0
+
+    def test_iter(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        chunks = [self.plays.iloc[:4], self.plays.iloc[4:]]
+        chunk_wps = list(self.wpmodel.predict_wp_iter(iter(chunks)))
+        assert [len(chunk_wp) for chunk_wp in chunk_wps] == [4, 6]
+        np.testing.assert_allclose(np.concatenate(chunk_wps), expected_wp, rtol=1e-12, atol=1e-14)
+
+    def test_iter_without_copying(self):
+        wpmodel = model.WPModel(copy_data=False)
+        wpmodel.train_model(source_data=self.plays.assign(offense_won=[True, False] * 5))
+        expected_wp = wpmodel.predict_wp(self.plays, chunksize=4)
+        chunks = [self.plays.iloc[:4].copy(), self.plays.iloc[4:].copy()]
+        chunk_wps = list(wpmodel.predict_wp_iter(iter(chunks)))
+        np.testing.assert_allclose(np.concatenate(chunk_wps), expected_wp, rtol=1e-12, atol=1e-14)
+        pd.util.testing.assert_frame_equal(pd.concat(chunks), self.plays)
+
+    def test_parallel(self, monkeypatch):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        self.wpmodel.min_plays_per_job = 1
+        for n_jobs, chunksize in [(2, None), (3, 2), (-1, None), (20, None)]:
+            np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays, chunksize=chunksize,
+                                                               n_jobs=n_jobs),
+                                       expected_wp, rtol=1e-12, atol=1e-14)
+
+    def test_parallel_threads(self):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        wpmodel = model.WPModel(copy_data=False)
+        wpmodel.model = self.wpmodel.model
+        wpmodel._training_seasons = []
+        wpmodel.min_plays_per_job = 1
+        self.plays["gsis_id"] = ["2012090500", "2012090600"] * 5
+        expected_plays = self.plays.copy()
+        with joblib.parallel_backend("threading"):
+            np.testing.assert_allclose(wpmodel.predict_wp(self.plays, n_jobs=2), expected_wp,
+                                       rtol=1e-12, atol=1e-14)
+        pd.util.testing.assert_frame_equal(self.plays, expected_plays)
+
+    def test_parallel_min_plays_per_job(self, monkeypatch):
+        expected_wp = self.wpmodel.predict_wp(self.plays)
+        jobs = []
+        def predict_wp_serially(wpmodel, plays, chunksize, n_jobs):
+            jobs.append(n_jobs)
+            return wpmodel._predict_wp_uncached(plays, chunksize, 1)
+        monkeypatch.setattr(model, "_predict_wp_parallel", predict_wp_serially)
+        #(Too few plays for two jobs, so they're scored in this process.)
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays, n_jobs=4), expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        assert jobs == []
+        self.wpmodel.min_plays_per_job = 3
+        self.wpmodel.predict_wp(self.plays, n_jobs=4)
+        assert jobs == [3]
+
+class TestPredictionCache(object):
+    """Tests for caching predictions in predict_wp."""
+
+    def setup_method(self, method):
+        validate_tests = TestModelValidate()
+        validate_tests.setup_method(method)
+        self.training_data = validate_tests.test_df
+        self.plays = validate_tests.test_df.drop("offense_won", axis=1)
+        self.wpmodel = model.WPModel(cache_size=100)
+        self.wpmodel.train_model(source_data=self.training_data)
+        self.expected_wp = self.wpmodel.model.predict_proba(self.plays)[:, 1]
+
+    def test_no_cache_by_default(self):
+        wpmodel = model.WPModel()
+        wpmodel.train_model(source_data=self.training_data)
+        wpmodel.predict_wp(self.plays)
+        assert wpmodel.cache_info() == model.CacheInfo(0, 0, 0, 0)
+
+    def test_hits_and_misses(self):
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays), self.expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info() == model.CacheInfo(0, 10, 100, 10)
+        np.testing.assert_array_equal(self.wpmodel.predict_wp(self.plays.iloc[::-1]),
+                                      self.expected_wp[::-1])
+        assert self.wpmodel.cache_info() == model.CacheInfo(10, 10, 100, 10)
+
+    def test_repeated_states_scored_once(self):
+        plays = pd.concat([self.plays, self.plays.iloc[:3]], ignore_index=True)
+        np.testing.assert_allclose(self.wpmodel.predict_wp(plays),
+                                   np.concatenate([self.expected_wp, self.expected_wp[:3]]),
+                                   rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info() == model.CacheInfo(3, 10, 100, 10)
+
+    def test_unused_columns_ignored(self):
+        self.wpmodel.predict_wp(self.plays)
+        self.plays["play_id"] += 1000
+        self.wpmodel.predict_wp(self.plays)
+        assert self.wpmodel.cache_info().hits == 10
+
+    def test_colliding_hashes(self):
+        #(hash(-1) == hash(-2), so these game states would collide if keyed by their hashes.)
+        plays = self.plays.iloc[[0, 0]].copy()
+        plays["yardline"] = [-1., -2.]
+        expected_wp = self.wpmodel.model.predict_proba(plays)[:, 1]
+        assert expected_wp[0] != expected_wp[1]
+        np.testing.assert_allclose(self.wpmodel.predict_wp(plays.iloc[:1]), expected_wp[:1],
+                                   rtol=1e-12, atol=1e-14)
+        np.testing.assert_allclose(self.wpmodel.predict_wp(plays), expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info() == model.CacheInfo(1, 2, 100, 2)
+
+    def test_equal_values_found(self):
+        self.wpmodel.predict_wp(self.plays)
+        plays = self.plays.copy()
+        plays["curr_home_score"] = plays["curr_home_score"].astype(np.float64)
+        plays["yardline"] = plays["yardline"].where(plays["yardline"] != 0, -0.)
+        for colname in ["offense_team", "home_team", "away_team", "quarter"]:
+            plays[colname] = plays[colname].astype("category")
+        np.testing.assert_allclose(self.wpmodel.predict_wp(plays), self.expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info() == model.CacheInfo(10, 10, 100, 10)
+
+    def test_different_kinds_not_confused(self):
+        #(A column of team codes must not match a numeric column with the same values.)
+        cache = model._PredictionCache(10)
+        team_keys = cache.make_keys(pd.DataFrame({"team": ["NE", "PIT"]}), ["team"])
+        number_keys = cache.make_keys(pd.DataFrame({"team": [0., 1.]}), ["team"])
+        missing_keys = cache.make_keys(pd.DataFrame({"team": [None, np.nan]}), ["team"])
+        assert len(set(team_keys + number_keys)) == 4
+        assert missing_keys[0] == missing_keys[1]
+        assert missing_keys[0] not in team_keys + number_keys
+
+    def test_large_batch(self):
+        plays = pd.concat([self.plays] * 150, ignore_index=True)
+        np.testing.assert_allclose(self.wpmodel.predict_wp(plays), np.tile(self.expected_wp, 150),
+                                   rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info() == model.CacheInfo(1490, 10, 100, 10)
+        self.wpmodel.predict_wp(plays)
+        assert self.wpmodel.cache_info() == model.CacheInfo(2990, 10, 100, 10)
+
+    def test_missing_values_found(self):
+        from sklearn.preprocessing import Imputer
+        self.wpmodel.model = Pipeline([("impute", Imputer()), ("model", LogisticRegression())]).fit(
+            pd.DataFrame({"x": [0., 1., 0., 1.]}), np.array([0, 1, 1, 0]))
+        plays = pd.DataFrame({"x": [np.nan, 1.]})
+        self.wpmodel.predict_wp(plays)
+        self.wpmodel.predict_wp(plays)
+        assert self.wpmodel.cache_info() == model.CacheInfo(2, 2, 100, 2)
+
+    def test_least_recently_used_evicted(self):
+        self.wpmodel.cache_size = 3
+        for rows in [[0, 1, 2], [0], [3], [0], [1]]:
+            self.wpmodel.predict_wp(self.plays.iloc[rows])
+        #(Scoring row 3 evicted row 1, the least recently used.)
+        assert self.wpmodel.cache_info() == model.CacheInfo(2, 5, 3, 3)
+
+    def test_model_reassigned(self):
+        self.wpmodel.predict_wp(self.plays)
+        self.wpmodel.model = self.wpmodel.create_default_pipeline()
+        assert self.wpmodel.cache_info() == model.CacheInfo(0, 0, 100, 0)
+        self.wpmodel.train_model(source_data=self.training_data.iloc[:6])
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays),
+                                   self.wpmodel.model.predict_proba(self.plays)[:, 1],
+                                   rtol=1e-12, atol=1e-14)
+
+    def test_retrained(self):
+        self.wpmodel.predict_wp(self.plays)
+        self.wpmodel.train_model(source_data=self.training_data.iloc[:6])
+        assert self.wpmodel.cache_info().currsize == 0
+        expected_wp = self.wpmodel.model.predict_proba(self.plays)[:, 1]
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays), expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+
+    def test_parallel_and_chunked(self):
+        self.wpmodel.min_plays_per_job = 1
+        self.wpmodel.predict_wp(self.plays.iloc[:4])
+        np.testing.assert_allclose(self.wpmodel.predict_wp(self.plays, chunksize=2, n_jobs=2),
+                                   self.expected_wp, rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info() == model.CacheInfo(4, 10, 100, 10)
+
+    def test_arrays_not_cached(self):
+        self.wpmodel.model = Pipeline([("model", LogisticRegression())]).fit(
+            np.array([[0.], [1.], [0.], [1.]]), np.array([0, 1, 1, 0]))
+        self.wpmodel.predict_wp(np.array([[0.], [1.]]))
+        assert self.wpmodel.cache_info().misses == 0
+
+    def test_pickled(self):
+        self.wpmodel.predict_wp(self.plays)
+        loaded_model = pickle.loads(pickle.dumps(self.wpmodel))
+        assert loaded_model.cache_info() == model.CacheInfo(0, 0, 100, 0)
+        np.testing.assert_allclose(loaded_model.predict_wp(self.plays), self.expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        assert self.wpmodel.cache_info().currsize == 10
+
+    def test_old_pickle(self):
+        #Models pickled before the cache existed have the pipeline in ``model``:
+        state = self.wpmodel.__getstate__()
+        state["model"] = state.pop("_model")
+        del state["_cache_size"]
+        state["_compact_model_source"] = None
+        loaded_model = model.WPModel.__new__(model.WPModel)
+        loaded_model.__setstate__(state)
+        assert loaded_model.cache_size == 0
+        assert "_compact_model_source" not in loaded_model.__dict__
+        np.testing.assert_allclose(loaded_model.predict_wp(self.plays), self.expected_wp,
+                                   rtol=1e-12, atol=1e-14)
+        loaded_model.predict_wp_single(**self.plays.iloc[0].to_dict())
+
+
+class TestPartitionPlays(object):
+    """Tests for splitting up plays to score them in parallel."""
+
+    def test_rows(self):
+        plays = pd.DataFrame({"down": np.arange(10)})
+        assert model._partition_plays(plays, 3) == [slice(0, 3), slice(3, 7), slice(7, 10)]
+        assert len(model._partition_plays(plays, 20)) == 10
+
+    def test_games_kept_together(self):
+        plays = pd.DataFrame({"gsis_id": ["a"] * 5 + ["b"] * 2 + ["c"] * 2 + ["d"]})
+        assert model._partition_plays(plays, 2) == [slice(0, 5), slice(5, 10)]
+        assert model._partition_plays(plays, 4) == [slice(0, 5), slice(5, 9), slice(9, 10)]
+
+    def test_interleaved_games(self):
+        plays = pd.DataFrame({"gsis_id": ["a", "b", "b", "a", "c", "c"]})
+        partitions = model._partition_plays(plays, 3)
+        np.testing.assert_array_equal(partitions[0], [0, 3])
+        assert partitions[1:] == [slice(1, 3), slice(4, 6)]
+
 class TestTestDistribution(object):
     """Tests the _test_distribution static method of WPModel."""
 
@@ -218,3 +522,148 @@ class TestModelIO(object):
         assert isinstance(loaded_instance, model.WPModel)
         
         
+
+
+class TestModelRegistry(object):
+    """Tests for sharing loaded models with get_model."""
+
+    def setup_method(self, method):
+        validate_tests = TestModelValidate()
+        validate_tests.setup_method(method)
+        self.plays = validate_tests.test_df.drop("offense_won", axis=1)
+        self.wpmodel = model.WPModel()
+        self.wpmodel.train_model(source_data=validate_tests.test_df)
+        model.model_registry.clear()
+
+    def teardown_method(self, method):
+        model.model_registry.clear()
+        model.model_registry.maxsize = 8
+
+    def _save(self, monkeypatch, tmpdir, filenames):
+        monkeypatch.setattr(model.WPModel, "model_directory", str(tmpdir))
+        for filename in filenames:
+            self.wpmodel.save_model(filename=filename)
+
+    def test_loaded_once(self, monkeypatch, tmpdir):
+        self._save(monkeypatch, tmpdir, ["one.nflwin"])
+        loaded_model = model.WPModel.get_model("one.nflwin")
+        assert model.WPModel.get_model("one.nflwin") is loaded_model
+        assert model.WPModel.load_model("one.nflwin") is not loaded_model
+        assert len(model.model_registry) == 1
+        np.testing.assert_allclose(loaded_model.predict_wp(self.plays),
+                                   self.wpmodel.predict_wp(self.plays), rtol=1e-12, atol=1e-14)
+
+    def test_memory_mapped(self, monkeypatch, tmpdir):
+        self._save(monkeypatch, tmpdir, ["one.nflwin"])
+        calibrated_classifier = model.WPModel.get_model("one.nflwin").model.steps[-1][1]
+        coefficients = calibrated_classifier.calibrated_classifiers_[0].base_estimator.coef_
+        assert isinstance(coefficients, np.memmap)
+        assert not coefficients.flags.writeable
+        calibrated_classifier = model.WPModel.get_model("one.nflwin", mmap_mode=None).model.steps[-1][1]
+        coefficients = calibrated_classifier.calibrated_classifiers_[0].base_estimator.coef_
+        assert not isinstance(coefficients, np.memmap)
+        assert len(model.model_registry) == 2
+
+    def test_reloaded_when_changed(self, monkeypatch, tmpdir):
+        self._save(monkeypatch, tmpdir, ["one.nflwin"])
+        loaded_model = model.WPModel.get_model("one.nflwin")
+        path = str(tmpdir.join("one.nflwin"))
+        modified_time = os.stat(path).st_mtime
+        self.wpmodel.save_model(filename="one.nflwin")
+        os.utime(path, (modified_time + 10, modified_time + 10))
+        assert model.WPModel.get_model("one.nflwin") is not loaded_model
+        assert len(model.model_registry) == 1
+
+    def test_least_recently_used_evicted(self, monkeypatch, tmpdir):
+        self._save(monkeypatch, tmpdir, ["one.nflwin", "two.nflwin", "three.nflwin"])
+        model.model_registry.maxsize = 2
+        one = model.WPModel.get_model("one.nflwin")
+        two = model.WPModel.get_model("two.nflwin")
+        assert model.WPModel.get_model("one.nflwin") is one
+        model.WPModel.get_model("three.nflwin")
+        assert len(model.model_registry) == 2
+        assert model.WPModel.get_model("one.nflwin") is one
+        assert model.WPModel.get_model("two.nflwin") is not two
+
+    def test_loaded_model_found_while_loading_another(self, monkeypatch, tmpdir):
+        self._save(monkeypatch, tmpdir, ["one.nflwin", "two.nflwin"])
+        one = model.WPModel.get_model("one.nflwin")
+        loading, finish_loading = threading.Event(), threading.Event()
+        original_load = model.joblib.load
+        def slow_load(path, mmap_mode=None):
+            loading.set()
+            finish_loading.wait(10)
+            return original_load(path, mmap_mode=mmap_mode)
+        monkeypatch.setattr(model.joblib, "load", slow_load)
+
+        loader = threading.Thread(target=model.WPModel.get_model, args=("two.nflwin",))
+        loader.start()
+        try:
+            assert loading.wait(10)
+            assert model.WPModel.get_model("one.nflwin") is one
+            assert len(model.model_registry) == 1
+        finally:
+            finish_loading.set()
+            loader.join()
+        assert len(model.model_registry) == 2
+
+    def test_loaded_once_by_concurrent_threads(self, monkeypatch, tmpdir):
+        self._save(monkeypatch, tmpdir, ["one.nflwin"])
+        num_loads = []
+        original_load = model.joblib.load
+        def counting_load(path, mmap_mode=None):
+            num_loads.append(path)
+            return original_load(path, mmap_mode=mmap_mode)
+        monkeypatch.setattr(model.joblib, "load", counting_load)
+
+        loaded_models = []
+        threads = [threading.Thread(target=lambda: loaded_models.append(
+            model.WPModel.get_model("one.nflwin"))) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(num_loads) == 1
+        assert all(loaded_model is loaded_models[0] for loaded_model in loaded_models)
+
+    def test_missing_file(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(model.WPModel, "model_directory", str(tmpdir))
+        with pytest.raises((IOError, OSError)):
+            model.WPModel.get_model("missing.nflwin")
+        assert len(model.model_registry) == 0
+
+class TestLazyImports(object):
+    """Tests that importing nflwin.model and scoring plays skip training and validation dependencies."""
+
+    def _imported_modules(self, script, module_names):
+        script += ("import sys\n"
+                   "print(sorted(name for name in {0!r} if name in sys.modules))\n").format(module_names)
+        package_directory = os.path.dirname(os.path.dirname(os.path.abspath(model.__file__)))
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         cwd=package_directory).decode("utf-8").splitlines()
+        return output[-1]
+
+    #The modules of NFLWin that only some methods use:
+    lazy_nflwin_modules = ["nflwin.compact", "nflwin.fused", "nflwin.lookup", "nflwin.profiling"]
+
+    def test_import(self):
+        module_names = self.lazy_nflwin_modules + [
+            "scipy.integrate", "scipy.stats", "sklearn.calibration", "sklearn.ensemble",
+            "sklearn.linear_model", "sklearn.metrics", "sklearn.model_selection",
+            "sklearn.neighbors", "sklearn.pipeline", "sklearn.preprocessing"]
+        assert self._imported_modules("import nflwin.model\n", module_names) == "[]"
+
+    def test_load_and_predict(self, monkeypatch, tmpdir, synthetic_plays, fitted_wpmodel):
+        monkeypatch.setattr(model.WPModel, "model_directory", str(tmpdir))
+        fitted_wpmodel.save_model(filename="model.nflwin")
+        plays_filename = str(tmpdir.join("plays.csv"))
+        synthetic_plays[0].to_csv(plays_filename, index=False)
+
+        script = ("import pandas as pd\n"
+                  "from nflwin.model import WPModel\n"
+                  "WPModel.model_directory = {0!r}\n"
+                  "WPModel.load_model('model.nflwin').predict_wp(pd.read_csv({1!r}))\n").format(
+                      str(tmpdir), plays_filename)
+        #(Unpickling the default model imports sklearn.calibration, which imports
+        #most of sklearn itself, so only check what NFLWin itself can avoid.)
+        assert self._imported_modules(script, self.lazy_nflwin_modules + ["sklearn.ensemble"]) == "[]"
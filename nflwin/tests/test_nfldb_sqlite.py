@@ -0,0 +1,168 @@
+from __future__ import print_function, division
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nflwin import nfldb_sqlite
+from nflwin import utilities as utils
+
+pytest.importorskip("sqlalchemy")
+
+
+def _make_fixture_tables():
+    """One finished game, one tie, and one unfinished game."""
+    game_df = pd.DataFrame({"gsis_id": ["2015091000", "2015091001", "2015091002"],
+                            "season_year": [2015, 2015, 2015],
+                            "season_type": ["Regular", "Regular", "Regular"],
+                            "finished": [True, True, False],
+                            "home_team": ["NE", "KC", "SF"],
+                            "away_team": ["PIT", "HOU", "DAL"],
+                            "home_score": [7, 0, 3],
+                            "away_score": [3, 0, 0]})
+    play_df = pd.DataFrame({"gsis_id": ["2015091000"] * 6 + ["2015091001", "2015091002"],
+                            "drive_id": [0, 1, 1, 2, 2, 2, 1, 1],
+                            "play_id": [1, 36, 56, 90, 110, 130, 36, 36],
+                            "time": ["(Pregame,0)", "(Q1,0)", "(Q1,55)", "(Q3,30)",
+                                     "(Q4,600)", "(Final,0)", "(Q1,0)", "(Q1,0)"],
+                            "pos_team": ["PIT", "PIT", "PIT", "NE", "NE", "NE", "KC", "SF"],
+                            "yardline": [None, "(-15)", "(20)", "(-15)", "(48)", None,
+                                         "(-15)", "(-15)"],
+                            "down": [None, None, 4, None, 1, None, None, None],
+                            "yards_to_go": [0, 0, 7, 0, 2, 0, 0, 0]})
+    agg_play_df = play_df[["gsis_id", "drive_id", "play_id"]].copy()
+    for stat in nfldb_sqlite.AGG_PLAY_COLUMNS[3:]:
+        agg_play_df[stat] = 0
+    agg_play_df.loc[2, "kicking_fgm"] = 1
+    agg_play_df.loc[4, "rushing_tds"] = 1
+    return {"game": game_df, "play": play_df, "agg_play": agg_play_df}
+
+
+class TestCreateDatabase(object):
+    """Testing the create_database function"""
+
+    def setup_method(self, method):
+        utils._nfldb_engine_cache.clear()
+
+    def test_fixture_data(self, tmpdir):
+        url = nfldb_sqlite.create_database(str(tmpdir.join("nfldb.sqlite")),
+                                           tables=_make_fixture_tables())
+        plays_df = utils.get_nfldb_play_data(season_years=[2015], database_url=url)
+
+        expected_df = pd.DataFrame({"gsis_id": ["2015091000"] * 4,
+                                    "drive_id": [1, 1, 2, 2],
+                                    "play_id": [36, 56, 90, 110],
+                                    "offense_team": ["PIT", "PIT", "NE", "NE"],
+                                    "yardline": [-15., 20., -15., 48.],
+                                    "down": np.array([0, 4, 0, 1], dtype=np.int8),
+                                    "yards_to_go": [0, 7, 0, 2],
+                                    "home_team": ["NE"] * 4,
+                                    "away_team": ["PIT"] * 4,
+                                    "offense_won": [False, False, True, True],
+                                    "quarter": ["Q1", "Q1", "Q3", "Q4"],
+                                    "seconds_elapsed": [0., 55., 30., 600.],
+                                    "curr_home_score": [0, 0, 0, 0],
+                                    "curr_away_score": [0, 0, 3, 3]})
+        pd.util.testing.assert_frame_equal(plays_df, expected_df[plays_df.columns])
+
+    def test_missing_table(self, tmpdir):
+        tables = _make_fixture_tables()
+        del tables["agg_play"]
+        with pytest.raises(ValueError):
+            nfldb_sqlite.create_database(str(tmpdir.join("nfldb.sqlite")), tables=tables)
+
+    def test_missing_columns(self, tmpdir):
+        tables = _make_fixture_tables()
+        tables["play"] = tables["play"].drop("time", axis=1)
+        with pytest.raises(ValueError):
+            nfldb_sqlite.create_database(str(tmpdir.join("nfldb.sqlite")), tables=tables)
+
+
+class TestSyntheticDatabase(object):
+    """Testing the ingestion functions against a synthetic SQLite database"""
+
+    def setup_method(self, method):
+        utils._nfldb_engine_cache.clear()
+
+    @pytest.fixture
+    def database_url(self, tmpdir):
+        return nfldb_sqlite.create_database(str(tmpdir.join("nfldb.sqlite")),
+                                            season_years=[2014, 2015],
+                                            season_types=["Regular", "Postseason"],
+                                            games_per_season=6, random_state=1)
+
+    def test_synthetic_tables_reproducible(self):
+        first_tables = nfldb_sqlite.make_synthetic_tables(random_state=3)
+        second_tables = nfldb_sqlite.make_synthetic_tables(random_state=3)
+        for table_name in ["game", "play", "agg_play"]:
+            pd.util.testing.assert_frame_equal(first_tables[table_name], second_tables[table_name])
+
+    def test_filters_applied(self, database_url):
+        plays_df = utils.get_nfldb_play_data(season_years=[2015], season_types=["Regular"],
+                                             database_url=database_url)
+        assert plays_df['gsis_id'].str.startswith("201509").all()
+        assert plays_df['quarter'].isin(["Q1", "Q2", "Q3", "Q4"]).all()
+        assert plays_df['offense_won'].dtype == np.bool_
+
+    def test_final_scores_match_games(self, database_url):
+        plays_df = utils.get_nfldb_play_data(database_url=database_url)
+        games_df = pd.read_sql("SELECT * FROM game WHERE finished = 1 AND home_score != away_score",
+                               utils.connect_nfldb(database_url)).set_index("gsis_id")
+        last_plays_df = plays_df.groupby("gsis_id").last()
+        assert sorted(last_plays_df.index) == sorted(games_df.index)
+        assert (last_plays_df['curr_home_score'] ==
+                games_df.loc[last_plays_df.index, 'home_score']).all()
+        assert (last_plays_df['curr_away_score'] ==
+                games_df.loc[last_plays_df.index, 'away_score']).all()
+
+    def test_aggregate_scores_in_db_matches(self, database_url):
+        python_df = utils.get_nfldb_play_data(database_url=database_url)
+        database_df = utils.get_nfldb_play_data(database_url=database_url,
+                                                aggregate_scores_in_db=True)
+        pd.util.testing.assert_frame_equal(python_df, database_df[python_df.columns])
+
+    def test_iter_matches(self, database_url):
+        plays_df = utils.get_nfldb_play_data(database_url=database_url)
+        chunked_df = pd.concat(utils.iter_nfldb_play_data(season_types=["Regular", "Postseason"],
+                                                          database_url=database_url,
+                                                          chunksize=250),
+                               ignore_index=True)
+        pd.util.testing.assert_frame_equal(plays_df, chunked_df)
+
+    def test_update_matches(self, database_url, tmpdir):
+        pytest.importorskip("pyarrow")
+        plays_df = utils.get_nfldb_play_data(database_url=database_url)
+        store_filename = str(tmpdir.join("plays.feather"))
+        utils.update_nfldb_play_data(store_filename, season_years=[2014], season_types=["Regular"],
+                                     database_url=database_url)
+        updated_df = utils.update_nfldb_play_data(store_filename, database_url=database_url)
+        pd.util.testing.assert_frame_equal(plays_df, updated_df)
+
+    def test_parallel_matches(self, database_url):
+        plays_df = utils.get_nfldb_play_data(season_years=[2014, 2015],
+                                             database_url=database_url)
+        parallel_df = utils.get_nfldb_play_data(season_years=[2014, 2015], n_jobs=2,
+                                                database_url=database_url)
+        pd.util.testing.assert_frame_equal(plays_df, parallel_df)
+
+    def test_all_seasons_parallel_matches(self, database_url):
+        assert utils._query_nfldb_season_years(season_types=["Regular"],
+                                               database_url=database_url) == [2014, 2015]
+        plays_df = utils.get_nfldb_play_data(database_url=database_url)
+        parallel_df = utils.get_nfldb_play_data(n_jobs=2, database_url=database_url)
+        pd.util.testing.assert_frame_equal(plays_df, parallel_df)
+
+    def test_columns_pruned(self, database_url):
+        plays_df = utils.get_nfldb_play_data(database_url=database_url,
+                                             columns=["quarter", "curr_home_score"])
+        assert list(plays_df.columns) == ["gsis_id", "drive_id", "play_id",
+                                          "quarter", "curr_home_score"]
+
+    @pytest.mark.parametrize("columns", [["down"], ["yardline", "down"], ["curr_away_score"],
+                                         ["down", "curr_home_score"]])
+    def test_columns_with_aggregate_scores_in_db(self, database_url, columns):
+        plays_df = utils.get_nfldb_play_data(database_url=database_url, columns=columns)
+        database_df = utils.get_nfldb_play_data(database_url=database_url, columns=columns,
+                                                aggregate_scores_in_db=True)
+        assert list(database_df.columns) == ["gsis_id", "drive_id", "play_id"] + columns
+        pd.util.testing.assert_frame_equal(plays_df, database_df)
@@ -110,6 +110,48 @@ class TestComputeElapsedTime(object):
                                     "time_elapsed": [200, 0, 50, 850, 40],
                                     "total_elapsed_time": [200, 500, 1850, 3550, 3640]})
         pd.util.testing.assert_frame_equal(transformed_df, expected_df)
+
+    def test_unknown_quarter_nan(self):
+        input_df = pd.DataFrame({"quarter": ["Q1", "Q5", "Q3"],
+                                 "time_elapsed": [200, 0, 50]})
+        cet = preprocessing.ComputeElapsedTime("quarter", "time_elapsed", handle_unknown="nan")
+        transformed_df = cet.fit(input_df).transform(input_df)
+        np.testing.assert_array_equal(transformed_df["total_elapsed_time"].values,
+                                      [200., np.nan, 1850.])
+
+    def test_unknown_quarter_sentinel(self):
+        input_df = pd.DataFrame({"quarter": ["Q1", "Q5", "Q3"],
+                                 "time_elapsed": [200, 0, 50]})
+        cet = preprocessing.ComputeElapsedTime("quarter", "time_elapsed", handle_unknown=-1)
+        transformed_df = cet.fit(input_df).transform(input_df)
+        np.testing.assert_array_equal(transformed_df["total_elapsed_time"].values,
+                                      [200, -1, 1850])
+        assert transformed_df["total_elapsed_time"].dtype == np.int
+
+    def test_missing_quarter(self):
+        input_df = pd.DataFrame({"quarter": ["Q1", np.nan, "Q3"],
+                                 "time_elapsed": [200, 0, 50]})
+        cet = preprocessing.ComputeElapsedTime("quarter", "time_elapsed")
+        transformed_df = cet.fit(input_df).transform(input_df)
+        np.testing.assert_array_equal(transformed_df["total_elapsed_time"].values,
+                                      [200., np.nan, 1850.])
+
+    def test_categorical_quarters(self):
+        input_df = pd.DataFrame({"quarter": ["Q1", "Q2", "Q3", "Q4", "OT", "Q2"],
+                                 "time_elapsed": [200, 0, 50, 850, 40, 1.5]})
+        cet = preprocessing.ComputeElapsedTime("quarter", "time_elapsed")
+        expected_df = cet.fit(input_df).transform(input_df)
+        input_df["quarter"] = input_df["quarter"].astype(
+            pd.api.types.CategoricalDtype(["OT2", "OT", "Q4", "Q3", "Q2", "Q1"]))
+        transformed_df = cet.fit(input_df).transform(input_df)
+        pd.util.testing.assert_series_equal(transformed_df["total_elapsed_time"],
+                                            expected_df["total_elapsed_time"])
+
+    def test_bad_unknown_policy(self):
+        input_df = pd.DataFrame({"quarter": ["Q1"], "time_elapsed": [200]})
+        cet = preprocessing.ComputeElapsedTime("quarter", "time_elapsed", handle_unknown="skip")
+        with pytest.raises(ValueError):
+            cet.fit(input_df).transform(input_df)
         
 
 class TestComputeIfOffenseIsHome(object):
@@ -251,6 +293,66 @@ class TestMapToInt(object):
         mti.fit(input_df)
         transformed_data = mti.transform(input_df)
         pd.util.testing.assert_frame_equal(input_df, expected_df)
+
+    def test_mapping_with_float_nans(self):
+        input_df = pd.DataFrame({"one": [1., np.nan, 3., 1.]})
+        mti = preprocessing.MapToInt("one")
+        mti.fit(input_df)
+        assert mti.mapping == {1.: 0, 3.: 2}
+
+    def test_transform_unknown_passthrough(self):
+        mti = preprocessing.MapToInt("one")
+        mti.fit(pd.DataFrame({"one": ["one", "two"]}))
+        transformed_df = mti.transform(pd.DataFrame({"one": ["two", "three", "one"]}))
+        expected_df = pd.DataFrame({"one": [1, "three", 0]})
+        pd.util.testing.assert_frame_equal(transformed_df, expected_df)
+
+    def test_transform_unknown_passthrough_numeric(self):
+        mti = preprocessing.MapToInt("one")
+        mti.fit(pd.DataFrame({"one": [3, 5]}))
+        transformed_df = mti.transform(pd.DataFrame({"one": [5, 7, 3]}))
+        expected_df = pd.DataFrame({"one": [1, 7, 0]})
+        pd.util.testing.assert_frame_equal(transformed_df, expected_df)
+
+    def test_transform_unknown_nan(self):
+        mti = preprocessing.MapToInt("one", handle_unknown="nan")
+        mti.fit(pd.DataFrame({"one": ["one", "two"]}))
+        transformed_df = mti.transform(pd.DataFrame({"one": ["two", "three", "one"]}))
+        expected_df = pd.DataFrame({"one": [1, np.nan, 0]})
+        pd.util.testing.assert_frame_equal(transformed_df, expected_df)
+
+    def test_transform_unknown_error(self):
+        mti = preprocessing.MapToInt("one", handle_unknown="error")
+        mti.fit(pd.DataFrame({"one": ["one", "two", np.nan]}))
+        mti.transform(pd.DataFrame({"one": ["two", np.nan]}))
+        with pytest.raises(ValueError):
+            mti.transform(pd.DataFrame({"one": ["two", "three", "one"]}))
+
+    def test_transform_unknown_sentinel(self):
+        mti = preprocessing.MapToInt("one", handle_unknown=-1)
+        mti.fit(pd.DataFrame({"one": ["one", "two"]}))
+        transformed_df = mti.transform(pd.DataFrame({"one": ["two", "three", "one"]}))
+        expected_df = pd.DataFrame({"one": [1, -1, 0]})
+        pd.util.testing.assert_frame_equal(transformed_df, expected_df)
+
+    def test_transform_categorical(self):
+        input_df = pd.DataFrame({"one": ["one", "two", "one", "four",
+                                         "six", "two", np.nan, "one"]})
+        mti = preprocessing.MapToInt("one")
+        mti.fit(input_df)
+        expected_df = mti.transform(input_df)
+        categorical_df = input_df.astype(pd.api.types.CategoricalDtype(["six", "one", "five",
+                                                                        "four", "two"]))
+        pd.util.testing.assert_frame_equal(mti.transform(categorical_df), expected_df)
+
+    def test_old_pickles(self):
+        input_df = pd.DataFrame({"one": ["one", "two", "three"]})
+        mti = preprocessing.MapToInt("one")
+        mti.fit(input_df.iloc[:2])
+        del mti.handle_unknown
+        transformed_df = mti.transform(input_df)
+        expected_df = pd.DataFrame({"one": [0, 1, "three"]})
+        pd.util.testing.assert_frame_equal(transformed_df, expected_df)
         
         
         
@@ -349,6 +451,55 @@ class TestOneHotEncoderFromDataFrame(object):
         print(expected_data)
         pd.util.testing.assert_frame_equal(transformed_data.sort_index(axis=1),
                                            expected_data.sort_index(axis=1))
+
+    def test_sparse_matches_dense(self):
+        dense_ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["one", "three"])
+        sparse_ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["one", "three"],
+                                                              sparse=True)
+        expected_data = dense_ohe.fit(self.data).transform(self.data)
+        transformed_data = sparse_ohe.fit(self.data).transform(self.data)
+        assert transformed_data.format == "csr"
+        assert transformed_data.dtype == np.float64
+        np.testing.assert_array_equal(transformed_data.toarray(), expected_data.values)
+
+    def test_sparse_all_columns(self):
+        ohe = preprocessing.OneHotEncoderFromDataFrame(sparse=True)
+        transformed_data = ohe.fit(self.data).transform(self.data)
+        assert transformed_data.shape == (4, 7)
+        assert transformed_data.nnz == 12
+
+    def test_sparse_array_input(self):
+        ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=[0, 2], sparse=True)
+        expected_data = preprocessing.OneHotEncoderFromDataFrame(
+            categorical_feature_names=["one", "three"]).fit(self.data).transform(self.data)
+        transformed_data = ohe.fit(self.data.values).transform(self.data.values)
+        np.testing.assert_array_equal(transformed_data.toarray(), expected_data.values)
+
+    def test_sparse_unknown_category(self):
+        ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["one"], sparse=True)
+        ohe.fit(self.data)
+        self.data["one"] = 10
+        with pytest.raises(ValueError):
+            ohe.transform(self.data)
+
+    def test_sparse_non_numeric_column(self):
+        ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["one"], sparse=True)
+        ohe.fit(self.data)
+        self.data["team"] = ["NE", "PIT", "NE", "PIT"]
+        with pytest.raises(ValueError) as excinfo:
+            ohe.transform(self.data)
+        assert "team" in str(excinfo.value)
+
+    def test_sparse_numeric_object_column(self):
+        ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["one"], sparse=True)
+        expected_data = ohe.fit(self.data).transform(self.data).toarray()
+        self.data["two"] = self.data["two"].astype(object)
+        np.testing.assert_array_equal(ohe.transform(self.data).toarray(), expected_data)
+
+    def test_sparse_pickled_before_option(self):
+        ohe = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["one"])
+        del ohe._sparse
+        assert ohe.sparse is False
         
         
         
@@ -569,3 +720,281 @@ class TestCheckColumnNames(object):
         expected_data = expected_data[["c", "b", "a"]]
         transformed_data = ccn.transform(input_data)
         pd.util.testing.assert_frame_equal(expected_data, transformed_data)
+
+
+class TestGetRequiredColumns(object):
+    """Testing the get_required_columns function"""
+
+    def test_default_pipeline(self):
+        from nflwin.model import WPModel
+        required_columns = preprocessing.get_required_columns(WPModel().model)
+        assert required_columns == ["offense_team", "home_team",
+                                    "curr_home_score", "curr_away_score",
+                                    "down", "quarter", "seconds_elapsed",
+                                    "yardline", "yards_to_go"]
+
+    def test_created_columns_not_required(self):
+        pipe = Pipeline(steps=[("home", preprocessing.ComputeIfOffenseIsHome("offense", "home")),
+                               ("check", preprocessing.CheckColumnNames(["is_offense_home", "yardline"])),
+                               ("map", preprocessing.MapToInt("unused")),
+                               ("model", None)])
+        assert preprocessing.get_required_columns(pipe) == ["offense", "home", "yardline"]
+
+    def test_undetermined_columns(self):
+        pipe = Pipeline(steps=[("check", preprocessing.CheckColumnNames()),
+                               ("model", None)])
+        assert preprocessing.get_required_columns(pipe) is None
+        assert preprocessing.get_required_columns("not a pipeline") is None
+
+    def test_no_check_column_names(self):
+        pipe = Pipeline(steps=[("encode", preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["down"])),
+                               ("model", None)])
+        assert preprocessing.get_required_columns(pipe) is None
+
+
+class TestFusedFeatureBuilder(object):
+    """Testing the FusedFeatureBuilder and compile_pipeline"""
+
+    def setup_method(self, method):
+        self.plays = pd.DataFrame({
+            "gsis_id": ["2015091000"] * 8,
+            "offense_team": ["NE", "NE", "PIT", "PIT", "NE", "PIT", "NE", "PIT"],
+            "home_team": ["NE"] * 8,
+            "curr_home_score": [0, 0, 7, 7, 7, 10, 14, 14],
+            "curr_away_score": [0, 0, 0, 3, 3, 3, 3, 10],
+            "down": np.array([0, 1, 2, 3, 4, 1, 0, 2], dtype=np.int8),
+            "quarter": ["Q1", "Q1", "Q2", "Q2", "Q3", "Q4", "Q4", "OT"],
+            "seconds_elapsed": [0., 30.5, 100., 899., 12., 450., 600., 3.],
+            "yardline": [-15., 20., -30., 49., 0., -1., -15., 10.],
+            "yards_to_go": [0, 10, 7, 1, 3, 10, 0, 4],
+            "offense_won": [True, True, False, False, True, False, True, False]},
+            index=np.arange(8) * 3 + 5)
+        self.steps = [
+            preprocessing.ComputeIfOffenseIsHome("offense_team", "home_team"),
+            preprocessing.CreateScoreDifferential("curr_home_score", "curr_away_score",
+                                                  "is_offense_home"),
+            preprocessing.MapToInt("down"),
+            preprocessing.ComputeElapsedTime("quarter", "seconds_elapsed"),
+            preprocessing.CheckColumnNames(["is_offense_home", "score_differential",
+                                            "total_elapsed_time", "yardline",
+                                            "yards_to_go", "down"]),
+            preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["down"])]
+
+    def _run_steps(self, X):
+        for step in self.steps:
+            X = step.fit(X).transform(X)
+        return np.asarray(X, dtype=np.float64)
+
+    def test_bit_identical_to_steps(self):
+        expected_features = self._run_steps(self.plays)
+        fused_features = preprocessing.FusedFeatureBuilder(self.steps).transform(self.plays)
+        assert fused_features.dtype == np.float64
+        np.testing.assert_array_equal(fused_features.view(np.int64),
+                                      expected_features.view(np.int64))
+
+    def test_fit(self):
+        expected_features = self._run_steps(self.plays)
+        unfit_steps = [step.__class__(**step.get_params()) for step in self.steps]
+        fused_features = (preprocessing.FusedFeatureBuilder(unfit_steps)
+                          .fit(self.plays).transform(self.plays))
+        np.testing.assert_array_equal(fused_features, expected_features)
+
+    def test_categorical_columns(self):
+        expected_features = self._run_steps(self.plays)
+        categorical_plays = self.plays.copy()
+        teams = pd.api.types.CategoricalDtype(["NE", "PIT"])
+        categorical_plays["offense_team"] = categorical_plays["offense_team"].astype(teams)
+        categorical_plays["home_team"] = categorical_plays["home_team"].astype(teams)
+        categorical_plays["quarter"] = categorical_plays["quarter"].astype("category")
+        fused_features = preprocessing.FusedFeatureBuilder(self.steps).transform(categorical_plays)
+        np.testing.assert_array_equal(fused_features, expected_features)
+
+    def test_without_check_column_names(self):
+        plays = pd.DataFrame({"offense_team": [1, 2, 2], "home_team": [2, 2, 2],
+                              "curr_home_score": [3, 0, 7], "curr_away_score": [0, 0, 14]})
+        steps = self.steps[:2]
+        expected_features = plays
+        for step in steps:
+            expected_features = step.transform(expected_features)
+        fused_features = preprocessing.FusedFeatureBuilder(steps).transform(plays)
+        np.testing.assert_array_equal(fused_features, np.asarray(expected_features, dtype=np.float64))
+
+    def test_missing_column(self):
+        self._run_steps(self.plays)
+        with pytest.raises(KeyError):
+            preprocessing.FusedFeatureBuilder(self.steps).transform(self.plays.drop("yardline", axis=1))
+
+    def test_unmapped_quarter(self):
+        self._run_steps(self.plays)
+        self.plays["quarter"] = "Q5"
+        with pytest.raises(TypeError):
+            preprocessing.FusedFeatureBuilder(self.steps).transform(self.plays)
+
+    def test_unknown_category(self):
+        self._run_steps(self.plays)
+        self.plays.loc[self.plays["down"] == 4, "down"] = 7
+        with pytest.raises(ValueError):
+            preprocessing.FusedFeatureBuilder(self.steps).transform(self.plays)
+
+    def test_compile_pipeline(self):
+        from sklearn.linear_model import LogisticRegression
+        pipe = Pipeline(steps=[("step{0}".format(i), step) for i, step in enumerate(self.steps)] +
+                        [("model", LogisticRegression())])
+        pipe.fit(self.plays, self.plays["offense_won"])
+        compiled_pipe = preprocessing.compile_pipeline(pipe)
+        np.testing.assert_array_equal(compiled_pipe.predict_proba(self.plays),
+                                      pipe.predict_proba(self.plays))
+        assert preprocessing.get_required_columns(compiled_pipe) == preprocessing.get_required_columns(pipe)
+
+    def test_sparse_encoder(self):
+        from sklearn.linear_model import LogisticRegression
+        expected_features = self._run_steps(self.plays)
+        self.steps[-1].sparse = True
+        fused_features = preprocessing.FusedFeatureBuilder(self.steps).transform(self.plays)
+        assert fused_features.format == "csr"
+        np.testing.assert_array_equal(fused_features.toarray(), expected_features)
+
+        pipe = Pipeline(steps=[("step{0}".format(i), step) for i, step in enumerate(self.steps)] +
+                        [("model", LogisticRegression())])
+        pipe.fit(self.plays, self.plays["offense_won"])
+        compiled_pipe = preprocessing.compile_pipeline(pipe)
+        np.testing.assert_allclose(compiled_pipe.predict_proba(self.plays),
+                                   pipe.predict_proba(self.plays))
+
+    def test_sparse_encoder_not_last(self):
+        self.steps.append(preprocessing.CheckColumnNames())
+        self._run_steps(self.plays)
+        self.steps[-2].sparse = True
+        with pytest.raises(TypeError):
+            preprocessing.FusedFeatureBuilder(self.steps).transform(self.plays)
+
+    def test_compile_unknown_step(self):
+        from sklearn.preprocessing import StandardScaler
+        pipe = Pipeline(steps=[("scale", StandardScaler()), ("model", None)])
+        with pytest.raises(TypeError):
+            preprocessing.compile_pipeline(pipe)
+
+
+class TestArrayMode(object):
+    """Testing the transformers on Numpy arrays"""
+
+    def setup_method(self, method):
+        self.plays_df = pd.DataFrame({
+            "offense_team": ["NE", "NE", "PIT", "PIT", "NE", "PIT"],
+            "home_team": ["NE"] * 6,
+            "curr_home_score": [0, 0, 7, 7, 7, 10],
+            "curr_away_score": [0, 0, 0, 3, 3, 3],
+            "down": [0, 1, 2, 3, 4, 1],
+            "quarter": ["Q1", "Q1", "Q2", "Q2", "Q3", "OT"],
+            "seconds_elapsed": [0., 30.5, 100., 899., 12., 450.],
+            "yardline": [-15., 20., -30., 49., 0., -1.]},
+            columns=["offense_team", "home_team", "curr_home_score", "curr_away_score",
+                     "down", "quarter", "seconds_elapsed", "yardline"])
+        self.plays_array = self.plays_df.values
+        self.plays_structured = self.plays_df.to_records(index=False)
+
+    def _make_steps(self, colnames):
+        """Make the default preprocessing steps, with columns identified by ``colnames``."""
+        return [
+            preprocessing.ComputeIfOffenseIsHome(colnames["offense_team"], colnames["home_team"]),
+            preprocessing.CreateScoreDifferential(colnames["curr_home_score"],
+                                                  colnames["curr_away_score"],
+                                                  colnames["is_offense_home"]),
+            preprocessing.MapToInt(colnames["down"]),
+            preprocessing.ComputeElapsedTime(colnames["quarter"], colnames["seconds_elapsed"]),
+            preprocessing.CheckColumnNames([colnames["is_offense_home"],
+                                            colnames["score_differential"],
+                                            colnames["total_elapsed_time"],
+                                            colnames["yardline"], colnames["down"]]),
+            preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=[colnames["down"]])]
+
+    def _fit_transform(self, steps, X):
+        for step in steps:
+            X = step.fit(X).transform(X)
+        return X
+
+    @property
+    def _names(self):
+        return {name: name for name in list(self.plays_df.columns) +
+                ["is_offense_home", "score_differential", "total_elapsed_time"]}
+
+    @property
+    def _indices(self):
+        indices = {name: i for i, name in enumerate(self.plays_df.columns)}
+        #New columns are appended, and the down ends up in the same position
+        #after the CheckColumnNames step:
+        indices.update({"is_offense_home": 8, "score_differential": 9,
+                        "total_elapsed_time": 10})
+        return indices
+
+    def test_ndarray_pipeline(self):
+        expected_features = np.asarray(self._fit_transform(self._make_steps(self._names),
+                                                           self.plays_df), dtype=np.float64)
+        array_features = self._fit_transform(self._make_steps(self._indices), self.plays_array)
+        assert isinstance(array_features, np.ndarray)
+        np.testing.assert_array_equal(array_features.astype(np.float64), expected_features)
+
+    def test_structured_pipeline(self):
+        expected_df = self._fit_transform(self._make_steps(self._names), self.plays_df)
+        structured_features = self._fit_transform(self._make_steps(self._names),
+                                                  self.plays_structured)
+        assert list(structured_features.dtype.names) == list(expected_df.columns)
+        for colname in expected_df.columns:
+            np.testing.assert_array_equal(structured_features[colname], expected_df[colname].values)
+
+    def test_fused_ndarray(self):
+        steps = self._make_steps(self._indices)
+        expected_features = self._fit_transform(steps, self.plays_array)
+        fused_features = preprocessing.FusedFeatureBuilder(steps).transform(self.plays_array)
+        np.testing.assert_array_equal(fused_features, expected_features.astype(np.float64))
+
+    def test_new_column_appended(self):
+        is_home = preprocessing.ComputeIfOffenseIsHome(0, 1)
+        output_array = is_home.fit(self.plays_array).transform(self.plays_array)
+        assert output_array.shape == (6, 9)
+        np.testing.assert_array_equal(output_array[:, :8], self.plays_array)
+        np.testing.assert_array_equal(output_array[:, 8].astype(bool),
+                                      [True, True, False, False, True, False])
+
+    def test_map_to_int(self):
+        mti = preprocessing.MapToInt(5)
+        output_array = mti.fit(self.plays_array).transform(self.plays_array)
+        assert mti.mapping == {"Q1": 0, "Q2": 1, "Q3": 2, "OT": 3}
+        np.testing.assert_array_equal(output_array[:, 5].astype(int), [0, 0, 1, 1, 2, 3])
+        np.testing.assert_array_equal(output_array[:, :5], self.plays_array[:, :5])
+
+    def test_map_to_int_bad_index(self):
+        mti = preprocessing.MapToInt(20)
+        with pytest.raises(KeyError):
+            mti.fit(self.plays_array)
+
+    def test_check_column_names_unspecified(self):
+        ccn = preprocessing.CheckColumnNames()
+        ccn.fit(self.plays_array)
+        assert ccn.column_names == list(range(8))
+        with pytest.raises(KeyError):
+            ccn.transform(self.plays_array[:, :4])
+
+    def test_onehot_all_columns(self):
+        data = np.array([[0, 1], [1, 0], [2, 1]])
+        ohe = preprocessing.OneHotEncoderFromDataFrame()
+        output_array = ohe.fit(data).transform(data)
+        expected_array = preprocessing.OneHotEncoderFromDataFrame().fit(
+            pd.DataFrame(data)).transform(pd.DataFrame(data)).values
+        np.testing.assert_array_equal(output_array, expected_array)
+
+    def test_mode_bound_at_fit(self):
+        is_home = preprocessing.ComputeIfOffenseIsHome("offense_team", "home_team")
+        is_home.fit(self.plays_df)
+        with pytest.raises(TypeError):
+            is_home.transform(self.plays_array)
+
+        ccn = preprocessing.CheckColumnNames(column_names=[0, 1])
+        ccn.fit(self.plays_array)
+        with pytest.raises(TypeError):
+            ccn.transform(self.plays_df)
+
+    def test_input_not_modified(self):
+        original_array = self.plays_array.copy()
+        self._fit_transform(self._make_steps(self._indices), self.plays_array)
+        np.testing.assert_array_equal(self.plays_array, original_array)
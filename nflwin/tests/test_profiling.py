@@ -0,0 +1,219 @@
+from __future__ import print_function, division
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nflwin import model
+from nflwin import preprocessing
+from nflwin import profiling
+
+class TestAccountCopies(object):
+    """Testing the copy accounting, and that copy=False doesn't copy."""
+
+    def setup_method(self, method):
+        self.plays = pd.DataFrame({
+            "offense_team": ["NE", "NE", "PIT", "PIT", "NE", "PIT", "NE", "PIT"],
+            "home_team": ["NE"] * 8,
+            "away_team": ["PIT"] * 8,
+            "curr_home_score": [0, 0, 7, 7, 7, 10, 14, 14],
+            "curr_away_score": [0, 0, 0, 3, 3, 3, 3, 10],
+            "down": np.array([0, 1, 2, 3, 4, 1, 0, 2], dtype=np.int8),
+            "quarter": ["Q1", "Q1", "Q2", "Q2", "Q3", "Q4", "Q4", "OT"],
+            "seconds_elapsed": [0., 30.5, 100., 899., 12., 450., 600., 3.],
+            "yardline": [-15., 20., -30., 49., 0., -1., -15., 10.],
+            "yards_to_go": [0, 10, 7, 1, 3, 10, 0, 4]})
+        self.offense_won = np.array([True, True, False, False, True, False, True, False])
+
+    def _fit_default_pipeline(self, copy_data):
+        pipeline = model.WPModel(copy_data=copy_data).model
+        pipeline.fit(self.plays.copy(), self.offense_won)
+        return pipeline
+
+    def test_copy_counted(self):
+        steps = [("offense_home", preprocessing.ComputeIfOffenseIsHome("offense_team", "home_team",
+                                                                       copy=True))]
+        reports = profiling.account_copies(steps, self.plays)
+        assert len(reports) == 1
+        assert reports[0].name == "offense_home"
+        assert not reports[0].in_place
+        assert reports[0].copied_columns == list(self.plays.columns)
+        assert reports[0].bytes_copied == sum(self.plays[colname].values.nbytes
+                                              for colname in self.plays.columns)
+        assert "is_offense_home" not in self.plays.columns
+
+    def test_changed_column_not_counted(self):
+        steps = [("map_down", preprocessing.MapToInt("down", copy=True).fit(self.plays))]
+        reports = profiling.account_copies(steps, self.plays)
+        assert "down" not in reports[0].copied_columns
+        assert len(reports[0].copied_columns) == len(self.plays.columns) - 1
+
+    def test_in_place_steps(self):
+        steps = [("offense_home", preprocessing.ComputeIfOffenseIsHome("offense_team", "home_team",
+                                                                       copy=False)),
+                 ("score_differential", preprocessing.CreateScoreDifferential(
+                     "curr_home_score", "curr_away_score", "is_offense_home", copy=False)),
+                 ("map_down", preprocessing.MapToInt("down", copy=False).fit(self.plays)),
+                 ("elapsed_time", preprocessing.ComputeElapsedTime("quarter", "seconds_elapsed",
+                                                                   copy=False))]
+        reports = profiling.account_copies(steps, self.plays)
+        for report in reports:
+            assert report.in_place
+            assert report.bytes_copied == 0
+        assert "total_elapsed_time" in self.plays.columns
+
+    def test_check_column_names_copies_once(self):
+        column_names = ["yardline", "down", "yards_to_go"]
+        for copy in [True, False]:
+            steps = [("check", preprocessing.CheckColumnNames(column_names, copy=copy))]
+            reports = profiling.account_copies(steps, self.plays)
+            assert reports[0].copied_columns == column_names
+            assert len(self.plays.columns) == 10
+
+    def test_check_column_names_no_copy_needed(self):
+        steps = [("check", preprocessing.CheckColumnNames(list(self.plays.columns), copy=False))]
+        reports = profiling.account_copies(steps, self.plays)
+        assert reports[0].in_place
+        assert reports[0].bytes_copied == 0
+
+    def test_onehot_in_place(self):
+        encoder = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["down"],
+                                                           copy=False).fit(self.plays)
+        reports = profiling.account_copies([("onehot", encoder)], self.plays)
+        assert reports[0].in_place
+        #The int8 down column is in a block of its own, so nothing else needs to move:
+        assert reports[0].bytes_copied == 0
+        assert "down" not in self.plays.columns
+        assert "onehot_col5" in self.plays.columns
+
+    def test_onehot_copy(self):
+        encoder = preprocessing.OneHotEncoderFromDataFrame(categorical_feature_names=["down"],
+                                                           copy=True).fit(self.plays)
+        reports = profiling.account_copies([("onehot", encoder)], self.plays)
+        assert not reports[0].in_place
+        assert reports[0].copied_columns == [colname for colname in self.plays.columns
+                                             if colname != "down"]
+        assert "down" in self.plays.columns
+
+    def test_default_pipeline_in_place(self):
+        pipeline = self._fit_default_pipeline(copy_data=False)
+        reports = profiling.account_copies(pipeline, self.plays)
+        assert [report.name for report in reports] == [name for name, step in pipeline.steps[:-1]]
+        for report in reports[:4]:
+            assert report.in_place
+            assert report.bytes_copied == 0
+        #Selecting the model columns copies each of them once:
+        assert (reports[4].copied_columns ==
+                list(pipeline.named_steps["remove_unnecessary_columns"].column_names))
+
+    def test_default_pipeline_matches_copy(self):
+        expected_output = self.plays.copy()
+        for name, step in self._fit_default_pipeline(copy_data=True).steps[:-1]:
+            expected_output = step.transform(expected_output)
+        output = self.plays
+        for name, step in self._fit_default_pipeline(copy_data=False).steps[:-1]:
+            output = step.transform(output)
+        pd.util.testing.assert_frame_equal(output, expected_output)
+
+    def test_array_input(self):
+        #(In array mode transformers always return a new array.)
+        steps = [("offense_home", preprocessing.ComputeIfOffenseIsHome(0, 1, copy=False)
+                  .fit(np.ones((5, 2))))]
+        reports = profiling.account_copies(steps, np.arange(10.).reshape(5, 2))
+        assert not reports[0].in_place
+        assert reports[0].copied_columns == [0, 1]
+        assert reports[0].bytes_copied == 80
+
+    def test_existing_trace_kept(self):
+        tracemalloc = pytest.importorskip("tracemalloc")
+        steps = [("offense_home", preprocessing.ComputeIfOffenseIsHome("offense_team", "home_team",
+                                                                       copy=True))]
+        tracemalloc.start(5)
+        try:
+            traced_object = bytearray(1000)
+            reports = profiling.account_copies(steps, self.plays)
+            assert tracemalloc.get_traceback_limit() == 5
+            assert tracemalloc.get_object_traceback(traced_object) is not None
+        finally:
+            tracemalloc.stop()
+        assert reports[0].bytes_allocated is None
+        assert not reports[0].in_place
+
+
+class TestProfilePipeline(object):
+    """Testing the per-step profiling of pipelines."""
+
+    def setup_method(self, method):
+        self.X = pd.DataFrame({"one": [1, 2, 3, 1, 2, 3],
+                               "two": [0., 1., 0., 1., 0., 1.]})
+        self.y = np.array([0, 1, 0, 1, 0, 1])
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import Pipeline
+        self.pipeline = Pipeline([("check", preprocessing.CheckColumnNames()),
+                                  ("onehot", preprocessing.OneHotEncoderFromDataFrame(
+                                      categorical_feature_names=["one"])),
+                                  ("model", LogisticRegression())])
+
+    def test_records(self):
+        with profiling.profile_pipeline(self.pipeline) as profile:
+            self.pipeline.fit(self.X, self.y)
+            self.pipeline.predict_proba(self.X.iloc[:4])
+        records = profile.to_dataframe()
+        assert list(records.columns) == ["step", "method", "seconds", "rows", "peak_bytes"]
+        assert list(zip(records["step"], records["method"])) == [
+            ("check", "fit"), ("check", "transform"), ("onehot", "fit"), ("onehot", "transform"),
+            ("model", "fit"),
+            ("check", "transform"), ("onehot", "transform"), ("model", "predict_proba")]
+        assert list(records["rows"]) == [6] * 5 + [4] * 3
+        assert (records["seconds"] >= 0).all()
+        assert (records["peak_bytes"] >= 0).all()
+
+    def test_summarize(self):
+        with profiling.profile_pipeline(self.pipeline, trace_memory=False) as profile:
+            self.pipeline.fit(self.X, self.y)
+            self.pipeline.predict_proba(self.X)
+        summary = profile.summarize()
+        assert list(summary.columns) == ["calls", "seconds", "rows", "peak_bytes"]
+        assert summary.loc[("check", "transform"), "calls"] == 2
+        assert summary.loc[("check", "transform"), "rows"] == 12
+        assert summary.loc[("model", "predict_proba"), "calls"] == 1
+        assert summary["peak_bytes"].isnull().all()
+
+    def test_existing_trace_kept(self):
+        tracemalloc = pytest.importorskip("tracemalloc")
+        tracemalloc.start(5)
+        try:
+            with pytest.raises(RuntimeError):
+                with profiling.profile_pipeline(self.pipeline):
+                    pass
+            with profiling.profile_pipeline(self.pipeline, trace_memory=False) as profile:
+                self.pipeline.fit(self.X, self.y)
+            assert tracemalloc.is_tracing()
+            assert tracemalloc.get_traceback_limit() == 5
+        finally:
+            tracemalloc.stop()
+        assert "fit" not in self.pipeline.named_steps["check"].__dict__
+        assert len(profile.records) == 5
+
+    def test_methods_restored(self):
+        with profiling.profile_pipeline(self.pipeline):
+            assert "transform" in self.pipeline.named_steps["check"].__dict__
+        for name, step in self.pipeline.steps:
+            for method_name in ["fit", "transform", "predict_proba"]:
+                assert method_name not in step.__dict__
+
+    def test_methods_restored_after_error(self):
+        try:
+            with profiling.profile_pipeline(self.pipeline):
+                self.pipeline.fit(self.X.drop("one", axis=1), self.y)
+        except KeyError:
+            pass
+        assert "fit" not in self.pipeline.named_steps["onehot"].__dict__
+
+    def test_wpmodel_profile(self):
+        win_probability_model = model.WPModel()
+        win_probability_model.model = self.pipeline
+        with win_probability_model.profile() as profile:
+            win_probability_model.train_model(source_data=self.X.assign(offense_won=self.y))
+        assert [record["step"] for record in profile.records] == [
+            "check", "check", "onehot", "onehot", "model"]
@@ -6,6 +6,10 @@ try:
 except ImportError:
     nfldb_missing=True
 
+import os
+import sqlite3
+import sys
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -37,9 +41,9 @@ class TestGetNFLDBPlayData(object):
                 })
         
     def test_standard_play_mock(self,monkeypatch):
-        def mockreturn_engine():
+        def mockreturn_engine(database_url=None):
             return True
-        def mockreturn_query_string(season_years, season_types):
+        def mockreturn_query_string(season_years, season_types, **kwargs):
             return True
         def mockreturn_read_sql(sql_string, engine):
             return self.test_df
@@ -70,6 +74,39 @@ class TestGetNFLDBPlayData(object):
         pd.util.testing.assert_frame_equal(utils.get_nfldb_play_data().sort_index(axis=1),
                                            expected_df.sort_index(axis=1))
 
+    def test_iter_play_data_mock(self, monkeypatch):
+        class MockConnection(object):
+            closed = False
+            def execution_options(self, **kwargs):
+                assert kwargs == {"stream_results": True}
+                return self
+            def close(self):
+                self.closed = True
+        class MockEngine(object):
+            connection = MockConnection()
+            def connect(self):
+                return self.connection
+        engine = MockEngine()
+        def mockreturn_engine(database_url=None):
+            return engine
+        def mockreturn_query_string(season_years, season_types, **kwargs):
+            return True
+        def mockreturn_read_sql(sql_string, engine, chunksize=None):
+            if chunksize is None:
+                return self.test_df.copy()
+            return (self.test_df[i:i + chunksize].copy()
+                    for i in range(0, len(self.test_df), chunksize))
+        monkeypatch.setattr(utils, 'connect_nfldb', mockreturn_engine)
+        monkeypatch.setattr(utils, '_make_nfldb_query_string', mockreturn_query_string)
+        monkeypatch.setattr(pd, 'read_sql', mockreturn_read_sql)
+
+        chunks = list(utils.iter_nfldb_play_data(chunksize=3))
+
+        assert [list(chunk['gsis_id'].unique()) for chunk in chunks] == [[0], [1]]
+        assert engine.connection.closed
+        pd.util.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True),
+                                           utils.get_nfldb_play_data())
+
     @pytest.mark.requires_db
     def test_2015_playoffs_query(self):
         queried_df = utils.get_nfldb_play_data(season_years=[2015], season_types=["Postseason"])
@@ -116,11 +153,250 @@ class TestGetNFLDBPlayData(object):
         pd.util.testing.assert_frame_equal(queried_df[:5].sort_index(axis=1),
                                            expected_df.sort_index(axis=1), check_column_type=False)
 
+class TestGetCachedNFLDBPlayData(object):
+    """Testing the on-disk caching of nfldb play data."""
+
+    def setup_method(self, method):
+        pytest.importorskip("pyarrow")
+        self.queried_years = []
+
+    def mock_query(self, season_years=None, season_types=None, aggregate_scores_in_db=False,
+                   columns=None, database_url=None):
+        self.queried_years.append(season_years)
+        year = season_years[0]
+        return pd.DataFrame({'gsis_id': ["{0}090900".format(year), "{0}090900".format(year)],
+                             'play_id': [1, 2],
+                             'down': np.array([0, 1], dtype=np.int8),
+                             'offense_won': [True, False]})
+
+    def test_cache_reused(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        cache_directory = str(tmpdir.join("cache"))
+
+        first_df = utils.get_nfldb_play_data(season_years=[2010, 2009], cache_directory=cache_directory)
+        assert self.queried_years == [[2009], [2010]]
+        assert len(os.listdir(cache_directory)) == 2
+
+        second_df = utils.get_nfldb_play_data(season_years=[2009, 2010], cache_directory=cache_directory)
+        assert self.queried_years == [[2009], [2010]]
+        pd.util.testing.assert_frame_equal(first_df, second_df)
+        assert list(second_df['gsis_id']) == ["2009090900", "2009090900", "2010090900", "2010090900"]
+
+    def test_only_missing_seasons_queried(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        cache_directory = str(tmpdir)
+
+        utils.get_nfldb_play_data(season_years=[2009, 2010], cache_directory=cache_directory)
+        output_df = utils.get_nfldb_play_data(season_years=[2010, 2011], cache_directory=cache_directory)
+        assert self.queried_years == [[2009], [2010], [2011]]
+        assert len(output_df) == 4
+
+    def test_different_season_types_not_shared(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        cache_directory = str(tmpdir)
+
+        utils.get_nfldb_play_data(season_years=[2009], season_types=["Regular"],
+                                  cache_directory=cache_directory)
+        utils.get_nfldb_play_data(season_years=[2009], season_types=["Postseason"],
+                                  cache_directory=cache_directory)
+        assert self.queried_years == [[2009], [2009]]
+
+    def test_changed_query_invalidates_cache(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        cache_directory = str(tmpdir)
+
+        utils.get_nfldb_play_data(season_years=[2009], cache_directory=cache_directory)
+        original_query_string = utils._make_nfldb_query_string
+        monkeypatch.setattr(utils, '_make_nfldb_query_string',
+                            lambda **kwargs: original_query_string(**kwargs) + " -- changed")
+        utils.get_nfldb_play_data(season_years=[2009], cache_directory=cache_directory)
+        assert self.queried_years == [[2009], [2009]]
+        assert len(os.listdir(cache_directory)) == 2
+
+class TestUpdateNFLDBPlayData(object):
+    """Testing the incremental ingestion of nfldb play data."""
+
+    def setup_method(self, method):
+        pytest.importorskip("pyarrow")
+        self.database_df = pd.DataFrame({'gsis_id': ['2015091000', '2015091000', '2015091300'],
+                                         'drive_id': [1, 1, 1],
+                                         'play_id': [1, 2, 1],
+                                         'curr_home_score': [0, 0, 0],
+                                         'offense_won': [True, False, True]})
+        self.min_gsis_ids = []
+
+    def mock_query(self, season_years=None, season_types=None, aggregate_scores_in_db=False,
+                   min_gsis_id=None, database_url=None):
+        self.min_gsis_ids.append(min_gsis_id)
+        if min_gsis_id is None:
+            min_gsis_id = ""
+        is_recent = self.database_df['gsis_id'] >= min_gsis_id
+        return self.database_df[is_recent].reset_index(drop=True)
+
+    def test_new_store(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        store_filename = str(tmpdir.join("plays.feather"))
+
+        output_df = utils.update_nfldb_play_data(store_filename)
+        assert self.min_gsis_ids == [None]
+        pd.util.testing.assert_frame_equal(output_df, self.database_df)
+        pd.util.testing.assert_frame_equal(pd.read_feather(store_filename), self.database_df)
+
+    def test_only_new_games_queried(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        store_filename = str(tmpdir.join("plays.feather"))
+        full_database_df = self.database_df
+        self.database_df = full_database_df[:2]
+        utils.update_nfldb_play_data(store_filename)
+
+        self.database_df = full_database_df
+        output_df = utils.update_nfldb_play_data(store_filename)
+        assert self.min_gsis_ids[1] == '20150903'
+        pd.util.testing.assert_frame_equal(output_df, full_database_df)
+        pd.util.testing.assert_frame_equal(pd.read_feather(store_filename), full_database_df)
+
+    def test_no_new_games(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        store_filename = str(tmpdir.join("plays.feather"))
+        utils.update_nfldb_play_data(store_filename)
+
+        output_df = utils.update_nfldb_play_data(store_filename)
+        assert self.min_gsis_ids[1] == '20150906'
+        pd.util.testing.assert_frame_equal(output_df, self.database_df)
+
+    def test_recheck_days(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        store_filename = str(tmpdir.join("plays.feather"))
+        utils.update_nfldb_play_data(store_filename)
+
+        utils.update_nfldb_play_data(store_filename, recheck_days=0)
+        assert self.min_gsis_ids[1] == '20150913'
+
+class TestGetNFLDBPlayDataParallel(object):
+    """Testing querying nfldb one season at a time in parallel."""
+
+    def mock_query(self, season_years=None, season_types=None, aggregate_scores_in_db=False,
+                   columns=None, database_url=None):
+        year = season_years[0]
+        return pd.DataFrame({'gsis_id': ["{0}091300".format(year), "{0}091000".format(year),
+                                         "{0}091000".format(year)],
+                             'drive_id': [1, 1, 2],
+                             'play_id': [1, 1, 1]}).sort_values(["gsis_id", "drive_id", "play_id"])
+
+    def test_seasons_combined_in_order(self, monkeypatch):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        output_df = utils.get_nfldb_play_data(season_years=[2011, 2009, 2010, 2009], n_jobs=3)
+        expected_df = pd.DataFrame({'gsis_id': ["2009091000", "2009091000", "2009091300",
+                                                "2010091000", "2010091000", "2010091300",
+                                                "2011091000", "2011091000", "2011091300"],
+                                    'drive_id': [1, 2, 1] * 3,
+                                    'play_id': [1, 1, 1] * 3})
+        pd.util.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_all_seasons(self, monkeypatch):
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        monkeypatch.setattr(utils, '_query_nfldb_season_years',
+                            lambda season_types=None, database_url=None: [2009, 2010])
+        output_df = utils.get_nfldb_play_data(n_jobs=2)
+        assert list(output_df['gsis_id'].str[:4].unique()) == ["2009", "2010"]
+
+    def test_cached_seasons_queried_in_parallel(self, monkeypatch, tmpdir):
+        pytest.importorskip("pyarrow")
+        monkeypatch.setattr(utils, '_query_nfldb_play_data', self.mock_query)
+        parallel_df = utils.get_nfldb_play_data(season_years=[2009, 2010, 2011], n_jobs=3,
+                                                cache_directory=str(tmpdir))
+        assert len(os.listdir(str(tmpdir))) == 3
+        uncached_df = utils.get_nfldb_play_data(season_years=[2009, 2010, 2011], n_jobs=3)
+        pd.util.testing.assert_frame_equal(parallel_df, uncached_df)
+
+
+class TestConnectNFLDBEngineReuse(object):
+    """Testing that connect_nfldb only creates one engine per process."""
+
+    def test_engine_created_once(self, monkeypatch):
+        sql = pytest.importorskip("sqlalchemy")
+        class MockDB(object):
+            @staticmethod
+            def config():
+                return ({"user": "nfldb", "timezone": "US/Eastern", "password": "",
+                         "host": "localhost", "port": 5432, "database": "nfldb"}, [])
+        class MockNFLDB(object):
+            db = MockDB
+        created_engines = []
+        def mockreturn_create_engine(url):
+            created_engines.append(object())
+            return created_engines[-1]
+        monkeypatch.setitem(sys.modules, 'nfldb', MockNFLDB)
+        monkeypatch.setattr(sql, 'create_engine', mockreturn_create_engine)
+        monkeypatch.setattr(utils, '_nfldb_engine_cache', {})
+
+        first_engine = utils.connect_nfldb()
+        second_engine = utils.connect_nfldb()
+        assert first_engine is second_engine
+        assert len(created_engines) == 1
+
+        monkeypatch.setattr(utils, '_nfldb_engine_cache', {-1: first_engine})
+        assert utils.connect_nfldb() is not first_engine
+
+class TestCompactPlayData(object):
+    """Testing the conversion of play data to compact dtypes."""
+
+    def setup_method(self, method):
+        self.test_df = pd.DataFrame({
+            'gsis_id': ['2016010900', '2016010900', '2016010901', '2016010901'],
+            'drive_id': [1, 1, 1, 2],
+            'play_id': [36, 54, 70, 3088],
+            'seconds_elapsed': [0., 11., 11., 45.],
+            'offense_team': ['HOU', 'KC', 'PIT', 'CIN'],
+            'yardline': [-15., 35, np.nan, -26],
+            'down': np.array([0, 0, 1, 2], dtype=np.int8),
+            'yards_to_go': [0, 0, 10, 6],
+            'home_team': ['HOU', 'HOU', 'CIN', 'CIN'],
+            'away_team': ['KC', 'KC', 'PIT', 'PIT'],
+            'offense_won': [False, True, True, False],
+            'quarter': ['Q1', 'Q1', 'OT', 'Q1'],
+            'curr_home_score': [0, 0, 300, 0],
+            'curr_away_score': [0, 6, 7, 7]
+            })
+
+    def test_dtypes(self):
+        compact_df = utils.compact_play_data(self.test_df.copy())
+        for colname in ['gsis_id', 'offense_team', 'home_team', 'away_team', 'quarter']:
+            assert pd.api.types.is_categorical_dtype(compact_df[colname])
+        assert compact_df['drive_id'].dtype == np.int8
+        assert compact_df['play_id'].dtype == np.int16
+        assert compact_df['seconds_elapsed'].dtype == np.int8
+        assert compact_df['yardline'].dtype == np.float32
+        assert compact_df['curr_home_score'].dtype == np.int16
+        assert compact_df['offense_won'].dtype == np.bool
+
+    def test_memory_reduced(self):
+        large_df = pd.concat([self.test_df] * 100, ignore_index=True)
+        compact_df = utils.compact_play_data(large_df.copy())
+        assert (compact_df.memory_usage(deep=True).sum() <
+                0.2 * large_df.memory_usage(deep=True).sum())
+
+    def test_values_unchanged(self):
+        compact_df = utils.compact_play_data(self.test_df.copy())
+        pd.util.testing.assert_frame_equal(compact_df.astype(object), self.test_df.astype(object),
+                                           check_dtype=False, check_categorical=False)
+
+    def test_team_columns_comparable(self):
+        compact_df = utils.compact_play_data(self.test_df.copy())
+        np.testing.assert_array_equal(compact_df['offense_team'] == compact_df['home_team'],
+                                      [True, False, False, True])
+
+    def test_missing_columns(self):
+        compact_df = utils.compact_play_data(self.test_df[['home_team', 'down']].copy())
+        assert pd.api.types.is_categorical_dtype(compact_df['home_team'])
+        assert compact_df['down'].dtype == np.int8
+
 @pytest.mark.requires_db
 class TestConnectNFLDB(object):
     """testing the connect_nfldb function"""
     def setup_method(self, method):
         self.curr_config_home = nfldb.db._config_home
+        utils._nfldb_engine_cache.clear()
         
     def teardown_method(self, method):
         nfldb.db._config_home = self.curr_config_home
@@ -219,6 +495,139 @@ class TestMakeNFLDBQueryString(object):
                               "AND game.season_type in ('Regular','Postseason'")
         assert expected_substring in utils._make_nfldb_query_string(season_types=["Regular", "Postseason"])
 
+
+    def test_min_gsis_id(self):
+        """Test that only querying recent games works"""
+        expected_substring = ("AND game.season_type = 'Regular' "
+                              "AND game.gsis_id >= '20150906' "
+                              "ORDER BY")
+        assert expected_substring in utils._make_nfldb_query_string(
+            season_types=["Regular"], min_gsis_id="20150906")
+
+    def test_invalid_min_gsis_id(self):
+        with pytest.raises(ValueError):
+            utils._make_nfldb_query_string(min_gsis_id="2015' OR '1'='1")
+
+    def test_columns_pruned(self):
+        query_string = utils._make_nfldb_query_string(columns=["down", "quarter"])
+        assert query_string.startswith("SELECT play.gsis_id, play.drive_id, play.play_id, "
+                                       "play.time, play.down FROM play")
+
+    def test_score_columns_pull_in_dependencies(self):
+        query_string = utils._make_nfldb_query_string(columns=["curr_home_score"],
+                                                      aggregate_scores=True)
+        assert "AS offense_play_points" in query_string
+        assert "AS defense_play_points" in query_string
+        assert "game.home_team" in query_string
+        assert "game.away_team" not in query_string
+        assert "plays.time" not in query_string
+
+    def test_aggregate_scores_without_score_columns(self):
+        assert (utils._make_nfldb_query_string(columns=["yardline", "down"], aggregate_scores=True) ==
+                utils._make_nfldb_query_string(columns=["yardline", "down"]))
+
+    def test_all_columns_unchanged(self):
+        all_columns = ["quarter", "seconds_elapsed", "offense_team", "yardline", "down",
+                       "yards_to_go", "home_team", "away_team", "curr_home_score",
+                       "curr_away_score", "offense_won"]
+        assert (utils._make_nfldb_query_string(columns=all_columns) ==
+                utils._make_nfldb_query_string())
+
+    def test_unknown_column(self):
+        with pytest.raises(ValueError):
+            utils._make_nfldb_query_string(columns=["not_a_column"])
+            
+class TestMakeNFLDBRunningScoreQuery(object):
+    """Testing the _make_nfldb_running_score_query function"""
+
+    def setup_method(self, method):
+        self.input_df = pd.DataFrame({'gsis_id': ['0', '0', '0', '0', '0', '1', '1', '1', '1'],
+                                      'drive_id': [1, 1, 1, 2, 2, 1, 1, 2, 2],
+                                      'play_id': [10, 20, 30, 5, 15, 10, 20, 30, 40],
+                                      'yardline': [0, 0, -15, 0, 0, -15, 0, 0, -15],
+                                      'offense_team': ['KC', 'KC', 'NE', 'KC', 'KC',
+                                                       'NYJ', 'NE', 'NE', 'NE'],
+                                      'home_team': ['KC', 'KC', 'KC', 'KC', 'KC',
+                                                    'NYJ', 'NYJ', 'NYJ', 'NYJ'],
+                                      'away_team': ['NE', 'NE', 'NE', 'NE', 'NE',
+                                                    'NE', 'NE', 'NE', 'NE'],
+                                      'offense_play_points': [0, 0, 0, 6, 0, 0, 6, 1, 0],
+                                      'defense_play_points': [0, 6, 0, 0, 0, 0, 0, 0, 0]
+                                      })
+        self.connection = sqlite3.connect(":memory:")
+        #Shuffle the rows to make sure the query does the ordering:
+        self.input_df.iloc[::-1].to_sql("fixture_plays", self.connection, index=False)
+
+    def teardown_method(self, method):
+        self.connection.close()
+
+    def test_matches_python_aggregation(self):
+        output_columns = ['gsis_id', 'drive_id', 'play_id', 'yardline',
+                          'offense_team', 'home_team', 'away_team']
+        query_string = utils._make_nfldb_running_score_query("SELECT * FROM fixture_plays",
+                                                             output_columns,
+                                                             yardline_position="raw_plays.yardline")
+        queried_df = pd.read_sql(query_string, self.connection)
+
+        expected_df = utils._aggregate_nfldb_scores(self.input_df.copy())
+        pd.util.testing.assert_frame_equal(queried_df, expected_df)
+
+    def test_in_query_string(self):
+        query_string = utils._make_nfldb_query_string(season_years=[2015], aggregate_scores=True)
+        assert "LEAD((raw_plays.yardline).pos) OVER (PARTITION BY raw_plays.gsis_id" in query_string
+        assert "AS curr_home_score" in query_string
+        assert "AS curr_away_score" in query_string
+        assert "AND game.season_year = 2015) AS raw_plays" in query_string
+        assert query_string.endswith("ORDER BY plays.gsis_id, plays.drive_id, plays.play_id;")
+
+
+class TestParseNFLDBCompositeColumns(object):
+    """Testing the _parse_nfldb_composite_columns function"""
+
+    def test_parsing(self):
+        input_df = pd.DataFrame({'gsis_id': [0, 0, 0, 1],
+                                 'time': ["(Q1,0)", "(Q2,152)", "(OT,840)", "(OT2,875)"],
+                                 'yardline': ["(-15)", None, "(48)", "(0)"]})
+        expected_df = pd.DataFrame({'gsis_id': [0, 0, 0, 1],
+                                    'yardline': [-15., np.nan, 48., 0.],
+                                    'quarter': ["Q1", "Q2", "OT", "OT2"],
+                                    'seconds_elapsed': [0., 152., 840., 875.]})
+
+        output_df = utils._parse_nfldb_composite_columns(input_df)
+        pd.util.testing.assert_frame_equal(output_df, expected_df)
+
+    def test_all_yardlines_missing(self):
+        input_df = pd.DataFrame({'time': ["(Q1,0)", "(Q2,152)"],
+                                 'yardline': [None, None]})
+        output_df = utils._parse_nfldb_composite_columns(input_df)
+        assert output_df['yardline'].isnull().all()
+        assert output_df['yardline'].dtype == np.float
+
+    def test_no_plays(self):
+        input_df = pd.DataFrame({'time': pd.Series([], dtype=object),
+                                 'yardline': pd.Series([], dtype=object)})
+        output_df = utils._parse_nfldb_composite_columns(input_df)
+        assert sorted(output_df.columns) == ['quarter', 'seconds_elapsed', 'yardline']
+        assert len(output_df) == 0
+
+    def test_missing_columns_skipped(self):
+        input_df = pd.DataFrame({'gsis_id': [0, 1], 'time': ["(Q1,0)", "(Q2,152)"]})
+        output_df = utils._parse_nfldb_composite_columns(input_df)
+        assert sorted(output_df.columns) == ['gsis_id', 'quarter', 'seconds_elapsed']
+
+
+class TestPostprocessNFLDBPlayData(object):
+    """Testing the _postprocess_nfldb_play_data function"""
+
+    def test_unrequested_columns_dropped(self):
+        input_df = pd.DataFrame({'gsis_id': [0, 0], 'drive_id': [1, 1], 'play_id': [1, 2],
+                                 'time': ["(Q1,0)", "(Q1,5)"], 'down': [np.nan, 1.]})
+        output_df = utils._postprocess_nfldb_play_data(input_df, columns=["down", "quarter"])
+        expected_df = pd.DataFrame({'gsis_id': [0, 0], 'drive_id': [1, 1], 'play_id': [1, 2],
+                                    'down': np.array([0, 1], dtype=np.int8),
+                                    'quarter': ["Q1", "Q1"]})
+        pd.util.testing.assert_frame_equal(output_df, expected_df)
+
             
 class TestAggregateNFLDBScores(object):
     """Testing the _aggregate_nfldb_scores function"""
@@ -335,7 +744,15 @@ class TestAggregateNFLDBScores(object):
         input_df = utils._aggregate_nfldb_scores(input_df)
         pd.util.testing.assert_frame_equal(input_df, expected_df)
 
-
-    
-
-        
+    def test_non_default_index(self):
+        input_df = pd.DataFrame({'gsis_id': [0, 0, 0, 1, 1],
+                                 'yardline': [0, 0, -15, -15, 0],
+                                 'offense_team': ['KC', 'KC', 'KC', 'NE', 'NE'],
+                                 'home_team': ['KC', 'KC', 'KC', 'KC', 'KC'],
+                                 'away_team': ['NE', 'NE', 'NE', 'NE', 'NE'],
+                                 'offense_play_points': [0, 6, 0, 3, 0],
+                                 'defense_play_points': [0, 0, 0, 0, 0]
+                                 }, index=[10, 11, 12, 13, 14])
+        input_df = utils._aggregate_nfldb_scores(input_df)
+        np.testing.assert_array_equal(input_df['curr_home_score'].values, [0, 0, 7, 0, 0])
+        np.testing.assert_array_equal(input_df['curr_away_score'].values, [0, 0, 0, 0, 3])
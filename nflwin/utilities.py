@@ -1,11 +1,39 @@
 """Utility functions that don't fit in the main modules"""
 from __future__ import print_function, division
 
+import datetime
+import hashlib
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 import pandas as pd
 
+#Bump this whenever the postprocessing of the nfldb data changes, to invalidate caches:
+_NFLDB_CACHE_VERSION = 1
+
+#Columns that are always returned from nfldb queries, as they identify each play:
+_NFLDB_KEY_COLUMNS = ("gsis_id", "drive_id", "play_id")
+
+#SQL expressions that differ between nfldb's Postgres database and the SQLite
+#stand-in from nflwin.nfldb_sqlite (which stores the composite types as text),
+#keyed by SQLAlchemy dialect name:
+_NFLDB_DIALECT_SQL = {
+    "postgresql": {"greatest": "GREATEST",
+                   "time_phase": "(play.time).phase",
+                   "yardline_position": "({0}.yardline).pos"},
+    "sqlite": {"greatest": "MAX",
+               "time_phase": "substr(play.time, 2, instr(play.time, ',') - 2)",
+               "yardline_position": "CAST(substr({0}.yardline, 2, length({0}.yardline) - 2) AS INTEGER)"},
+    }
+
+#The nfldb engines for the current process, keyed by process id and then database url:
+_nfldb_engine_cache = {}
+_nfldb_engine_lock = threading.Lock()
 
-def connect_nfldb():
+
+def connect_nfldb(database_url=None):
     """Connect to the nfldb database.
 
     Rather than using the builtin method we make our own,
@@ -14,9 +42,16 @@ def connect_nfldb():
     file to get information like username and password, which
     means this function doesn't need any arguments.
 
+    The engine (and its connection pool) is only created the first time
+    this function is called in a given process; subsequent calls return the
+    same engine, so that connections are reused across queries.
+
     Parameters
     ----------
-    None
+    database_url : string or ``None`` (default=``None``)
+        If not ``None``, connect to the database at this SQLAlchemy URL rather than
+        the one in the nfldb config file. This is mostly useful for pointing NFLWin at
+        a SQLite copy of the nfldb schema (see :mod:`nflwin.nfldb_sqlite`).
 
     Returns
     -------
@@ -28,23 +63,48 @@ def connect_nfldb():
     IOError
         If it can't find the config file.
     """
-    import nfldb
-    import sqlalchemy as sql
-    db_config, paths_tried = nfldb.db.config()
-    if db_config is None:
-        raise IOError("get_play_data: could not find database config! Looked"
-                      " in these places: {0}".format(paths_tried))
-    db_config["drivername"] = "postgres"
-    db_config["username"] = db_config["user"]
-    del db_config["user"]
-    del db_config["timezone"]
+    #Engines can't be shared across processes, so check the pid in case we've been forked:
+    process_id = os.getpid()
+    with _nfldb_engine_lock:
+        if process_id not in _nfldb_engine_cache:
+            _nfldb_engine_cache.clear()
+            _nfldb_engine_cache[process_id] = {}
+        process_engines = _nfldb_engine_cache[process_id]
+        if database_url in process_engines:
+            return process_engines[database_url]
+
+        import sqlalchemy as sql
+        if database_url is None:
+            import nfldb
+            db_config, paths_tried = nfldb.db.config()
+            if db_config is None:
+                raise IOError("get_play_data: could not find database config! Looked"
+                              " in these places: {0}".format(paths_tried))
+            db_config["drivername"] = "postgres"
+            db_config["username"] = db_config["user"]
+            del db_config["user"]
+            del db_config["timezone"]
+
+            engine = sql.create_engine(sql.engine.url.URL(**db_config))
+        else:
+            engine = sql.create_engine(database_url)
 
-    engine = sql.create_engine(sql.engine.url.URL(**db_config))
+        process_engines[database_url] = engine
 
     return engine
+
+
+def _get_nfldb_dialect(database_url=None):
+    """Get the name of the SQL dialect of the nfldb database at ``database_url``."""
+    if database_url is None:
+        return "postgresql"
+    import sqlalchemy as sql
+    return sql.engine.url.make_url(database_url).get_backend_name()
     
     
-def get_nfldb_play_data(season_years=None, season_types=("Regular", "Postseason")):
+def get_nfldb_play_data(season_years=None, season_types=("Regular", "Postseason"),
+                        aggregate_scores_in_db=False, cache_directory=None, n_jobs=1,
+                        compact_dtypes=False, columns=None, database_url=None):
     """Get play-by-play data from the nfldb database.
 
     We use a specialized query and then postprocessing because, while possible to
@@ -64,6 +124,35 @@ def get_nfldb_play_data(season_years=None, season_types=("Regular", "Postseason"
         A list of all parts of seasons to get data for (acceptable values are
         "Preseason", "Regular", and "Postseason"). If ``None``, get data from
         all three season types.
+    aggregate_scores_in_db : boolean (default=``False``)
+        If ``True``, compute the running scores inside the database with window
+        functions rather than in Python after the query returns. The resulting
+        scores are the same, but the work is moved to the Postgres server.
+    cache_directory : string or ``None`` (default=``None``)
+        If not ``None``, a directory where query results are stored on disk (as Feather
+        files, which requires ``pyarrow``) and reused by subsequent calls. Results are
+        cached separately for each season, so only seasons that haven't been
+        queried before hit the database. Each cached file is keyed on a hash of the
+        query string, so changing the query automatically invalidates the cache.
+    n_jobs : int (default=1)
+        If greater than 1, query each season separately, running up to ``n_jobs``
+        queries at once in a pool of threads (sharing the connection pool
+        of the engine from ``connect_nfldb``). The results are combined in
+        ``gsis_id``, ``drive_id``, ``play_id`` order. If ``season_years`` is ``None``,
+        the seasons with finished games are looked up first (except when using
+        ``cache_directory``, where all seasons are queried and cached together).
+    compact_dtypes : boolean (default=``False``)
+        If ``True``, convert the output to a more memory-efficient set of dtypes
+        (see ``compact_play_data``).
+    columns : list of strings or ``None`` (default=``None``)
+        If not ``None``, only return these columns (plus ``gsis_id``, ``drive_id``, and
+        ``play_id``), and only query nfldb for the fields needed to compute them.
+        Useful with :attr:`nflwin.model.WPModel.required_columns` for models that
+        don't need all the columns.
+    database_url : string or ``None`` (default=``None``)
+        If not ``None``, query the database at this SQLAlchemy URL rather than the one
+        configured for nfldb (see ``connect_nfldb``). Both Postgres and SQLite
+        databases with the nfldb schema are supported.
 
     Returns
     -------
@@ -96,99 +185,464 @@ def get_nfldb_play_data(season_years=None, season_types=("Regular", "Postseason"
     ``gsis_id``, ``drive_id``, and ``play_id`` are not necessary to make the model, but
     are included because they can be useful for computing things like WPA.
     """
-    
-    engine = connect_nfldb()
+    parallel_years = None
+    if cache_directory is None and n_jobs > 1:
+        if season_years is None:
+            parallel_years = _query_nfldb_season_years(season_types=season_types,
+                                                       database_url=database_url)
+        else:
+            parallel_years = sorted(set(season_years))
+
+    if cache_directory is not None:
+        plays_df = _get_cached_nfldb_play_data(cache_directory, season_years=season_years,
+                                               season_types=season_types,
+                                               aggregate_scores_in_db=aggregate_scores_in_db,
+                                               n_jobs=n_jobs, columns=columns,
+                                               database_url=database_url)
+    elif parallel_years is not None and len(parallel_years) > 1:
+        season_dfs = _query_nfldb_seasons(parallel_years, season_types=season_types,
+                                          aggregate_scores_in_db=aggregate_scores_in_db,
+                                          n_jobs=n_jobs, columns=columns,
+                                          database_url=database_url)
+        plays_df = pd.concat(season_dfs, ignore_index=True)
+        plays_df.sort_values(["gsis_id", "drive_id", "play_id"], kind="mergesort", inplace=True)
+        plays_df.reset_index(drop=True, inplace=True)
+    else:
+        plays_df = _query_nfldb_play_data(season_years=season_years, season_types=season_types,
+                                          aggregate_scores_in_db=aggregate_scores_in_db,
+                                          columns=columns, database_url=database_url)
+
+    if compact_dtypes:
+        plays_df = compact_play_data(plays_df)
+
+    return plays_df
+
+
+def compact_play_data(plays_df):
+    """Convert play-by-play data to memory-efficient dtypes, in place.
+
+    Team abbreviations, quarters, and game ids become categoricals (with all the team
+    columns sharing the same categories, so they can still be compared
+    to each other), integer-valued numeric columns are downcast to the smallest
+    integer type that holds them, and other numeric columns become 32-bit
+    floats. The result can be used with all of the transformers in
+    :mod:`nflwin.preprocessing`.
+
+    Parameters
+    ----------
+    plays_df : Pandas DataFrame
+        Play-by-play data with the columns returned by ``get_nfldb_play_data`` (any of
+        the columns may be missing).
+
+    Returns
+    -------
+    Pandas DataFrame
+        ``plays_df``, with the converted columns.
+    """
+    team_colnames = [colname for colname in ("offense_team", "home_team", "away_team")
+                     if colname in plays_df.columns]
+    if len(team_colnames) > 0:
+        teams = pd.unique(np.concatenate([plays_df[colname].astype(object).values
+                                          for colname in team_colnames]))
+        team_dtype = pd.api.types.CategoricalDtype(sorted(team for team in teams if pd.notnull(team)))
+        for colname in team_colnames:
+            plays_df[colname] = plays_df[colname].astype(team_dtype)
+
+    for colname in ("gsis_id", "quarter"):
+        if colname in plays_df.columns:
+            plays_df[colname] = plays_df[colname].astype("category")
+
+    for colname in ("drive_id", "play_id", "seconds_elapsed", "yardline", "down",
+                    "yards_to_go", "curr_home_score", "curr_away_score"):
+        if colname in plays_df.columns:
+            compact_column = pd.to_numeric(plays_df[colname], downcast="integer")
+            if compact_column.dtype.kind == "f":
+                compact_column = pd.to_numeric(compact_column, downcast="float")
+            plays_df[colname] = compact_column
+
+    if "offense_won" in plays_df.columns:
+        plays_df["offense_won"] = plays_df["offense_won"].astype(np.bool_)
+
+    return plays_df
+
 
-    sql_string = _make_nfldb_query_string(season_years=season_years, season_types=season_types)
+def _query_nfldb_play_data(season_years=None, season_types=None, aggregate_scores_in_db=False,
+                           min_gsis_id=None, columns=None, database_url=None):
+    """Query nfldb and postprocess the results (see ``get_nfldb_play_data``)."""
+    engine = connect_nfldb(database_url)
+
+    sql_string = _make_nfldb_query_string(season_years=season_years, season_types=season_types,
+                                          aggregate_scores=aggregate_scores_in_db,
+                                          min_gsis_id=min_gsis_id, columns=columns,
+                                          dialect=_get_nfldb_dialect(database_url))
 
     plays_df = pd.read_sql(sql_string, engine)
 
+    return _postprocess_nfldb_play_data(plays_df, aggregate_scores_in_db=aggregate_scores_in_db,
+                                        columns=columns)
+
+
+def iter_nfldb_play_data(season_years=None, season_types=("Regular", "Postseason"),
+                         chunksize=100000, aggregate_scores_in_db=False, compact_dtypes=False,
+                         columns=None, database_url=None):
+    """Get play-by-play data from the nfldb database in chunks.
+
+    This is a streaming version of ``get_nfldb_play_data``: results are read from
+    the database with a server-side cursor and processed ``chunksize`` rows
+    at a time, so memory use is governed by the size of the chunks rather than
+    the number of seasons requested.
+
+    Parameters
+    ----------
+    season_years : list (default=None)
+        Same as ``get_nfldb_play_data``.
+    season_types : list (default=["Regular", "Postseason"])
+        Same as ``get_nfldb_play_data``.
+    chunksize : int (default=100000)
+        The number of rows to read from the database at a time.
+    aggregate_scores_in_db : boolean (default=``False``)
+        Same as ``get_nfldb_play_data``.
+    compact_dtypes : boolean (default=``False``)
+        Same as ``get_nfldb_play_data``. Note that the categories of the
+        categorical columns will differ from chunk to chunk.
+    columns : list of strings or ``None`` (default=``None``)
+        Same as ``get_nfldb_play_data``.
+    database_url : string or ``None`` (default=``None``)
+        Same as ``get_nfldb_play_data``.
+
+    Yields
+    ------
+    Pandas DataFrame
+        Consecutive chunks of the play by play data, with the same columns as
+        ``get_nfldb_play_data``. Every chunk contains only complete games (so
+        chunks will usually be a little smaller or larger than ``chunksize``).
+    """
+    engine = connect_nfldb(database_url)
+
+    sql_string = _make_nfldb_query_string(season_years=season_years, season_types=season_types,
+                                          aggregate_scores=aggregate_scores_in_db, columns=columns,
+                                          dialect=_get_nfldb_dialect(database_url))
+
+    connection = engine.connect().execution_options(stream_results=True)
+    try:
+        incomplete_game_df = None
+        for plays_df in pd.read_sql(sql_string, connection, chunksize=chunksize):
+            if incomplete_game_df is not None:
+                plays_df = pd.concat([incomplete_game_df, plays_df], ignore_index=True)
+
+            #The last game in the chunk may continue in the next one, so hold it back:
+            is_last_game = (plays_df['gsis_id'] == plays_df['gsis_id'].iloc[-1]).values
+            incomplete_game_df = plays_df[is_last_game]
+            complete_games_df = plays_df[~is_last_game].reset_index(drop=True)
+            if len(complete_games_df) > 0:
+                complete_games_df = _postprocess_nfldb_play_data(
+                    complete_games_df, aggregate_scores_in_db=aggregate_scores_in_db, columns=columns)
+                if compact_dtypes:
+                    complete_games_df = compact_play_data(complete_games_df)
+                yield complete_games_df
+
+        if incomplete_game_df is not None and len(incomplete_game_df) > 0:
+            incomplete_game_df = _postprocess_nfldb_play_data(
+                incomplete_game_df.reset_index(drop=True), aggregate_scores_in_db=aggregate_scores_in_db,
+                columns=columns)
+            if compact_dtypes:
+                incomplete_game_df = compact_play_data(incomplete_game_df)
+            yield incomplete_game_df
+    finally:
+        connection.close()
+
+
+def _postprocess_nfldb_play_data(plays_df, aggregate_scores_in_db=False, columns=None):
+    """Turn the raw results of the nfldb query into the format used for modeling.
+
+    If ``columns`` is not ``None``, fields that were only queried in order to
+    compute other columns are dropped at the end.
+    """
+
     #Fix yardline, quarter and time elapsed:
-    def yardline_time_fix(row):
-        try:
-            yardline = float(row['yardline'][1:-1])
-        except TypeError:
-            yardline = np.nan
-        split_time = row['time'].split(",")
-        return yardline, split_time[0][1:], float(split_time[1][:-1])
-    
-    plays_df[['yardline', 'quarter', 'seconds_elapsed']] = pd.DataFrame(plays_df.apply(yardline_time_fix, axis=1).values.tolist())
-    plays_df.drop('time', axis=1, inplace=True)
+    plays_df = _parse_nfldb_composite_columns(plays_df)
+
+    #Databases without a boolean type (e.g. SQLite) return 0 or 1:
+    if 'offense_won' in plays_df.columns and plays_df['offense_won'].dtype != np.bool_:
+        plays_df['offense_won'] = plays_df['offense_won'].astype(np.bool_)
 
     #Set NaN downs (kickoffs, etc) to 0:
-    plays_df['down'] = plays_df['down'].fillna(value=0).astype(np.int8)
+    if 'down' in plays_df.columns:
+        plays_df['down'] = plays_df['down'].fillna(value=0).astype(np.int8)
 
 
     #Aggregate scores:
-    plays_df = _aggregate_nfldb_scores(plays_df)
+    if not aggregate_scores_in_db and 'offense_play_points' in plays_df.columns:
+        plays_df = _aggregate_nfldb_scores(plays_df)
+
+    if columns is not None:
+        unrequested_columns = [colname for colname in plays_df.columns
+                               if colname not in _NFLDB_KEY_COLUMNS and colname not in columns]
+        plays_df.drop(unrequested_columns, axis=1, inplace=True)
     
     return plays_df
 
+
+def update_nfldb_play_data(store_filename, season_years=None,
+                           season_types=("Regular", "Postseason"), recheck_days=7,
+                           database_url=None):
+    """Incrementally add newly finished games to a local store of nfldb play data.
+
+    Rather than re-querying entire seasons, this only asks nfldb for finished games
+    played since shortly before the latest game in the store, computes the scores
+    for just those games, and then appends the ones that aren't already in the
+    store. This makes in-season data refreshes much faster.
+
+    Parameters
+    ----------
+    store_filename : string
+        The path to the store, a Feather file (which requires ``pyarrow``).
+        If it doesn't exist yet it will be created.
+    season_years : list (default=None)
+        The seasons to look for new games in. If ``None``, look in all seasons.
+    season_types : list (default=["Regular", "Postseason"])
+        The parts of seasons to look for new games in. If ``None``, look in
+        all three season types.
+    recheck_days : int (default=7)
+        How many days before the latest game in the store to look for new games
+        from, to pick up games that finished after a later game was stored (e.g.
+        a Monday night game that was still going when a Thursday game was stored).
+    database_url : string or ``None`` (default=``None``)
+        Same as ``get_nfldb_play_data``.
+
+    Returns
+    -------
+    Pandas DataFrame
+        All the play by play data in the store (not just the new games, and not
+        just the ones from ``season_years`` and ``season_types``), with
+        the same columns as ``get_nfldb_play_data``.
+
+    Notes
+    -----
+    Games are found by the date at the start of their ``gsis_id``, so a game
+    that finishes more than ``recheck_days`` before the latest stored game
+    (e.g. one suspended and resumed much later) won't be added; nor will games from
+    seasons older than the latest stored game that weren't requested before. To
+    pick those up, delete the store and rebuild it.
+    """
+    stored_df = None
+    ingested_gsis_ids = None
+    min_gsis_id = None
+    if os.path.isfile(store_filename):
+        stored_df = pd.read_feather(store_filename)
+        if len(stored_df) > 0:
+            ingested_gsis_ids = stored_df['gsis_id'].astype(str).unique()
+            #(Game ids start with the date of the game, as YYYYMMDD.)
+            latest_game_date = datetime.datetime.strptime(max(ingested_gsis_ids)[:8], "%Y%m%d")
+            min_gsis_id = (latest_game_date -
+                           datetime.timedelta(days=recheck_days)).strftime("%Y%m%d")
+
+    new_df = _query_nfldb_play_data(season_years=season_years, season_types=season_types,
+                                    min_gsis_id=min_gsis_id, database_url=database_url)
+    if ingested_gsis_ids is not None:
+        new_df = new_df[~new_df['gsis_id'].isin(ingested_gsis_ids)].reset_index(drop=True)
+    if stored_df is not None:
+        if len(new_df) == 0:
+            return stored_df
+        new_df = pd.concat([stored_df, new_df], ignore_index=True)
+        new_df.sort_values(["gsis_id", "drive_id", "play_id"], kind="mergesort", inplace=True)
+        new_df.reset_index(drop=True, inplace=True)
+
+    #Write to a temporary file first so an interrupted write can't corrupt the store:
+    temp_filename = store_filename + ".tmp"
+    new_df.to_feather(temp_filename)
+    if os.path.isfile(store_filename):
+        os.remove(store_filename)
+    os.rename(temp_filename, store_filename)
+
+    return new_df
+
+
+def _get_cached_nfldb_play_data(cache_directory, season_years=None, season_types=None,
+                                aggregate_scores_in_db=False, n_jobs=1, columns=None,
+                                database_url=None):
+    """Get nfldb play data, using an on-disk cache with one file per season.
+
+    If ``season_years`` is ``None`` all seasons are cached together in a single file.
+    """
+    if not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+
+    if season_years is None:
+        partition_years = [None]
+    else:
+        partition_years = sorted(set(season_years))
+
+    cache_filenames = []
+    for year in partition_years:
+        sql_string = _make_nfldb_query_string(season_years=None if year is None else [year],
+                                              season_types=season_types,
+                                              aggregate_scores=aggregate_scores_in_db,
+                                              columns=columns,
+                                              dialect=_get_nfldb_dialect(database_url))
+        cache_filenames.append(os.path.join(cache_directory,
+                                            _make_nfldb_cache_filename(year, season_types, sql_string,
+                                                                       database_url=database_url)))
+
+    missing_partitions = [(year, cache_filename)
+                          for year, cache_filename in zip(partition_years, cache_filenames)
+                          if not os.path.isfile(cache_filename)]
+    if len(missing_partitions) > 0:
+        missing_years, missing_filenames = zip(*missing_partitions)
+        missing_dfs = _query_nfldb_seasons(missing_years, season_types=season_types,
+                                           aggregate_scores_in_db=aggregate_scores_in_db,
+                                           n_jobs=n_jobs, columns=columns,
+                                           database_url=database_url)
+        for season_df, cache_filename in zip(missing_dfs, missing_filenames):
+            #Write to a temporary file first so an interrupted write can't corrupt the cache:
+            temp_filename = cache_filename + ".tmp"
+            season_df.reset_index(drop=True).to_feather(temp_filename)
+            os.rename(temp_filename, cache_filename)
+
+    season_dfs = [pd.read_feather(cache_filename) for cache_filename in cache_filenames]
+
+    return pd.concat(season_dfs, ignore_index=True)
+
+
+def _query_nfldb_seasons(season_years, season_types=None, aggregate_scores_in_db=False, n_jobs=1,
+                         columns=None, database_url=None):
+    """Query each season separately, returning a list of DataFrames in the same order.
+
+    A season of ``None`` means all seasons. If ``n_jobs`` is greater than 1 the
+    queries are run in a pool of threads.
+    """
+    def query_season(year):
+        return _query_nfldb_play_data(season_years=None if year is None else [year],
+                                      season_types=season_types,
+                                      aggregate_scores_in_db=aggregate_scores_in_db,
+                                      columns=columns, database_url=database_url)
+
+    if n_jobs <= 1 or len(season_years) <= 1:
+        return [query_season(year) for year in season_years]
+
+    pool = ThreadPool(min(n_jobs, len(season_years)))
+    try:
+        return pool.map(query_season, season_years)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _query_nfldb_season_years(season_types=None, database_url=None):
+    """Get the (sorted) seasons in nfldb with finished games of the given season types."""
+    engine = connect_nfldb(database_url)
+
+    sql_string = "SELECT DISTINCT season_year FROM game WHERE finished = TRUE"
+    if season_types is not None:
+        sql_string += " AND season_type in ('{0}')".format("','".join(season_types))
+    sql_string += " ORDER BY season_year;"
+
+    return [int(year) for year in pd.read_sql(sql_string, engine)["season_year"]]
+
+
+def _make_nfldb_cache_filename(year, season_types, sql_string, database_url=None):
+    """Make the name of the cache file for a season of nfldb data.
+
+    Results from a database other than the default nfldb one are keyed on its url as well.
+    """
+    query_key = "{0}:{1}".format(_NFLDB_CACHE_VERSION, sql_string)
+    if database_url is not None:
+        query_key += ":{0}".format(database_url)
+    query_hash = hashlib.sha1(query_key.encode("utf-8")).hexdigest()
+    return "nfldb_plays_{0}_{1}_{2}.feather".format(
+        "all" if year is None else year,
+        "all" if season_types is None else "-".join(season_types),
+        query_hash[:16])
+
+def _parse_nfldb_composite_columns(plays_df):
+    """Split the nfldb composite types into separate, usable columns.
+
+    The yardline (e.g. ``"(-15)"``) and game time (e.g. ``"(Q1,152)"``) come
+    out of the database as strings. This parses them using vectorized string
+    operations, replacing the ``time`` column with ``quarter`` and ``seconds_elapsed``
+    columns and converting ``yardline`` to a float.
+    """
+    if 'yardline' in plays_df.columns:
+        plays_df['yardline'] = plays_df['yardline'].str[1:-1].astype(np.float64)
+
+    if 'time' in plays_df.columns:
+        #(Reindexing makes sure both columns exist even if there are no plays.)
+        split_time = plays_df['time'].str[1:-1].str.split(",", n=1, expand=True).reindex(columns=[0, 1])
+        plays_df['quarter'] = split_time[0]
+        plays_df['seconds_elapsed'] = split_time[1].astype(np.float64)
+        plays_df.drop('time', axis=1, inplace=True)
+
+    return plays_df
+
 def _aggregate_nfldb_scores(play_df):
-    """Aggregate the raw nfldb data to get the score of every play."""
-
-    # First, add the yardline of the subsequent play to the df
-    play_df['next_yardline'] = play_df['yardline'].shift(-1)
-
-    #Set up the dictionary to keep track of things:
-    curr_home_score = 0
-    curr_away_score = 0
-    curr_gsis_id = play_df.iloc[0].gsis_id
-    argdict = {"curr_home_score": 0, "curr_away_score": 0, "curr_gsis_id": play_df.iloc[0].gsis_id}
-
-    #Define an internal function to actually compute the score of a given play:
-    def compute_current_scores(play, argdict):
-        #If new game, set scores to zero:
-        if play.gsis_id != argdict['curr_gsis_id']:
-            argdict['curr_home_score'] = 0
-            argdict['curr_away_score'] = 0
-            argdict['curr_gsis_id'] = play.gsis_id
-
-        #Get current score at start of play:
-        home_score_to_return = argdict['curr_home_score']
-        away_score_to_return = argdict['curr_away_score']
-        
-        #Check if an extra point is missing from the data:
-        if play.offense_play_points == 6 and play.next_yardline < 0:
-            play.offense_play_points += 1
-        if play.defense_play_points == 6 and play.next_yardline < 0:
-            play.defense_play_points += 1
-
-        #Update scores, if necessary:
-        if play.offense_team == play.home_team:
-            argdict['curr_home_score'] += play.offense_play_points
-            argdict['curr_away_score'] += play.defense_play_points
-        else:
-            argdict['curr_home_score'] += play.defense_play_points
-            argdict['curr_away_score'] += play.offense_play_points
-        return home_score_to_return, away_score_to_return
+    """Aggregate the raw nfldb data to get the score of every play.
+
+    The running score is computed column-wise: the points scored on each play
+    are assigned to the home or away team, then a cumulative sum within each
+    game (shifted by one play, so that the score is the one at the *start* of
+    the play) gives the current score.
+    """
+
+    # Games are identified by runs of consecutive gsis_ids (the data come
+    # ordered by gsis_id, drive_id, and play_id):
+    gsis_ids = play_df['gsis_id']
+    game_numbers = (gsis_ids != gsis_ids.shift(1)).cumsum().values
 
-    #Apply function to data:
-    #TODO (AndrewRook): Make the .apply function go faster, currently it's a large bottleneck
-    aggregate_scores = play_df.apply(compute_current_scores, axis=1, args=(argdict,))
-    aggregate_scores = pd.DataFrame(aggregate_scores.values.tolist())
-    play_df[['curr_home_score', 'curr_away_score']] = aggregate_scores
+    #Check if an extra point is missing from the data (a touchdown followed
+    #by a kickoff rather than a PAT):
+    next_play_is_kickoff = (play_df['yardline'].shift(-1) < 0).values
+    offense_play_points = play_df['offense_play_points'].values
+    defense_play_points = play_df['defense_play_points'].values
+    offense_play_points = offense_play_points + ((offense_play_points == 6) & next_play_is_kickoff)
+    defense_play_points = defense_play_points + ((defense_play_points == 6) & next_play_is_kickoff)
+
+    #Assign the points to the home and away teams:
+    offense_is_home = (play_df['offense_team'] == play_df['home_team']).values
+    home_play_points = pd.Series(np.where(offense_is_home, offense_play_points, defense_play_points))
+    away_play_points = pd.Series(np.where(offense_is_home, defense_play_points, offense_play_points))
+
+    #Sum up the points in each game, excluding the current play:
+    play_df['curr_home_score'] = (home_play_points.groupby(game_numbers).cumsum() - home_play_points).values
+    play_df['curr_away_score'] = (away_play_points.groupby(game_numbers).cumsum() - away_play_points).values
 
     #Drop unnecessary columns:
-    play_df.drop(labels=["next_yardline", "offense_play_points", "defense_play_points"],
+    play_df.drop(labels=["offense_play_points", "defense_play_points"],
                  axis=1, inplace=True)
 
     return play_df
 
 
-def _make_nfldb_query_string(season_years=None, season_types=None):
+def _make_nfldb_query_string(season_years=None, season_types=None, aggregate_scores=False,
+                             min_gsis_id=None, columns=None, dialect="postgresql"):
     """Construct the query string to get all the play data.
 
     This way is a little more compact and robust than specifying
     the string in the function that uses it.
 
+    If ``min_gsis_id`` is not ``None`` (a string of digits, e.g. a date as
+    ``"YYYYMMDD"``), only games whose ids sort at or after it are queried. If
+    ``columns`` is not ``None``, only the fields needed to compute those
+    output columns (see ``_get_nfldb_query_fields``) are selected. ``dialect`` is
+    the SQLAlchemy name of the database's SQL dialect (``"postgresql"`` or
+    ``"sqlite"``).
+
+    If ``aggregate_scores`` is ``True``, the query is wrapped
+    (see ``_make_nfldb_running_score_query``) so that the current scores are
+    computed by the database rather than returning the points scored on each play.
+    (If ``columns`` doesn't include the scores, there's nothing to compute, so
+    the query isn't wrapped.)
     """
     
+    try:
+        dialect_sql = _NFLDB_DIALECT_SQL[dialect]
+    except KeyError:
+        raise ValueError("get_nfldb_play_data: unsupported database dialect '{0}'".format(dialect))
+
     play_fields = ['gsis_id', 'drive_id', 'play_id',
                    'time', 'pos_team AS offense_team', 'yardline', 'down',
                    'yards_to_go']
 
-    offense_play_points = ("GREATEST("
+    offense_play_points = (dialect_sql["greatest"] + "("
         "(agg_play.fumbles_rec_tds * 6), "
         "(agg_play.kicking_rec_tds * 6), "
         "(agg_play.passing_tds * 6), "
@@ -200,7 +654,7 @@ def _make_nfldb_query_string(season_years=None, season_types=None):
         "(agg_play.rushing_twoptm * 2), "
         "(agg_play.kicking_fgm * 3)) "
         "AS offense_play_points")
-    defense_play_points = ("GREATEST("
+    defense_play_points = (dialect_sql["greatest"] + "("
         "(agg_play.defense_frec_tds * 6), "
         "(agg_play.defense_int_tds * 6), "
         "(agg_play.defense_misc_tds * 6), "
@@ -209,14 +663,21 @@ def _make_nfldb_query_string(season_years=None, season_types=None):
         "(agg_play.defense_safe * 2)) "
         "AS defense_play_points")
 
-    game_fields = ("game.home_team, game.away_team, "
-                   "((game.home_score > game.away_score AND play.pos_team = game.home_team) "
-                   "OR (game.away_score > game.home_score AND play.pos_team = game.away_team)) AS offense_won")
+    game_fields = ["game.home_team", "game.away_team",
+                   ("((game.home_score > game.away_score AND play.pos_team = game.home_team) "
+                    "OR (game.away_score > game.home_score AND play.pos_team = game.away_team)) AS offense_won")]
+
+    select_fields = (["play." + field for field in play_fields] +
+                     [offense_play_points, defense_play_points] + game_fields)
+    if columns is not None:
+        query_fields = _get_nfldb_query_fields(columns)
+        select_fields = [field for field in select_fields
+                         if _get_sql_field_name(field) in query_fields]
 
     where_clause = ("WHERE game.home_score != game.away_score "
                     "AND game.finished = TRUE "
                     "AND play.pos_team != 'UNK' "
-                    "AND (play.time).phase not in ('Pregame', 'Half', 'Final')")
+                    "AND " + dialect_sql["time_phase"] + " not in ('Pregame', 'Half', 'Final')")
 
     if season_years is not None:
         where_clause += " AND game.season_year"
@@ -231,18 +692,125 @@ def _make_nfldb_query_string(season_years=None, season_types=None):
             where_clause += " = '{0}'".format(season_types[0])
         else:
             where_clause += " in ('{0}')".format("','".join(season_types))
+    if min_gsis_id is not None:
+        if not min_gsis_id.isdigit():
+            raise ValueError("get_nfldb_play_data: invalid gsis_id '{0}'".format(min_gsis_id))
+        where_clause += " AND game.gsis_id >= '{0}'".format(min_gsis_id)
 
     query_string = "SELECT "
-    query_string += "play." + ", play.".join(play_fields)
-    query_string += ", " + offense_play_points
-    query_string += ", " + defense_play_points
-    query_string += ", " + game_fields
+    query_string += ", ".join(select_fields)
     query_string += " FROM play INNER JOIN agg_play"
     query_string += (" ON play.gsis_id = agg_play.gsis_id"
         " AND play.drive_id = agg_play.drive_id"
         " AND play.play_id = agg_play.play_id")
     query_string += " INNER JOIN game on play.gsis_id = game.gsis_id"
     query_string += " " + where_clause
+
+    #(The running score query needs the fields the scores depend on, which are
+    #only selected if the scores were asked for.)
+    if aggregate_scores and offense_play_points in select_fields:
+        output_columns = [_get_sql_field_name(field) for field in select_fields
+                          if field not in (offense_play_points, defense_play_points)]
+        return _make_nfldb_running_score_query(
+            query_string, output_columns,
+            yardline_position=dialect_sql["yardline_position"].format("raw_plays"))
+
     query_string += " ORDER BY play.gsis_id, play.drive_id, play.play_id;"
 
     return query_string
+
+
+def _get_nfldb_query_fields(columns):
+    """Find the fields the nfldb query has to return to produce the given output columns.
+
+    Raises
+    ------
+    ValueError
+        If any of ``columns`` can't be produced from nfldb.
+    """
+    #The query fields each output column depends on:
+    column_dependencies = {
+        "gsis_id": ["gsis_id"],
+        "drive_id": ["drive_id"],
+        "play_id": ["play_id"],
+        "quarter": ["time"],
+        "seconds_elapsed": ["time"],
+        "offense_team": ["offense_team"],
+        "yardline": ["yardline"],
+        "down": ["down"],
+        "yards_to_go": ["yards_to_go"],
+        "home_team": ["home_team"],
+        "away_team": ["away_team"],
+        "offense_won": ["offense_won"],
+        "curr_home_score": ["offense_team", "home_team", "yardline",
+                            "offense_play_points", "defense_play_points"],
+        "curr_away_score": ["offense_team", "home_team", "yardline",
+                            "offense_play_points", "defense_play_points"],
+        }
+
+    unknown_columns = [colname for colname in columns if colname not in column_dependencies]
+    if len(unknown_columns) > 0:
+        raise ValueError("get_nfldb_play_data: can't get columns {0} from nfldb"
+                         .format(unknown_columns))
+
+    query_fields = set()
+    for colname in list(_NFLDB_KEY_COLUMNS) + list(columns):
+        query_fields.update(column_dependencies[colname])
+    return query_fields
+
+
+def _get_sql_field_name(field):
+    """Get the name of a field in a SELECT statement (e.g. "play.pos_team AS offense_team" -> "offense_team")."""
+    return field.split(" AS ")[-1].split(".")[-1]
+
+
+def _make_nfldb_running_score_query(play_query, output_columns,
+                                    yardline_position="(raw_plays.yardline).pos"):
+    """Wrap a play query so that the running scores are computed in the database.
+
+    This is the SQL equivalent of ``_aggregate_nfldb_scores``: the points from each
+    play (including any missing extra points, detected using the yardline of the
+    next play) are assigned to the home or away team and then summed over all prior
+    plays in the game using window functions.
+
+    Parameters
+    ----------
+    play_query : string
+        A query (with no ``ORDER BY`` or trailing semicolon) returning one row per play,
+        including the ``gsis_id``, ``drive_id``, ``play_id``, ``offense_team``,
+        ``home_team``, ``yardline``, ``offense_play_points``, and ``defense_play_points`` columns.
+    output_columns : list of strings
+        The columns of ``play_query`` to return alongside the scores.
+    yardline_position : string (default=``"(raw_plays.yardline).pos"``)
+        The SQL expression giving the numeric yardline of a row of ``play_query``
+        (aliased as ``raw_plays``).
+
+    Returns
+    -------
+    string
+        The query, returning ``output_columns`` plus ``curr_home_score`` and
+        ``curr_away_score``, ordered by ``gsis_id``, ``drive_id``, and ``play_id``.
+    """
+    play_order = "ORDER BY {0}.drive_id, {0}.play_id"
+    game_window = ("OVER (PARTITION BY plays.gsis_id " + play_order.format("plays") +
+                   " ROWS UNBOUNDED PRECEDING)")
+
+    fixed_play_points = ("(plays.{0}_play_points + CASE WHEN plays.{0}_play_points = 6 "
+                         "AND plays.next_yardline < 0 THEN 1 ELSE 0 END)")
+    offense_play_points = fixed_play_points.format("offense")
+    defense_play_points = fixed_play_points.format("defense")
+    home_play_points = ("CASE WHEN plays.offense_team = plays.home_team "
+                        "THEN {0} ELSE {1} END".format(offense_play_points, defense_play_points))
+    away_play_points = ("CASE WHEN plays.offense_team = plays.home_team "
+                        "THEN {0} ELSE {1} END".format(defense_play_points, offense_play_points))
+
+    query_string = "SELECT "
+    query_string += "plays." + ", plays.".join(output_columns)
+    query_string += ", SUM({0}) {1} - {0} AS curr_home_score".format(home_play_points, game_window)
+    query_string += ", SUM({0}) {1} - {0} AS curr_away_score".format(away_play_points, game_window)
+    query_string += (" FROM (SELECT raw_plays.*, LEAD({0}) OVER (PARTITION BY raw_plays.gsis_id {1})"
+                     " AS next_yardline FROM ({2}) AS raw_plays) AS plays"
+                     "".format(yardline_position, play_order.format("raw_plays"), play_query))
+    query_string += " ORDER BY plays.gsis_id, plays.drive_id, plays.play_id;"
+
+    return query_string
@@ -39,7 +39,8 @@ INSTALL_REQUIRES = ['numpy',
 EXTRAS_REQUIRE = {
     "plotting": ["matplotlib"],
     "nfldb": ["nfldb", "sqlalchemy"],
-    "dev": ["matplotlib", "nfldb", "sqlalchemy", "pytest", "pytest-cov", "sphinx", "numpydoc"]
+    "cache": ["pyarrow"],
+    "dev": ["matplotlib", "nfldb", "sqlalchemy", "pyarrow", "pytest", "pytest-cov", "sphinx", "numpydoc"]
     }
 
 PACKAGE_DATA = {"nflwin": ["models/default_model.nflwin*"]}